@@ -0,0 +1,108 @@
+"""Cost of the GaussianHMM M-step for the means under the L1 fusion prior.
+
+Compares the batched local quadratic approximation (LQA) update used by
+``GaussianHMM`` against the previous implementation, which looped over
+features and state pairs in Python, as the number of states and features
+grows. Inputs are random sufficient statistics of the size one EM
+iteration would produce.
+
+Usage::
+
+    $ python devtools/benchmarks/bench_ghmm_fusion_mstep.py [--n_lqa_iter 10]
+"""
+from __future__ import print_function, division
+
+import argparse
+import time
+
+import numpy as np
+
+from msmbuilder.hmm.gaussian import _fused_means
+
+
+def looped_fused_means(means, obs, post, vars, fusion_prior, n_lqa_iter,
+                       difference_cutoff=1e-10):
+    """The previous, per-feature implementation, for reference."""
+    means = np.array(means, dtype=np.float64)
+    n_states, n_features = means.shape
+
+    def getdiff(means):
+        diff = np.zeros((n_features, n_states, n_states))
+        for i in range(n_features):
+            diff[i] = np.maximum(np.abs(np.subtract.outer(
+                means[:, i], means[:, i])), difference_cutoff)
+        return diff
+
+    strength = fusion_prior / getdiff(means)
+    rhs = obs / vars
+    for i in range(n_features):
+        np.fill_diagonal(strength[i], 0)
+
+    break_lqa = False
+    for s in range(n_lqa_iter):
+        diff = getdiff(means)
+        if np.all(diff <= difference_cutoff) or break_lqa:
+            break
+        offdiagonal = -strength / diff
+        diagonal_penalty = np.sum(strength / diff, axis=2)
+        for f in range(n_features):
+            if np.all(diff[f] <= difference_cutoff):
+                continue
+            ridge_approximation = np.diag(
+                post / vars[:, f] + diagonal_penalty[f]) + offdiagonal[f]
+            try:
+                means[:, f] = np.linalg.solve(ridge_approximation, rhs[:, f])
+            except np.linalg.LinAlgError:
+                break_lqa = True
+
+    for i in range(n_features):
+        for k, j in zip(*np.triu_indices(n_states)):
+            if diff[i, k, j] <= difference_cutoff:
+                means[k, i] = means[j, i]
+    return means
+
+
+def make_stats(n_states, n_features, random_state=0):
+    random = np.random.RandomState(random_state)
+    post = random.uniform(10, 1000, size=n_states)
+    means = random.randn(n_states, n_features)
+    obs = means * post[:, np.newaxis]
+    vars = random.uniform(0.5, 1.5, size=(n_states, n_features))
+    return means, obs, post, vars
+
+
+def best_time(fn, n_repeats):
+    times = []
+    for i in range(n_repeats):
+        start = time.time()
+        result = fn()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n_lqa_iter', type=int, default=10)
+    parser.add_argument('--fusion_prior', type=float, default=1e-2)
+    parser.add_argument('--n_repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    print('%8s %10s %14s %14s %9s %12s' % (
+        'n_states', 'n_features', 'looped (ms)', 'batched (ms)', 'speedup',
+        'max diff'))
+    for n_states, n_features in [(4, 4), (8, 8), (16, 16), (32, 16),
+                                 (32, 64), (64, 64)]:
+        means, obs, post, vars = make_stats(n_states, n_features)
+        t_loop, reference = best_time(lambda: looped_fused_means(
+            means, obs, post, vars, args.fusion_prior, args.n_lqa_iter),
+            args.n_repeats)
+        t_batch, result = best_time(lambda: _fused_means(
+            means, obs, post, vars, args.fusion_prior, args.n_lqa_iter),
+            args.n_repeats)
+        print('%8d %10d %14.2f %14.2f %9.1f %12.2e' % (
+            n_states, n_features, 1e3 * t_loop, 1e3 * t_batch,
+            t_loop / t_batch, np.max(np.abs(result - reference))))
+
+
+if __name__ == '__main__':
+    main()
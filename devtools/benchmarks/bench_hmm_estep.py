@@ -0,0 +1,99 @@
+"""Thread scaling of the GaussianHMM E-step.
+
+Each thread count runs in a fresh interpreter with ``OMP_NUM_THREADS`` set,
+and times a fixed number of EM iterations (with a cheap M-step, so the
+E-step dominates) beyond the hot start. Two datasets with the same total
+number of frames are used: many short trajectories, where merging the
+per-trajectory statistics used to serialize the threads, and a few long
+ones.
+
+Usage::
+
+    $ python devtools/benchmarks/bench_hmm_estep.py [--max_threads 8]
+"""
+from __future__ import print_function, division
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from multiprocessing import cpu_count
+
+import numpy as np
+
+DATASETS = ['many-short', 'few-long']
+
+
+def make_data(kind, n_frames_total, n_features, random_state=0):
+    random = np.random.RandomState(random_state)
+    length = 100 if kind == 'many-short' else n_frames_total // 4
+    means = 5 * random.randn(4, n_features)
+    sequences = []
+    for i in range(n_frames_total // length):
+        states = np.repeat(random.randint(4, size=length // 10 + 1), 10)
+        X = means[states[:length]] + random.randn(length, n_features)
+        sequences.append(X)
+    return sequences
+
+
+def worker(args):
+    from msmbuilder.hmm import GaussianHMM
+    sequences = make_data(args.dataset, args.n_frames, args.n_features)
+
+    def timed_fit(n_iter):
+        model = GaussianHMM(n_states=args.n_states, n_init=1, n_iter=n_iter,
+                            thresh=-1, fusion_prior=0,
+                            reversible_type='transpose', random_state=0)
+        start = time.time()
+        model.fit(sequences)
+        return time.time() - start
+
+    # the hot start is the same in both fits, so it cancels out
+    elapsed = timed_fit(1 + args.n_iter) - timed_fit(1)
+    print(json.dumps({'seconds_per_iter': elapsed / args.n_iter}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--max_threads', type=int, default=cpu_count())
+    parser.add_argument('--n_frames', type=int, default=200000)
+    parser.add_argument('--n_features', type=int, default=10)
+    parser.add_argument('--n_states', type=int, default=8)
+    parser.add_argument('--n_iter', type=int, default=5)
+    parser.add_argument('--dataset', choices=DATASETS, help='(internal)')
+    args = parser.parse_args()
+
+    if args.dataset is not None:
+        worker(args)
+        return
+
+    threads = [1]
+    while threads[-1] * 2 <= args.max_threads:
+        threads.append(threads[-1] * 2)
+    if threads[-1] != args.max_threads:
+        threads.append(args.max_threads)
+
+    print('%-12s %8s %16s %10s' % ('dataset', 'threads', 'sec/EM-iter',
+                                   'speedup'))
+    for dataset in DATASETS:
+        baseline = None
+        for n_threads in threads:
+            env = dict(os.environ, OMP_NUM_THREADS=str(n_threads))
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--dataset', dataset,
+                 '--n_frames', str(args.n_frames),
+                 '--n_features', str(args.n_features),
+                 '--n_states', str(args.n_states),
+                 '--n_iter', str(args.n_iter)], env=env)
+            seconds = json.loads(output.decode().splitlines()[-1])[
+                'seconds_per_iter']
+            if baseline is None:
+                baseline = seconds
+            print('%-12s %8d %16.4f %10.2f' % (dataset, n_threads, seconds,
+                                              baseline / seconds))
+
+
+if __name__ == '__main__':
+    main()
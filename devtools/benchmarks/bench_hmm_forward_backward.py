@@ -0,0 +1,84 @@
+"""Accuracy and throughput of the scaled single-precision forward-backward
+algorithm of the HMMs, against the default log-space double-precision one.
+
+For a range of numbers of states, times a fixed number of EM iterations
+beyond the hot start of ``GaussianHMM`` with ``forward_backward='log'`` and
+``forward_backward='scaled'``, and compares the log-likelihood and the state
+posteriors that the two modes compute for the same fitted model.
+
+Usage::
+
+    $ python devtools/benchmarks/bench_hmm_forward_backward.py [--n_features 10]
+"""
+from __future__ import print_function, division
+
+import argparse
+import time
+
+import numpy as np
+
+from msmbuilder.hmm import GaussianHMM
+
+
+def make_data(n_states, n_features, n_frames_total, length, random_state=0):
+    random = np.random.RandomState(random_state)
+    means = 3 * random.randn(n_states, n_features)
+    sequences = []
+    for i in range(n_frames_total // length):
+        states = np.repeat(random.randint(n_states, size=length // 10 + 1), 10)
+        X = means[states[:length]] + random.randn(length, n_features)
+        sequences.append(X)
+    return sequences
+
+
+def seconds_per_iter(sequences, n_states, n_iter, forward_backward):
+    def timed_fit(n):
+        model = GaussianHMM(n_states=n_states, n_init=1, n_iter=n, thresh=-1,
+                            fusion_prior=0, reversible_type='transpose',
+                            random_state=0, forward_backward=forward_backward)
+        start = time.time()
+        model.fit(sequences)
+        return time.time() - start
+
+    # the hot start is the same in both fits, so it cancels out
+    return (timed_fit(1 + n_iter) - timed_fit(1)) / n_iter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n_frames', type=int, default=100000)
+    parser.add_argument('--length', type=int, default=2000)
+    parser.add_argument('--n_features', type=int, default=10)
+    parser.add_argument('--n_iter', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%8s %14s %16s %9s %14s %14s' % (
+        'n_states', 'log (s/iter)', 'scaled (s/iter)', 'speedup',
+        'logprob rel', 'posterior max'))
+    for n_states in [2, 4, 8, 16, 32, 64]:
+        sequences = make_data(n_states, args.n_features, args.n_frames,
+                              args.length)
+        t_log = seconds_per_iter(sequences, n_states, args.n_iter, 'log')
+        t_scaled = seconds_per_iter(sequences, n_states, args.n_iter,
+                                    'scaled')
+
+        model = GaussianHMM(n_states=n_states, n_init=1, n_iter=args.n_iter,
+                            fusion_prior=0, reversible_type='transpose',
+                            random_state=0)
+        model.fit(sequences)
+        scaled = GaussianHMM(n_states=n_states, forward_backward='scaled')
+        scaled.__setstate__(model.__reduce__()[2])
+
+        logprob = model.score(sequences)
+        logprob_error = abs(scaled.score(sequences) - logprob) / abs(logprob)
+        posterior_error = max(
+            np.max(np.abs(a - b)) for a, b in
+            zip(model.predict_proba(sequences),
+                scaled.predict_proba(sequences)))
+        print('%8d %14.4f %16.4f %9.2f %14.2e %14.2e' % (
+            n_states, t_log, t_scaled, t_log / t_scaled, logprob_error,
+            posterior_error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Cost of the HMM E-step and Viterbi decoding with sparse transitions.
+
+For a range of numbers of states, builds a ``GaussianHMM`` whose states are
+arranged on a ring, with a dense reversible transition matrix in which each
+state mostly jumps to its nearest neighbours. This model is compared with
+the same model pruned to ``--max_out_degree`` transitions per state and
+with ``max_out_degree`` set, so that the log-space forward-backward and
+Viterbi recursions only visit the remaining transitions. The emission
+log-likelihoods cost the same in both, so few features are used to expose
+the recursions.
+
+Usage::
+
+    $ python devtools/benchmarks/bench_hmm_sparse_transitions.py [--max_out_degree 4]
+"""
+from __future__ import print_function, division
+
+import argparse
+import time
+
+import numpy as np
+
+from msmbuilder.hmm import GaussianHMM
+from msmbuilder.hmm._transitions import prune_transmat
+
+
+def make_model(n_states, n_features, random_state=0):
+    random = np.random.RandomState(random_state)
+    means = 10 * random.randn(n_states, n_features)
+    vars = np.ones((n_states, n_features))
+    distance = np.abs(np.subtract.outer(np.arange(n_states),
+                                        np.arange(n_states)))
+    distance = np.minimum(distance, n_states - distance)
+    transmat = np.exp(-2.0 * distance)
+    transmat /= transmat.sum(axis=1)[:, np.newaxis]
+    populations = np.ones(n_states) / n_states
+    return means, vars, transmat, populations
+
+
+def sample(means, transmat, n_frames, length, random_state=0):
+    random = np.random.RandomState(random_state)
+    cumulative = np.cumsum(transmat, axis=1)
+    sequences = []
+    for i in range(n_frames // length):
+        states = np.empty(length, dtype=int)
+        states[0] = random.randint(len(means))
+        u = random.rand(length)
+        for t in range(1, length):
+            states[t] = min(np.searchsorted(cumulative[states[t - 1]], u[t]),
+                            len(means) - 1)
+        sequences.append(means[states] + random.randn(length, means.shape[1]))
+    return sequences
+
+
+def best_time(fn, n_repeats):
+    times = []
+    for i in range(n_repeats):
+        start = time.time()
+        result = fn()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n_frames', type=int, default=20000)
+    parser.add_argument('--length', type=int, default=1000)
+    parser.add_argument('--n_features', type=int, default=2)
+    parser.add_argument('--max_out_degree', type=int, default=4)
+    parser.add_argument('--n_repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    print('%8s %8s %14s %14s %9s %14s %14s %9s' % (
+        'n_states', 'nnz/row', 'dense E (s)', 'sparse E (s)', 'speedup',
+        'dense vit (s)', 'sparse vit (s)', 'speedup'))
+    for n_states in [8, 16, 32, 64, 128, 256, 512]:
+        means, vars, transmat, populations = make_model(n_states,
+                                                        args.n_features)
+        sequences = sample(means, transmat, args.n_frames, args.length)
+        pruned, pruned_populations = prune_transmat(
+            transmat, populations, max_out_degree=args.max_out_degree)
+
+        dense = GaussianHMM(n_states=n_states)
+        dense.__setstate__((means, vars, pruned, pruned_populations,
+                            None, None))
+        sparse = GaussianHMM(n_states=n_states,
+                             max_out_degree=args.max_out_degree)
+        sparse.__setstate__((means, vars, pruned, pruned_populations,
+                             None, None))
+
+        t_dense, _ = best_time(lambda: dense._expectation_step(sequences),
+                               args.n_repeats)
+        t_sparse, _ = best_time(lambda: sparse._expectation_step(sequences),
+                                args.n_repeats)
+        v_dense, _ = best_time(lambda: dense.predict(sequences),
+                               args.n_repeats)
+        v_sparse, _ = best_time(lambda: sparse.predict(sequences),
+                                args.n_repeats)
+        print('%8d %8.1f %14.4f %14.4f %9.2f %14.4f %14.4f %9.2f' % (
+            n_states, np.count_nonzero(pruned) / n_states, t_dense, t_sparse,
+            t_dense / t_sparse, v_dense, v_sparse, v_dense / v_sparse))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Throughput and accuracy of tICA accumulation in double vs. mixed precision.
+
+The errors are relative to the eigenvalues from the existing
+double-precision path, fit to float64 copies of the same data in the same
+way. Each precision is timed once with ``fit`` on long float32 sequences and
+once through many small ``partial_fit`` updates.
+
+Usage::
+
+    $ python devtools/benchmarks/bench_tica_precision.py [--n_features 100]
+"""
+from __future__ import print_function, division
+
+import argparse
+import time
+
+import numpy as np
+
+from msmbuilder.decomposition import tICA
+
+
+def make_data(n_sequences, n_frames, n_features, random_state=0):
+    random = np.random.RandomState(random_state)
+    # an AR(1) process with a range of relaxation timescales and an offset,
+    # so that the uncentered second moments are not small
+    phi = np.linspace(0.5, 0.999, n_features)
+    sequences = []
+    for i in range(n_sequences):
+        noise = random.randn(n_frames, n_features)
+        X = np.empty_like(noise)
+        X[0] = noise[0]
+        for t in range(1, n_frames):
+            X[t] = phi * X[t - 1] + noise[t]
+        sequences.append((X + 5.0).astype(np.float32))
+    return sequences
+
+
+def run(sequences, precision, partial_size=None):
+    model = tICA(n_components=10, lag_time=10, shrinkage=0,
+                 precision=precision)
+    start = time.time()
+    if partial_size is None:
+        model.fit(sequences)
+    else:
+        for X in sequences:
+            for i in range(0, len(X), partial_size):
+                model.partial_fit(X[i:i + partial_size])
+    elapsed = time.time() - start
+    return model.eigenvalues_, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n_sequences', type=int, default=10)
+    parser.add_argument('--n_frames', type=int, default=20000)
+    parser.add_argument('--n_features', type=int, default=100)
+    parser.add_argument('--partial_size', type=int, default=100)
+    args = parser.parse_args()
+
+    sequences = make_data(args.n_sequences, args.n_frames, args.n_features)
+    sequences64 = [X.astype(np.float64) for X in sequences]
+    n_total = args.n_sequences * args.n_frames
+
+    print('%-8s %-12s %14s %18s' % ('mode', 'precision', 'frames/sec',
+                                    'max rel. error'))
+    for mode, partial_size in [('fit', None),
+                               ('partial', args.partial_size)]:
+        reference, _ = run(sequences64, 'double', partial_size)
+        for precision in ['double', 'mixed']:
+            vals, elapsed = run(sequences, precision, partial_size)
+            error = np.max(np.abs(vals - reference) / np.abs(reference))
+            print('%-8s %-12s %14.0f %18.3e' % (
+                mode, precision, n_total / elapsed, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Cost of committors and mean first passage times with sparse transition
+matrices.
+
+For a range of numbers of states, builds a reversible transition matrix on a
+ring in which each state only jumps to its ``--n_neighbors`` nearest
+neighbours on either side, and stores it as a CSR matrix. Times
+``_committors``, ``_conditional_committors`` and ``_mfpts`` (to a set of
+sinks) with the sparse LU backend, the iterative backend, and, for the
+sizes where it fits in memory, the dense backend. The second committor
+solve swaps the sources and sinks, so it reuses the cached factorization
+and only pays for the triangular solves.
+
+Usage::
+
+    $ python devtools/benchmarks/bench_tpt_sparse.py [--max_dense 4000]
+"""
+from __future__ import print_function, division
+
+import argparse
+import time
+
+import numpy as np
+import scipy.sparse
+
+from msmbuilder.tpt import _linalg, clear_cache
+from msmbuilder.tpt.committor import _committors, _conditional_committors
+from msmbuilder.tpt.mfpt import _mfpts
+
+
+def make_transmat(n_states, n_neighbors, random_state=0):
+    random = np.random.RandomState(random_state)
+    rows = np.repeat(np.arange(n_states), n_neighbors)
+    offsets = np.tile(np.arange(1, n_neighbors + 1), n_states)
+    cols = (rows + offsets) % n_states
+    weights = random.rand(len(rows))
+    counts = scipy.sparse.coo_matrix((weights, (rows, cols)),
+                                     shape=(n_states, n_states)).tocsr()
+    counts = counts + counts.T + scipy.sparse.identity(n_states)
+    outflow = np.asarray(counts.sum(axis=1)).ravel()
+    transmat = scipy.sparse.diags(1 / outflow).dot(counts).tocsr()
+    return transmat, outflow / outflow.sum()
+
+
+def timed(fn):
+    start = time.time()
+    result = fn()
+    return time.time() - start, result
+
+
+def run(transmat, populations):
+    n_states = transmat.shape[0]
+    source, sink, waypoint = 0, n_states // 2, n_states // 4
+    sinks = np.arange(0, n_states, max(n_states // 10, 1))
+
+    clear_cache()
+    t_committors, committors = timed(
+        lambda: _committors([source], [sink], transmat))
+    t_reused, _ = timed(lambda: _committors([sink], [source], transmat))
+    t_conditional, _ = timed(lambda: _conditional_committors(
+        source, sink, waypoint, transmat))
+    t_mfpts, _ = timed(lambda: _mfpts(transmat, populations, sinks, 1.0))
+    return (t_committors, t_reused, t_conditional, t_mfpts), committors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n_neighbors', type=int, default=3)
+    parser.add_argument('--max_dense', type=int, default=4000)
+    parser.add_argument('--max_iterative', type=int, default=30000)
+    args = parser.parse_args()
+
+    print('%8s %10s %9s %13s %11s %11s %11s %10s' % (
+        'n_states', 'backend', 'nnz/row', 'committor (s)', 'reused (s)',
+        'cond (s)', 'mfpts (s)', 'max error'))
+    for n_states in [1000, 4000, 10000, 30000, 100000]:
+        transmat, populations = make_transmat(n_states, args.n_neighbors)
+        nnz = transmat.nnz / n_states
+
+        times, reference = run(transmat, populations)
+        print('%8d %10s %9.1f %13.4f %11.4f %11.4f %11.4f %10s' % (
+            (n_states, 'sparse LU', nnz) + times + ('-',)))
+
+        if n_states <= args.max_iterative:
+            _linalg.METHOD = 'iterative'
+            try:
+                times, committors = run(transmat, populations)
+            finally:
+                _linalg.METHOD = 'auto'
+            print('%8d %10s %9.1f %13.4f %11.4f %11.4f %11.4f %10.2e' % (
+                (n_states, 'iterative', nnz) + times +
+                (np.max(np.abs(committors - reference)),)))
+
+        if n_states <= args.max_dense:
+            times, committors = run(transmat.toarray(), populations)
+            print('%8d %10s %9.1f %13.4f %11.4f %11.4f %11.4f %10.2e' % (
+                (n_states, 'dense', nnz) + times +
+                (np.max(np.abs(committors - reference)),)))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,7 @@ from sklearn import decomposition as _decomposition
 
 from .base import MultiSequenceDecompositionMixin
 from .ktica import KernelTICA
-from .pca import PCA, SparsePCA, MiniBatchSparsePCA
+from .pca import PCA, SparsePCA, MiniBatchSparsePCA, IncrementalPCA
 from .sparsetica import SparseTICA
 from .tica import tICA
 
@@ -45,7 +45,8 @@ def scdeflate(A, x):
 
 
 def speigh(double[:, ::1] A, double[:, ::1] B, double rho, double eps=1e-6,
-           double tol=1e-8, int maxiter=100, int verbose=False, int method=1):
+           double tol=1e-8, int maxiter=100, int verbose=False, int method=1,
+           x0=None, B_eigh=None):
     """Find a sparse approximate generalized eigenpair.
 
     The generalized eigenvalue equation, :math:`Av = lambda Bv`,
@@ -87,6 +88,16 @@ def speigh(double[:, ::1] A, double[:, ::1] B, double rho, double eps=1e-6,
     method : int
         1: Default ADMM solver.
         2. CVXOPT interior point solver for the QCQP.
+    x0 : np.ndarray, shape=(N,), optional
+        Initial guess for the solution vector, e.g. the solution of the same
+        problem at a nearby value of ``rho``. By default, the solver is
+        initialized from the dominant (unregularized) generalized
+        eigenvector. Entries of ``x0`` which are exactly zero tend to stay
+        zero, so warm starts work best when moving towards larger ``rho``.
+    B_eigh : tuple of (np.ndarray, np.ndarray), optional
+        Precomputed eigenvalues and eigenvectors of ``B``, as returned by
+        ``scipy.linalg.eigh(B)``. ``B`` is unchanged by deflation and by
+        changes in ``rho``, so this decomposition can be reused across calls.
 
     Returns
     -------
@@ -116,20 +127,29 @@ def speigh(double[:, ::1] A, double[:, ::1] B, double rho, double eps=1e-6,
     cdef double f, old_f    # current and old objective function
     cdef double[::1] x      # solution vector to be iterated
     cdef double rho_e = rho / scipy.special.log1p(1/eps)
-    cdef double tau = SPEIGH_TAU_MIN + max(0, -np.min(scipy.linalg.eigvalsh(A)))
+    # only the smallest eigenvalue of A is needed for the majorization
+    cdef double tau = SPEIGH_TAU_MIN + max(0, -scipy.linalg.eigvalsh(
+        A, eigvals=(0, 0))[0])
     f, old_f = np.inf, np.inf
 
     cdef double[::1] Ax = np.empty(N)        # Matrix vector product: dot(A, x)
     cdef double[::1] w = np.empty(N)
     cdef double[::1] b = np.empty(N)
-    # Initialize solver from dominant generalized eigenvector (unregularized
-    # solution)
-    x = scipy.linalg.eigh(A, B, eigvals=(N-1, N-1))[1][:,0]
+    if x0 is None:
+        # Initialize solver from dominant generalized eigenvector
+        # (unregularized solution)
+        x = np.ascontiguousarray(scipy.linalg.eigh(A, B, eigvals=(N-1, N-1))[1][:,0])
+    else:
+        if len(x0) != N:
+            raise ValueError('x0 must have length %d' % N)
+        x = np.array(x0, dtype=np.float64, copy=True)
 
     cdef double[::1] B_eigvals
     cdef double[:, ::1] B_eigvecs
     if method == 1:
-        B_eigvals, B_eigvecs = map(np.ascontiguousarray, scipy.linalg.eigh(B))
+        if B_eigh is None:
+            B_eigh = scipy.linalg.eigh(B)
+        B_eigvals, B_eigvecs = map(np.ascontiguousarray, B_eigh)
 
     for i in range(maxiter):
         old_f = f
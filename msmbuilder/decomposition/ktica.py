@@ -9,10 +9,15 @@
 
 from __future__ import print_function, division, absolute_import
 
+import warnings
+
 import numpy as np
+from sklearn.metrics.pairwise import pairwise_kernels
+from sklearn.utils import check_random_state
 
 from .tica import tICA
 from .kernel_approximation import LandmarkNystroem
+from ..utils import array2d
 
 # -----------------------------------------------------------------------------
 # Code
@@ -63,6 +68,26 @@ class KernelTICA(tICA):
         Custom landmark points for the Nyostroem approximation
     stride : int, optional (default=1)
         Only sample pairs of points from the data according to this stride
+    n_landmarks : int, optional (default=None)
+        Number of landmarks to select when ``landmarks`` is not given. Only
+        used with ``landmark_strategy='kcenters'`` or ``'reservoir'``.
+    landmark_strategy : {'stride', 'kcenters', 'reservoir'}
+        How to choose landmarks when ``landmarks`` is not given.
+            - 'stride' : every (strided) frame that takes part in a
+              time-lagged pair is a landmark, so the basis grows with the
+              size of the dataset.
+            - 'kcenters' : the ``n_landmarks`` cluster centers found by
+              :class:`msmbuilder.cluster.KCenters` on the strided frames.
+            - 'reservoir' : a uniform random sample of ``n_landmarks``
+              strided frames, drawn in a single pass over the data.
+    chunk_size : int, optional (default=None)
+        If given, the kernel features of each sequence are computed in
+        blocks of ``chunk_size`` frames and accumulated directly into the
+        tICA sufficient statistics, so that the full
+        ``(n_frames, n_landmarks)`` kernel matrix is never held in memory.
+    n_jobs : int, optional (default=1)
+        Number of jobs used to evaluate the kernel between frames and
+        landmarks in the chunked mode. -1 means using all processors.
 
     Attributes
     ----------
@@ -105,7 +130,8 @@ class KernelTICA(tICA):
     def __init__(self, n_components=None, lag_time=1, shrinkage=None,
                  kinetic_mapping=False, kernel='rbf', degree=3, gamma=None,
                  coef0=1., stride=1, landmarks=None, random_state=None,
-                 kernel_params=None):
+                 kernel_params=None, n_landmarks=None,
+                 landmark_strategy='stride', chunk_size=None, n_jobs=1):
         self.n_components = n_components
         self.lag_time = lag_time
         self.shrinkage = shrinkage
@@ -118,6 +144,11 @@ class KernelTICA(tICA):
         self.landmarks = landmarks
         self.random_state = random_state
         self.kernel_params = kernel_params
+        self.n_landmarks = n_landmarks
+        self.landmark_strategy = landmark_strategy
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self._nystroem = None
         if kernel_params is None:
             self.kernel_params = {
                                   'kernel': self.kernel,
@@ -131,24 +162,113 @@ class KernelTICA(tICA):
                                          shrinkage=shrinkage,
                                          kinetic_mapping=kinetic_mapping)
 
+    def _strided(self, seq):
+        u = np.arange(seq.shape[0])[self.lag_time::self.stride]
+        v = np.arange(seq.shape[0])[::self.stride][:u.shape[0]]
+        return seq[np.unique((u, v))]
+
     def _gen_landmarks(self, sequences):
-        X = []
+        if self.landmark_strategy == 'stride':
+            return np.concatenate([self._strided(seq) for seq in sequences],
+                                  axis=0)
+
+        if self.landmark_strategy not in ('kcenters', 'reservoir'):
+            raise ValueError("landmark_strategy must be one of 'stride', "
+                             "'kcenters' or 'reservoir'")
+        if self.n_landmarks is None:
+            raise ValueError('n_landmarks is required with '
+                             'landmark_strategy=%r' % self.landmark_strategy)
+
+        if self.landmark_strategy == 'kcenters':
+            from ..cluster import KCenters
+            kcenters = KCenters(n_clusters=self.n_landmarks,
+                                random_state=self.random_state)
+            kcenters.fit([self._strided(seq) for seq in sequences])
+            return kcenters.cluster_centers_
+
+        # Reservoir sampling (Vitter's algorithm R): after seeing n frames,
+        # each of them is in the reservoir with probability n_landmarks / n.
+        random = check_random_state(self.random_state)
+        reservoir = None
+        n_seen = 0
         for seq in sequences:
-            u = np.arange(seq.shape[0])[self.lag_time::self.stride]
-            v = np.arange(seq.shape[0])[::self.stride][:u.shape[0]]
+            X = self._strided(seq)
+            if reservoir is None:
+                reservoir = np.empty((self.n_landmarks, X.shape[1]),
+                                     dtype=X.dtype)
+            n_fill = min(max(self.n_landmarks - n_seen, 0), len(X))
+            reservoir[n_seen:n_seen + n_fill] = X[:n_fill]
+            # once the reservoir is full, the frame with (0-based) index i
+            # replaces a random slot with probability n_landmarks / (i + 1).
+            # Where several frames draw the same slot, the last one wins, as
+            # it would one frame at a time.
+            index = np.arange(n_seen + n_fill, n_seen + len(X))
+            if len(index) > 0:
+                slots = random.randint(0, index + 1)
+                keep = slots < self.n_landmarks
+                reservoir[slots[keep]] = X[n_fill:][keep]
+            n_seen += len(X)
+
+        if n_seen < self.n_landmarks:
+            warnings.warn('only %d frames were available to use as '
+                          'landmarks' % n_seen)
+        return reservoir[:n_seen]
+
+    def _kernel_features(self, X):
+        X = array2d(X)
+        embedded = pairwise_kernels(X, self._nystroem.components_,
+                                    metric=self._nystroem.kernel,
+                                    filter_params=True, n_jobs=self.n_jobs,
+                                    **self._nystroem._get_kernel_params())
+        return np.dot(embedded, self._nystroem.normalization_.T)
 
-            X.append(seq[np.unique((u, v))])
+    def _fit_chunked(self, X):
+        self._initialize(len(self._nystroem.components_))
+        n_frames = len(X)
+        lag = self.lag_time
 
-        return np.concatenate(X, axis=0)
+        if not n_frames > lag:
+            warnings.warn("length of data (%d) is too short for the lag "
+                          "time (%d)" % (n_frames, lag))
+            return
+
+        self.n_observations_ += n_frames
+        self.n_sequences_ += 1
+
+        # the kernel features of the last ``lag`` frames of each chunk are
+        # recomputed at the beginning of the next one
+        self._accumulate_blocks(X, self.chunk_size, self._kernel_features)
+        self._is_dirty = True
+
+    def _transform_chunked(self, X, out=None):
+        if out is None:
+            out = np.empty((len(X), self.n_components))
+        transform = super(KernelTICA, self).transform
+        for start in range(0, len(X), self.chunk_size):
+            sl = slice(start, start + self.chunk_size)
+            transform([self._kernel_features(X[sl])], out=[out[sl]])
+        return out
 
     def fit(self, sequences, y=None):
         if self.landmarks is None:
             self.landmarks = self._gen_landmarks(sequences)
         self._nystroem = LandmarkNystroem(landmarks=self.landmarks,
                                           **self.kernel_params)
-        ksequences = self._nystroem.fit_transform(sequences)
 
-        super(KernelTICA, self).fit(ksequences, y=y)
+        if self.chunk_size is None:
+            ksequences = self._nystroem.fit_transform(sequences)
+            super(KernelTICA, self).fit(ksequences, y=y)
+            return self
+
+        self._nystroem.fit(sequences)
+        self._initialized = False
+        for X in sequences:
+            self._fit_chunked(X)
+
+        if self.n_sequences_ == 0:
+            raise ValueError('All sequences were shorter than '
+                             'the lag time, %d' % self.lag_time)
+        return self
 
     def partial_fit(self, X):
         if self.landmarks is None:
@@ -156,12 +276,22 @@ class KernelTICA(tICA):
         if self._nystroem is None:
             self._nystroem = LandmarkNystroem(landmarks=self.landmarks,
                                               **self.kernel_params)
-            self._nystroem.partial_fit(X)
+            self._nystroem.fit([X])
+
+        if self.chunk_size is not None:
+            self._fit_chunked(X)
+            return self
 
         Y = self._nystroem.partial_transform(X)
 
         super(KernelTICA, self).partial_fit(Y)
+        return self
 
-    def transform(self, sequences):
+    def transform(self, sequences, out=None):
+        if self.chunk_size is not None:
+            if out is None:
+                return [self._transform_chunked(X) for X in sequences]
+            return [self._transform_chunked(X, Y)
+                    for X, Y in zip(sequences, out)]
         ksequences = self._nystroem.transform(sequences)
-        return super(KernelTICA, self).transform(ksequences)
+        return super(KernelTICA, self).transform(ksequences, out=out)
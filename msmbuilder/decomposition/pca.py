@@ -5,11 +5,13 @@
 
 from __future__ import print_function, division, absolute_import
 
+import numpy as np
 from sklearn import decomposition
 
 from .base import MultiSequenceDecompositionMixin
+from ..utils import check_iter_of_sequences
 
-__all__ = ['PCA', 'SparsePCA']
+__all__ = ['PCA', 'SparsePCA', 'IncrementalPCA']
 
 
 class PCA(MultiSequenceDecompositionMixin, decomposition.PCA):
@@ -25,6 +27,195 @@ class PCA(MultiSequenceDecompositionMixin, decomposition.PCA):
         ]).format(**self.__dict__)
 
 
+class IncrementalPCA(MultiSequenceDecompositionMixin,
+                     decomposition.IncrementalPCA):
+    """Incremental principal components analysis (IPCA).
+
+    Linear dimensionality reduction using a singular value decomposition of
+    the data, computed from mini-batches of frames so that the sequences
+    never need to be held in memory at the same time. Unlike ``PCA``, the
+    sequences are not concatenated: ``fit`` streams over them (e.g. over a
+    lazily-loaded ``msmbuilder.dataset``) and ``partial_fit`` updates the
+    model with one more sequence. Float32 input is projected to float32
+    output.
+
+    Parameters
+    ----------
+    n_components : int or None
+        Number of components to keep. If ``n_components`` is ``None``,
+        then ``n_components`` is set to ``n_features``.
+    whiten : bool, optional
+        If True, the projected data are scaled to have unit variance.
+    copy : bool, (default=True)
+        If False, the input batches may be overwritten.
+    batch_size : int or None, (default=None)
+        The number of frames used for each update, and for each block of
+        ``partial_transform``. If ``batch_size`` is ``None``, it is inferred
+        from the data as ``5 * n_features``.
+
+    Attributes
+    ----------
+    components_ : array, shape (n_components, n_features)
+        Components with maximum variance.
+    explained_variance_ : array, shape (n_components,)
+        Variance explained by each of the selected components.
+    explained_variance_ratio_ : array, shape (n_components,)
+        Percentage of variance explained by each of the selected components.
+    mean_ : array, shape (n_features,)
+        Per-feature empirical mean, aggregated over calls to ``partial_fit``.
+    var_ : array, shape (n_features,)
+        Per-feature empirical variance, aggregated over calls to
+        ``partial_fit``.
+    noise_variance_ : float
+        The estimated noise covariance following the Probabilistic PCA model.
+    n_samples_seen_ : int
+        The number of frames processed by the estimator.
+
+    See Also
+    --------
+    PCA, sklearn.decomposition.IncrementalPCA
+
+    Examples
+    --------
+    >>> diheds = dataset('diheds')
+    >>> pca = diheds.fit_transform_with(IncrementalPCA(n_components=5), 'pca')
+    """
+
+    def _batch_size(self, n_features):
+        if self.batch_size is None:
+            return 5 * n_features
+        return self.batch_size
+
+    def _reset(self):
+        # sklearn's partial_fit() starts from scratch when these are absent
+        for attr in ('components_', 'n_samples_seen_', 'mean_', 'var_'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
+    def fit(self, sequences, y=None):
+        """Fit the model with a collection of sequences.
+
+        Any state accumulated from previous calls to fit() or partial_fit()
+        will be cleared. The frames of all the sequences are streamed
+        through the model in batches of ``batch_size``.
+
+        Parameters
+        ----------
+        sequences : list of array-like, each of shape (n_samples_i, n_features)
+            Training data, where n_samples_i in the number of samples
+            in sequence i and n_features is the number of features.
+        y : None
+            Ignored
+
+        Returns
+        -------
+        self
+        """
+        check_iter_of_sequences(sequences, max_iter=3)  # we might be lazy-loading
+        self._reset()
+        s = super(MultiSequenceDecompositionMixin, self)
+
+        # Batches of ``batch_size`` frames are sliced from each sequence,
+        # and the fewer than ``batch_size`` frames left over at its end are
+        # carried into the next one. The last batch is held back and merged
+        # with the final leftover, so that no update is smaller than
+        # ``batch_size``. Both are copied, so that only one sequence at a
+        # time is referenced.
+        leftover, pending, batch_size = None, None, None
+        for X in sequences:
+            if batch_size is None:
+                batch_size = self._batch_size(X.shape[1])
+            batches, start = [], 0
+            if leftover is not None and len(leftover) > 0:
+                start = batch_size - len(leftover)
+                head = np.concatenate([leftover, X[:start]])
+                if len(head) < batch_size:
+                    leftover = head
+                    continue
+                batches.append(head)
+            stop = start + (len(X) - start) // batch_size * batch_size
+            batches.extend(X[i:i + batch_size]
+                           for i in range(start, stop, batch_size))
+            for batch in batches:
+                if pending is not None:
+                    s.partial_fit(pending)
+                pending = batch
+            if batches:
+                pending = np.array(pending)
+            leftover = np.array(X[stop:])
+
+        final = [b for b in (pending, leftover) if b is not None and len(b)]
+        if not final:
+            raise ValueError('sequences must contain at least one frame')
+        s.partial_fit(np.concatenate(final))
+        return self
+
+    def partial_fit(self, X, y=None):
+        """Update the model with a single sequence.
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+            Training data, where n_samples in the number of samples
+            and n_features is the number of features.
+        y : None
+            Ignored
+
+        Returns
+        -------
+        self
+        """
+        s = super(MultiSequenceDecompositionMixin, self)
+        for sl in _batches(len(X), self._batch_size(X.shape[1])):
+            s.partial_fit(X[sl])
+        return self
+
+    def partial_transform(self, sequence):
+        """Apply dimensionality reduction to single sequence
+
+        The sequence is projected in blocks of ``batch_size`` frames, so that
+        ``sequence`` can be e.g. a memory-mapped array.
+
+        Parameters
+        ----------
+        sequence: array like, shape (n_samples, n_features)
+            A single sequence to transform
+
+        Returns
+        -------
+        out : array like, shape (n_samples, n_components)
+        """
+        dtype = getattr(sequence, 'dtype', np.float64)
+        if dtype not in (np.float32, np.float64):
+            dtype = np.float64
+
+        s = super(MultiSequenceDecompositionMixin, self)
+        out = np.empty((len(sequence), len(self.components_)), dtype=dtype)
+        for sl in _batches(len(sequence), self._batch_size(sequence.shape[1])):
+            out[sl] = s.transform(sequence[sl])
+        return out
+
+    def summarize(self):
+        return '\n'.join([
+            "Incremental Principal Component Analysis (IPCA)",
+            "----------",
+            "Number of components:     {n_components}",
+            "Batch size:               {batch_size}",
+            "Explained variance ratio: {explained_variance_ratio_}",
+            "Noise variance:           {noise_variance_}",
+        ]).format(**self.__dict__)
+
+
+def _batches(n_samples, batch_size):
+    """Slices of ``batch_size`` rows covering ``n_samples`` rows. A short
+    final batch is merged into the previous one."""
+    starts = list(range(0, n_samples, batch_size))
+    if len(starts) > 1 and n_samples - starts[-1] < batch_size:
+        starts.pop()
+    ends = starts[1:] + [n_samples]
+    return [slice(a, b) for a, b in zip(starts, ends)]
+
+
 class SparsePCA(MultiSequenceDecompositionMixin, decomposition.SparsePCA):
     __doc__ = decomposition.SparsePCA.__doc__
 
@@ -11,6 +11,7 @@ from __future__ import print_function, division, absolute_import
 from six import PY2
 import numpy as np
 import scipy.linalg
+from sklearn.externals.joblib import Parallel, delayed, cpu_count
 from .tica import tICA
 from ..utils import experimental, array2d
 from ._speigh import speigh, scdeflate
@@ -131,36 +132,118 @@ class SparseTICA(tICA):
         self.maxiter = maxiter
         self.verbose = verbose
 
+        # rho and (unsorted) solution of the last sparse solve, which are
+        # used to warm start the solver when only rho changes
+        self._solved_rho = None
+        self._warm_start = None
+
     def _solve(self):
-        if not self._is_dirty:
+        if not self._is_dirty and self._solved_rho == self.rho:
             return
 
         if self.rho <= 0:
             # if no sparse regularization, it's just regular tICA
+            if self._solved_rho != self.rho:
+                self._is_dirty = True
+            self._solved_rho = self.rho
             return super(SparseTICA, self)._solve()
 
         A = self.offset_correlation_
         B = self.covariance_
 
-        self._eigenvalues_ = np.zeros((self.n_components))
-        self._eigenvectors_ = np.zeros((self.n_features, self.n_components))
-
-        for i in range(self.n_components):
-            u, v = speigh(A, B, rho=self.rho, eps=self.epsilon,
-                          tol=self.tolerance, maxiter=self.maxiter,
-                          verbose=self.verbose)
+        # zeros are sticky in the solver, so only warm start towards sparser
+        # solutions
+        x0 = None
+        if (not self._is_dirty and self._warm_start is not None and
+                self._solved_rho is not None and
+                0 < self._solved_rho < self.rho):
+            x0 = self._warm_start
 
-            self._eigenvalues_[i] = u
-            self._eigenvectors_[:, i] = v
-            A = scdeflate(A, v)
+        vals, vecs = _sparse_generalized_eigh(
+            A, B, self.rho, self.n_components, x0=x0, **self._solver_params())
+        self._warm_start = vecs
 
         # sort in order of decreasing value
-        ind = np.argsort(self._eigenvalues_)[::-1]
-        self._eigenvalues_ = self._eigenvalues_[ind]
-        self._eigenvectors_ = self._eigenvectors_[:, ind]
+        ind = np.argsort(vals)[::-1]
+        self._eigenvalues_ = vals[ind]
+        self._eigenvectors_ = vecs[:, ind]
 
+        self._solved_rho = self.rho
         self._is_dirty = False
 
+    def _solver_params(self):
+        return dict(eps=self.epsilon, tol=self.tolerance,
+                    maxiter=self.maxiter, verbose=self.verbose)
+
+    def regularization_path(self, rhos, warm_start=True, n_jobs=1):
+        """Compute sparse tICs for a sequence of regularization strengths.
+
+        The model must already be fit. The covariance matrices are computed
+        once and shared by every value of ``rho``. With ``warm_start``, the
+        values of ``rho`` are visited in increasing order and the solver for
+        each one is initialized from the solution at the previous, smaller,
+        ``rho``, which typically needs only a handful of iterations.
+
+        Parameters
+        ----------
+        rhos : array-like, shape (n_rhos,)
+            Positive regularization strengths.
+        warm_start : bool, default=True
+            Initialize the solver at each ``rho`` from the previous solution.
+        n_jobs : int, default=1
+            Number of jobs to run in parallel using joblib.Parallel. With
+            ``warm_start``, the sorted path is split into ``n_jobs``
+            contiguous segments, each of which is warm started from its own
+            first solution.
+
+        Returns
+        -------
+        eigenvalues : array, shape (n_rhos, n_components)
+            Psuedo-eigenvalues at each ``rho``, in decreasing order.
+        eigenvectors : array, shape (n_rhos, n_features, n_components)
+            Sparse psuedo-eigenvectors at each ``rho``.
+
+        Notes
+        -----
+        The results are returned in the order of ``rhos``. The state of the
+        model (including ``rho``) is not changed.
+        """
+        if not self.n_observations_:
+            raise RuntimeError('The model must be fit() before use.')
+        rhos = np.asarray(rhos, dtype=float)
+        if rhos.ndim != 1 or np.any(rhos <= 0):
+            raise ValueError('rhos must be a 1D array of positive numbers')
+
+        A = self.offset_correlation_
+        B = self.covariance_
+        B_eigh = scipy.linalg.eigh(B)
+        params = self._solver_params()
+
+        order = np.argsort(rhos)
+        if warm_start:
+            if n_jobs < 0:
+                n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+            n_segments = min(n_jobs, len(rhos))
+            segments = np.array_split(rhos[order], n_segments)
+        else:
+            segments = [[r] for r in rhos[order]]
+
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(_sparse_generalized_eigh_path)(
+                A, B, segment, self.n_components, B_eigh=B_eigh, **params)
+            for segment in segments)
+        results = [r for segment in results for r in segment]
+
+        eigenvalues = np.zeros((len(rhos), self.n_components))
+        eigenvectors = np.zeros((len(rhos), self.n_features,
+                                 self.n_components))
+        for i, (vals, vecs) in zip(order, results):
+            ind = np.argsort(vals)[::-1]
+            eigenvalues[i] = vals[ind]
+            eigenvectors[i] = vecs[:, ind]
+
+        return eigenvalues, eigenvectors
+
     def summarize(self):
         """Some summary information."""
         nonzeros = np.sum(np.abs(self.eigenvectors_) > 0, axis=0)
@@ -188,3 +271,45 @@ Number of active degrees of freedom:
            kinetic_mapping=self.kinetic_mapping,
            timescales=self.timescales_[:5], eigenvalues=self.eigenvalues_[:5],
            n_features=self.n_features, active=active)
+
+
+def _sparse_generalized_eigh(A, B, rho, n_components, x0=None, B_eigh=None,
+                             **kwargs):
+    """Find ``n_components`` sparse generalized eigenpairs of (A, B) by
+    repeated calls to ``speigh`` followed by Schur complement deflation.
+
+    The eigenpairs are returned in the order in which they were found. If
+    ``x0`` is given, column ``i`` is used as the initial guess for the
+    ``i``-th call to ``speigh``, unless it is all zero (a fixed point of the
+    solver).
+    """
+    if B_eigh is None:
+        B_eigh = scipy.linalg.eigh(B)
+
+    n_features = len(A)
+    vals = np.zeros(n_components)
+    vecs = np.zeros((n_features, n_components))
+
+    for i in range(n_components):
+        x0_i = None
+        if x0 is not None and np.any(x0[:, i] != 0):
+            x0_i = x0[:, i]
+        u, v = speigh(A, B, rho=rho, x0=x0_i, B_eigh=B_eigh, **kwargs)
+        vals[i] = u
+        vecs[:, i] = v
+        A = scdeflate(A, v)
+
+    return vals, vecs
+
+
+def _sparse_generalized_eigh_path(A, B, rhos, n_components, **kwargs):
+    """Solve the sparse generalized eigenproblem for each value in ``rhos``,
+    initializing the solver at each step from the previous solution."""
+    results = []
+    x0 = None
+    for rho in rhos:
+        vals, vecs = _sparse_generalized_eigh(A, B, rho, n_components,
+                                              x0=x0, **kwargs)
+        x0 = vecs
+        results.append((vals, vecs))
+    return results
@@ -11,6 +11,8 @@ from __future__ import print_function, division, absolute_import
 import numpy as np
 import scipy.linalg
 import warnings
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from ..base import BaseEstimator
 from ..utils import check_iter_of_sequences, array2d
 from sklearn.base import TransformerMixin
@@ -44,6 +46,12 @@ class tICA(BaseEstimator, TransformerMixin):
     kinetic_mapping : bool, default=False
         If True, weigh the projections by the tICA eigenvalues, yielding
          kinetic distances as described in [6].
+    precision : {'double', 'mixed'}, default='double'
+        Precision of the accumulated correlation matrices. With 'double',
+        every sequence is converted to float64. With 'mixed', sequences are
+        processed in blocks of frames in float32 (halving the memory
+        traffic of the matrix products), and the block results are summed
+        into float64 accumulators with Kahan (compensated) summation.
 
     Attributes
     ----------
@@ -99,13 +107,23 @@ class tICA(BaseEstimator, TransformerMixin):
            (2015)
     """
 
+    # number of frames projected at a time by transform()
+    _TRANSFORM_CHUNK_SIZE = 2**14
+    # number of time-lagged pairs accumulated at a time with precision='mixed'
+    _ACCUMULATE_CHUNK_SIZE = 2**12
+    # the sufficient statistics, in the order they are computed by _accumulate
+    _ACCUMULATORS = ('_outer_0_to_T_lagged', '_sum_0_to_TminusTau',
+                     '_sum_tau_to_T', '_sum_0_to_T', '_outer_0_to_TminusTau',
+                     '_outer_offset_to_T')
+
     def __init__(self, n_components=None, lag_time=1, shrinkage=None,
-                 kinetic_mapping=False):
+                 kinetic_mapping=False, precision='double'):
         self.n_components = n_components
         self.lag_time = lag_time
         self.shrinkage = shrinkage
         self.shrinkage_ = None
         self.kinetic_mapping = kinetic_mapping
+        self.precision = precision
 
         self.n_features = None
         self.n_observations_ = None
@@ -126,12 +144,16 @@ class tICA(BaseEstimator, TransformerMixin):
         self._outer_0_to_TminusTau = None
         # X[self.lag_time:].T dot X[self.lag_time:]
         self._outer_offset_to_T = None
+        # Kahan compensation terms for each of the above, with precision='mixed'
+        self._compensation = None
 
         # the tICs themselves
         self._components_ = None
         # Cached results of the eigendecompsition
         self._eigenvectors_ = None
         self._eigenvalues_ = None
+        # Cached projection used by transform(). See _projection()
+        self._projection_cache = None
 
         # are our current tICs dirty? this indicates that we've updated
         # the model with more data since the last time we computed components_,
@@ -153,6 +175,8 @@ class tICA(BaseEstimator, TransformerMixin):
         self._sum_0_to_T = np.zeros(n_features)
         self._outer_0_to_TminusTau = np.zeros((n_features, n_features))
         self._outer_offset_to_T = np.zeros((n_features, n_features))
+        self._compensation = [np.zeros_like(getattr(self, name))
+                              for name in self._ACCUMULATORS]
         self._initialized = True
 
     def _solve(self):
@@ -300,7 +324,35 @@ class tICA(BaseEstimator, TransformerMixin):
         self._fit(X)
         return self
 
-    def transform(self, sequences):
+    def _projection(self):
+        """The projection as an affine map, ``transform(X) = dot(X, W) + b``.
+
+        The mean is folded into the offset ``b = -dot(means_, W)`` and, with
+        ``kinetic_mapping``, the eigenvalues are folded into the columns of
+        ``W``. The result is cached until the eigenvectors, ``n_components``
+        or ``kinetic_mapping`` change.
+
+        Returns
+        -------
+        W : array, shape (n_features, n_components)
+        b : array, shape (n_components,)
+        """
+        self._solve()
+        key = (self._eigenvectors_, self.n_components, self.kinetic_mapping)
+        cache = self._projection_cache
+        if (cache is not None and cache[0] is key[0] and
+                cache[1:3] == key[1:]):
+            return cache[3], cache[4]
+
+        W = np.array(self.components_.T, order='C')
+        if self.kinetic_mapping:
+            W *= self.eigenvalues_
+        b = -np.dot(self.means_, W)
+
+        self._projection_cache = key + (W, b)
+        return W, b
+
+    def transform(self, sequences, out=None, n_jobs=1):
         """Apply the dimensionality reduction on X.
 
         Parameters
@@ -308,6 +360,12 @@ class tICA(BaseEstimator, TransformerMixin):
         sequences: list of array-like, each of shape (n_samples_i, n_features)
             Training data, where n_samples_i in the number of samples
             in sequence i and n_features is the number of features.
+        out : list of array, each of shape (n_samples_i, n_components), optional
+            Preallocated arrays (e.g. memory-mapped files) into which the
+            projected sequences are written.
+        n_jobs : int, default=1
+            Number of threads used to project blocks of frames. -1 means
+            using all processors.
 
         Returns
         -------
@@ -315,22 +373,45 @@ class tICA(BaseEstimator, TransformerMixin):
 
         """
         check_iter_of_sequences(sequences, max_iter=3)  # we might be lazy-loading
-        sequences_new = []
+        W, b = self._projection()
+        n_components = W.shape[1]
+        chunk = self._TRANSFORM_CHUNK_SIZE
 
-        for X in sequences:
-            X = array2d(X)
-            if self.means_ is not None:
-                X = X - self.means_
-            X_transformed = np.dot(X, self.components_.T)
-
-            if self.kinetic_mapping:
-                X_transformed *= self.eigenvalues_
+        if n_jobs < 0:
+            n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+        pool = ThreadPool(n_jobs) if n_jobs > 1 else None
 
-            sequences_new.append(X_transformed)
+        sequences_new = []
+        try:
+            for i, X in enumerate(sequences):
+                if out is None:
+                    Y = np.empty((len(X), n_components))
+                else:
+                    Y = out[i]
+                    if Y.shape != (len(X), n_components):
+                        raise ValueError(
+                            'out[%d] has shape %s, but should be %s' % (
+                                i, Y.shape, (len(X), n_components)))
+
+                # the BLAS call releases the GIL, so blocks of frames can be
+                # projected concurrently
+                blocks = [slice(start, start + chunk)
+                          for start in range(0, len(X), chunk)]
+                project = lambda sl: _project(X[sl], W, b, Y[sl])
+                if pool is None or len(blocks) == 1:
+                    for sl in blocks:
+                        project(sl)
+                else:
+                    pool.map(project, blocks)
+
+                sequences_new.append(Y)
+        finally:
+            if pool is not None:
+                pool.close()
 
         return sequences_new
 
-    def partial_transform(self, features):
+    def partial_transform(self, features, out=None):
         """Apply the dimensionality reduction on X.
 
         Parameters
@@ -339,6 +420,8 @@ class tICA(BaseEstimator, TransformerMixin):
             Training data, where n_samples in the number of samples
             and n_features is the number of features.  This function
             acts on a single featurized trajectory.
+        out : array, shape (n_samples, n_components), optional
+            Preallocated array into which the projection is written.
 
         Returns
         -------
@@ -351,7 +434,9 @@ class tICA(BaseEstimator, TransformerMixin):
 
         """
         sequences = [features]
-        return self.transform(sequences)[0]
+        if out is not None:
+            out = [out]
+        return self.transform(sequences, out=out)[0]
 
     def fit_transform(self, sequences, y=None):
         """Fit the model with X and apply the dimensionality reduction on X.
@@ -376,7 +461,12 @@ class tICA(BaseEstimator, TransformerMixin):
         return self.transform(sequences)
 
     def _fit(self, X):
-        X = np.asarray(array2d(X), dtype=np.float64)
+        if self.precision == 'double':
+            X = np.asarray(array2d(X), dtype=np.float64)
+        elif self.precision == 'mixed':
+            X = np.asarray(array2d(X), dtype=np.float32)
+        else:
+            raise ValueError("precision must be one of 'double' or 'mixed'")
         self._initialize(X.shape[1])
 
         # We don't need to scream and shout here. Just ignore this data.
@@ -387,15 +477,53 @@ class tICA(BaseEstimator, TransformerMixin):
         self.n_observations_ += X.shape[0]
         self.n_sequences_ += 1
 
-        self._outer_0_to_T_lagged += np.dot(X[:-self.lag_time].T, X[self.lag_time:])
-        self._sum_0_to_TminusTau += X[:-self.lag_time].sum(axis=0)
-        self._sum_tau_to_T += X[self.lag_time:].sum(axis=0)
-        self._sum_0_to_T += X.sum(axis=0)
-        self._outer_0_to_TminusTau += np.dot(X[:-self.lag_time].T, X[:-self.lag_time])
-        self._outer_offset_to_T += np.dot(X[self.lag_time:].T, X[self.lag_time:])
-
+        if self.precision == 'double':
+            self._accumulate(X[:-self.lag_time], X[self.lag_time:], X)
+        else:
+            self._accumulate_blocks(X, self._ACCUMULATE_CHUNK_SIZE)
         self._is_dirty = True
 
+    def _accumulate_blocks(self, X, block_size, featurize=None):
+        """Accumulate the sequence ``X`` in blocks of ``block_size``
+        time-lagged pairs, optionally applying ``featurize`` to each block
+        of frames first.
+        """
+        # Each block covers the pairs (t, t + lag) for t in [start, stop),
+        # so the last ``lag`` frames of a block are also the first frames
+        # of the next one.
+        lag = self.lag_time
+        n_pairs = len(X) - lag
+        for start in range(0, n_pairs, block_size):
+            stop = min(start + block_size, n_pairs)
+            Y = X[start:stop + lag]
+            if featurize is not None:
+                Y = featurize(Y)
+            Y_new = Y if stop == n_pairs else Y[:stop - start]
+            self._accumulate(Y[:stop - start], Y[lag:], Y_new)
+
+    def _accumulate(self, X_0, X_tau, X_new):
+        """Add a block of time-lagged pairs to the sufficient statistics.
+
+        Row ``i`` of ``X_0`` and row ``i`` of ``X_tau`` are ``lag_time``
+        frames apart. ``X_new`` holds the frames that have not yet been
+        counted in ``_sum_0_to_T``. A single sequence can therefore be
+        accumulated in several (overlapping) chunks.
+        """
+        if self.precision == 'mixed':
+            X_0, X_tau, X_new = [np.asarray(A, dtype=np.float32)
+                                 for A in (X_0, X_tau, X_new)]
+
+        terms = (np.dot(X_0.T, X_tau), X_0.sum(axis=0), X_tau.sum(axis=0),
+                 X_new.sum(axis=0), np.dot(X_0.T, X_0), np.dot(X_tau.T, X_tau))
+
+        if self.precision == 'mixed':
+            for name, comp, term in zip(self._ACCUMULATORS,
+                                        self._compensation, terms):
+                _kahan_add(getattr(self, name), comp, term)
+        else:
+            for name, term in zip(self._ACCUMULATORS, terms):
+                getattr(self, name)[...] += term
+
     def score(self, sequences, y=None):
         """Score the model on new data using the generalized matrix Rayleigh quotient
 
@@ -462,6 +590,25 @@ Top 5 eigenvalues :
            timescales=self.timescales_[:5], eigenvalues=self.eigenvalues_[:5])
 
 
+def _kahan_add(total, compensation, term):
+    """total += term, in place, with Kahan compensated summation"""
+    y = term - compensation
+    t = total + y
+    compensation[...] = (t - total) - y
+    total[...] = t
+
+
+def _project(X, W, b, out):
+    """out = dot(X, W) + b, without temporaries when ``out`` allows it"""
+    X = array2d(X)
+    if (out.flags.c_contiguous and
+            out.dtype == np.result_type(X.dtype, W.dtype)):
+        np.dot(X, W, out=out)
+    else:
+        out[...] = np.dot(X, W)
+    out += b
+
+
 def rao_blackwell_ledoit_wolf(S, n):
     """Rao-Blackwellized Ledoit-Wolf shrinkaged estimator of the covariance
     matrix.
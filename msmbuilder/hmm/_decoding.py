@@ -0,0 +1,102 @@
+# Author: MSMBuilder Developers
+# Contributors:
+# Copyright (c) 2026, Stanford University and the Authors
+# All rights reserved.
+
+"""Batch decoding (Viterbi paths and state posteriors) with the HMMs."""
+
+from __future__ import absolute_import, division
+
+import numpy as np
+
+__all__ = ['decode_in_chunks']
+
+
+def decode_in_chunks(decode_chunk, sequences, n_states, posteriors=False,
+                     states_out=None, posteriors_out=None, chunk_size=256):
+    """Decode a collection of sequences a chunk at a time.
+
+    Only ``chunk_size`` sequences (and their outputs) are held in memory at
+    once, so ``sequences`` and the outputs can be on-disk datasets.
+
+    Parameters
+    ----------
+    decode_chunk : callable
+        ``decode_chunk(arrays, states, posteriors)`` decodes the list of
+        arrays, writing the Viterbi path of ``arrays[i]`` into ``states[i]``
+        and, unless ``posteriors`` is None, the state posteriors into
+        ``posteriors[i]``. It returns the log probability of each Viterbi
+        path.
+    sequences : list of arrays, or dataset
+        The sequences to decode. Datasets (anything with a ``keys()`` method)
+        are read one key at a time.
+    n_states : int
+        Number of states of the model.
+    posteriors : bool, default=False
+        Whether to compute the posteriors. Implied by ``posteriors_out``.
+    states_out, posteriors_out : list, dataset or None
+        Where to store the outputs. A list is indexed by the position of the
+        sequence, and any other container (e.g. a dataset opened for writing)
+        by its key. If ``states_out[i]`` is already a C-contiguous, writeable
+        array with the right shape and dtype (int32 for the states, float64
+        for the posteriors), for instance a view of a ``np.memmap``, the
+        output is written into it in place.
+    chunk_size : int, default=256
+        Number of sequences decoded together.
+
+    Returns
+    -------
+    logprob : np.ndarray, shape=(n_sequences,)
+        Log probability of the Viterbi path of each sequence.
+    states_out : list or container
+    posteriors_out : list, container or None
+    """
+    if hasattr(sequences, 'keys'):
+        keys = list(sequences.keys())
+    else:
+        keys = list(range(len(sequences)))
+    posteriors = posteriors or posteriors_out is not None
+    if states_out is None:
+        states_out = [None] * len(keys)
+    if posteriors and posteriors_out is None:
+        posteriors_out = [None] * len(keys)
+
+    logprob = np.zeros(len(keys))
+    for start in range(0, len(keys), chunk_size):
+        chunk = range(start, min(start + chunk_size, len(keys)))
+        arrays = [sequences[keys[i]] for i in chunk]
+        states = [_output_buffer(states_out, i, (len(arrays[n]),),
+                                 np.int32) for n, i in enumerate(chunk)]
+        if posteriors:
+            post = [_output_buffer(posteriors_out, i,
+                                   (len(arrays[n]), n_states), np.float64)
+                    for n, i in enumerate(chunk)]
+        else:
+            post = None
+
+        logprob[start:start + len(chunk)] = decode_chunk(arrays, states, post)
+
+        for n, i in enumerate(chunk):
+            _store(states_out, keys, i, states[n])
+            if posteriors:
+                _store(posteriors_out, keys, i, post[n])
+    return logprob, states_out, posteriors_out
+
+
+def _output_buffer(out, i, shape, dtype):
+    """The array in `out` for sequence `i` if it can be written in place,
+    otherwise a new one."""
+    if isinstance(out, list):
+        existing = out[i]
+        if (isinstance(existing, np.ndarray) and existing.shape == shape
+                and existing.dtype == dtype
+                and existing.flags.c_contiguous and existing.flags.writeable):
+            return existing
+    return np.empty(shape, dtype=dtype)
+
+
+def _store(out, keys, i, array):
+    if isinstance(out, list):
+        out[i] = array
+    else:
+        out[keys[i]] = array
@@ -0,0 +1,125 @@
+# Author: MSMBuilder Developers
+# Contributors:
+# Copyright (c) 2026, Stanford University and the Authors
+# All rights reserved.
+
+"""Scheduling of the independent EM restarts (``n_init``) of the HMMs."""
+
+from __future__ import absolute_import, division
+
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+__all__ = ['RestartMonitor', 'run_restarts']
+
+
+class RestartMonitor(object):
+    """Track the log-likelihood of concurrent EM restarts and decide when
+    a restart trails the others badly enough to be abandoned.
+
+    A restart is pruned at iteration ``i`` if its log-likelihood is more
+    than ``margin`` below the best log-likelihood any other restart has
+    reached at iteration ``i`` (a restart that converged before iteration
+    ``i`` contributes its final value). EM never decreases the likelihood,
+    so a pruned restart would have to gain more than ``margin`` on the
+    leader to win.
+
+    Parameters
+    ----------
+    margin : float or None
+        Log-likelihood deficit that triggers pruning. If None, restarts are
+        never pruned.
+    min_iter : int, default=2
+        Number of EM iterations every restart runs before it can be pruned.
+    """
+
+    def __init__(self, margin=None, min_iter=2):
+        self.margin = margin
+        self.min_iter = min_iter
+        self._traces = {}
+        self._finished = set()
+        self._pruned = set()
+        self._lock = threading.Lock()
+
+    def should_stop(self, run, log_probability):
+        """Record the log-likelihood trace of restart ``run`` and return
+        whether it should stop now."""
+        log_probability = np.array(log_probability, dtype=np.float64)
+        with self._lock:
+            self._traces[run] = log_probability
+            i = len(log_probability) - 1
+            if self.margin is None or i < self.min_iter:
+                return False
+
+            reference = -np.inf
+            for other, trace in self._traces.items():
+                if other == run:
+                    continue
+                if len(trace) > i:
+                    reference = max(reference, trace[i])
+                elif other in self._finished:
+                    reference = max(reference, trace[-1])
+
+            if log_probability[-1] < reference - self.margin:
+                self._pruned.add(run)
+                return True
+            return False
+
+    def finish(self, run, log_probability):
+        """Record the final log-likelihood trace of restart ``run``."""
+        with self._lock:
+            self._traces[run] = np.array(log_probability, dtype=np.float64)
+            if run not in self._pruned:
+                self._finished.add(run)
+
+    @property
+    def n_pruned(self):
+        return len(self._pruned)
+
+    def best(self):
+        """Index of the restart with the highest final log-likelihood.
+
+        Restarts that ran to completion are preferred over pruned ones.
+        """
+        candidates = self._finished or set(self._traces)
+        return max(sorted(candidates), key=lambda run: self._traces[run][-1])
+
+
+def run_restarts(fit_one, n_init, n_jobs=1):
+    """Call ``fit_one(run)`` for each restart, possibly concurrently.
+
+    The restarts run in a thread pool, so they share the (read-only) input
+    sequences without copying them. This only gives a speedup if
+    ``fit_one`` releases the GIL for the bulk of its work, as the C++ EM
+    loop of the HMMs does.
+
+    Parameters
+    ----------
+    fit_one : callable
+        Called with the index of the restart, in ``range(n_init)``.
+    n_init : int
+        Number of restarts.
+    n_jobs : int, default=1
+        Number of restarts to run at the same time. If negative,
+        ``cpu_count() + 1 + n_jobs`` are used.
+
+    Returns
+    -------
+    results : list
+        The return values of ``fit_one``, in order of the restart index.
+    """
+    if n_jobs < 0:
+        n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+    n_jobs = min(n_jobs, n_init)
+    if n_jobs <= 1:
+        return [fit_one(run) for run in range(n_init)]
+
+    pool = ThreadPool(n_jobs)
+    try:
+        return pool.map(fit_one, range(n_init), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
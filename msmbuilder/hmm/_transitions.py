@@ -0,0 +1,82 @@
+# Author: MSMBuilder Developers
+# Contributors:
+# Copyright (c) 2026, Stanford University and the Authors
+# All rights reserved.
+
+"""Sparsification of the transition matrices of the HMMs."""
+
+from __future__ import absolute_import, division
+
+import numpy as np
+
+__all__ = ['prune_transmat']
+
+
+def prune_transmat(transmat, populations, threshold=0.0, max_out_degree=None):
+    """Drop the negligible transitions of a reversible transition matrix.
+
+    A pair of states stays connected only if the larger of its two
+    transition probabilities is at least ``threshold``. With
+    ``max_out_degree``, the candidates are the remaining pairs among the
+    ``max_out_degree`` largest equilibrium fluxes out of either state. They
+    are considered in order of decreasing flux, and each is kept only while
+    both of its states have fewer than ``max_out_degree`` other
+    connections. Self-transitions are always kept. The flux through the
+    remaining pairs is renormalized, so the pruned matrix still satisfies
+    detailed balance.
+
+    Parameters
+    ----------
+    transmat : np.ndarray, shape=(n_states, n_states)
+        Reversible transition matrix.
+    populations : np.ndarray, shape=(n_states,)
+        Its stationary distribution.
+    threshold : float, default=0
+        Transition probability below which a pair is disconnected.
+    max_out_degree : int, optional
+        Maximum number of transitions out of each state, besides the
+        self-transition.
+
+    Returns
+    -------
+    transmat : np.ndarray, shape=(n_states, n_states)
+        The pruned transition matrix, with exact zeros for the dropped
+        transitions.
+    populations : np.ndarray, shape=(n_states,)
+        Its stationary distribution.
+    """
+    transmat = np.asarray(transmat, dtype=np.float64)
+    n_states = len(transmat)
+    flux = populations[:, np.newaxis] * transmat
+    flux = 0.5 * (flux + flux.T)
+    keep = np.maximum(transmat, transmat.T) >= threshold
+    np.fill_diagonal(keep, False)
+
+    if max_out_degree is not None:
+        # The candidates are the pairs among the max_out_degree strongest of
+        # either state, so the greedy pass is over O(n_states) pairs.
+        candidates = np.where(keep, flux, -1.0)
+        top = np.argsort(-candidates, axis=1,
+                         kind='mergesort')[:, :max_out_degree]
+        rows = np.repeat(np.arange(n_states), top.shape[1])
+        cols = top.ravel()
+        # each unordered pair once, in lexicographic order of (min, max)
+        keys = np.unique(np.minimum(rows, cols) * n_states +
+                         np.maximum(rows, cols))
+        first, second = divmod(keys, n_states)
+        candidate = keep[first, second]
+        first, second = first[candidate], second[candidate]
+        order = np.argsort(-flux[first, second], kind='mergesort')
+
+        keep = np.zeros_like(keep)
+        degree = np.zeros(n_states, dtype=int)
+        for i, j in zip(first[order], second[order]):
+            if degree[i] < max_out_degree and degree[j] < max_out_degree:
+                keep[i, j] = keep[j, i] = True
+                degree[i] += 1
+                degree[j] += 1
+    np.fill_diagonal(keep, True)
+
+    flux = np.where(keep, flux, 0.0)
+    outflow = flux.sum(axis=1)
+    return flux / outflow[:, np.newaxis], outflow / outflow.sum()
@@ -4,6 +4,7 @@
 #include "cephes_names.h"
 int mtherr(char *name, int code);
 double i0(double x);
+double i0e(double x);
 double i1(double x);
 double zeta(double x, double q);
 double psi(double x);
@@ -6,12 +6,16 @@ from cpython.ref cimport PyObject
 
 import time
 import warnings
+from functools import partial
 from sklearn import cluster, mixture
 from sklearn.utils import check_random_state
 from mdtraj.utils import ensure_type
 from .discrete_approx import discrete_approx_mvn, NotSatisfiableError
 from ..utils import check_iter_of_sequences, printoptions
 from ..msm._markovstatemodel import _transmat_mle_prinz
+from ._restarts import RestartMonitor, run_restarts
+from ._decoding import decode_in_chunks
+from ._transitions import prune_transmat
 
 
 cdef extern from "Trajectory.h" namespace "msmbuilder":
@@ -23,14 +27,21 @@ cdef extern from "GaussianHMMFitter.h" namespace "msmbuilder":
     cdef cppclass GaussianHMMFitter[T]:
         GaussianHMMFitter(GaussianHMM, int, int, int, double*) except +
         void set_transmat(double*)
+        void set_scaled_lattices(bint)
+        void set_sparse_transitions(bint)
         void set_means_and_variances(double*, double*)
-        void fit(const vector[Trajectory]&, double)
+        void set_means_and_covariance_factors(double*, double*)
+        void fit(const vector[Trajectory]&, double) nogil
+        void request_stop()
+        double expectation_step(const vector[Trajectory]&) nogil
         double score_trajectories(vector[Trajectory]&)
         double predict_state_sequence(Trajectory& trajectory, int* state_sequence)
+        void decode_trajectories(const vector[Trajectory]&, int**, double**, double*) nogil
         int get_fit_iterations()
         void get_transition_counts(double*)
         void get_obs(double*)
         void get_obs2(double*)
+        void get_obs_outer(double*)
         void get_post(double*)
         void get_log_probability(double*)
 
@@ -51,7 +62,7 @@ cdef public class GaussianHMM[object GaussianHMMObject, type GaussianHMMType]:
     n_init : int
         Number of time the EM algorithm will be run with different
         random seeds. The final results will be the best output of
-        n_init consecutive runs in terms of log likelihood.
+        n_init runs in terms of log likelihood.
     n_iter : int
         The maximum number of iterations of expectation-maximization to
         run during each fitting round.
@@ -87,6 +98,43 @@ cdef public class GaussianHMM[object GaussianHMMObject, type GaussianHMMType]:
     init_algo : str
         Use this algorithm to hotstart the means and covariances.  Must
         be one of "kmeans" or "GMM"
+    n_jobs : int, default=1
+        Number of the n_init restarts to run concurrently. The restarts
+        run in threads that share the input sequences, and each of them
+        still parallelizes its E-step over trajectories with OpenMP. If
+        negative, ``cpu_count() + 1 + n_jobs`` restarts run at once.
+    restart_margin : float, optional
+        If given, a restart whose log-likelihood trails the best
+        log-likelihood reached by another restart at the same EM iteration
+        by more than restart_margin is abandoned early. With n_jobs > 1
+        which restarts get abandoned depends on thread scheduling.
+    covariance_type : {'diag', 'full'}, default='diag'
+        Form of the covariance matrices of the Gaussian emissions. 'full'
+        captures correlations between features (e.g. non-whitened tICA
+        coordinates) at a cost per frame that grows with n_features**2. With
+        a fusion prior, the penalty on the means is weighted by the diagonal
+        of the covariance matrices.
+    forward_backward : {'log', 'scaled'}, default='log'
+        How the forward-backward algorithm is computed. 'log' works with
+        log probabilities in double precision. 'scaled' works with
+        probabilities in single precision, renormalized at every frame,
+        which is faster and needs half the memory for the lattices, but
+        only agrees with 'log' to single precision.
+    transition_threshold : float, default=0
+        If positive, transitions less likely than this (in both directions)
+        are removed from the model at every M-step, in a way that preserves
+        detailed balance. The forward-backward and Viterbi recursions then
+        only visit the remaining transitions, which makes them much faster
+        with many states. With forward_backward='scaled', only the Viterbi
+        algorithm does.
+    max_out_degree : int, optional
+        If given, each state keeps at most this many transitions to other
+        states at every M-step. The candidates are the pairs among the
+        ``max_out_degree`` largest equilibrium fluxes out of either state,
+        and they are considered in order of decreasing flux. Each is kept
+        only while both of its states have fewer than ``max_out_degree``
+        other connections. Like transition_threshold, this turns on the
+        sparse recursions.
 
     References
     ----------
@@ -98,6 +146,9 @@ cdef public class GaussianHMM[object GaussianHMMObject, type GaussianHMMType]:
     ----------
     means_ :
     vars_ :
+    covars_ : array, shape (n_states, n_features, n_features)
+        Covariance matrices of the emissions. With covariance_type='diag',
+        these are the diagonal matrices built from vars_.
     transmat_ :
     populations_ :
     fit_logprob_ :
@@ -109,13 +160,18 @@ cdef public class GaussianHMM[object GaussianHMMObject, type GaussianHMMType]:
     cdef startprob
     cdef stats
     cdef reversible_type, n_lqa_iter, fusion_prior, vars_prior, vars_weight, init_algo
-    cdef _means_, _vars_, _transmat_, _populations_, _fit_logprob_, _fit_time_
+    cdef n_jobs, restart_margin, _early_stop
+    cdef covariance_type, forward_backward, transition_threshold, max_out_degree
+    cdef _means_, _vars_, _covars_, _transmat_, _populations_, _fit_logprob_, _fit_time_
 
     def __init__(self, n_states, n_init=10, n_iter=10,
                  n_lqa_iter=10, fusion_prior=1e-2, thresh=1e-2,
                  reversible_type='mle', vars_prior=1e-3,
                  vars_weight=1, random_state=None,
-                 timing=False, n_hotstart='all', init_algo='kmeans'):
+                 timing=False, n_hotstart='all', init_algo='kmeans',
+                 n_jobs=1, restart_margin=None, covariance_type='diag',
+                 forward_backward='log', transition_threshold=0,
+                 max_out_degree=None):
         self.n_states = int(n_states)
         self.n_features = -1
         self.n_init = int(n_init)
@@ -130,6 +186,20 @@ cdef public class GaussianHMM[object GaussianHMMObject, type GaussianHMMType]:
         self.timing = timing
         self.n_hotstart = n_hotstart
         self.init_algo = init_algo
+        self.n_jobs = int(n_jobs)
+        self.restart_margin = restart_margin
+        if covariance_type not in ('diag', 'full'):
+            raise ValueError("covariance_type must be 'diag' or 'full'")
+        self.covariance_type = covariance_type
+        if forward_backward not in ('log', 'scaled'):
+            raise ValueError("forward_backward must be 'log' or 'scaled'")
+        self.forward_backward = forward_backward
+        self.transition_threshold = float(transition_threshold)
+        if max_out_degree is not None:
+            max_out_degree = int(max_out_degree)
+        self.max_out_degree = max_out_degree
+        self._covars_ = None
+        self._early_stop = None
         self.startprob = np.tile(1.0/n_states, n_states)
         self.stats = {}
 
@@ -146,10 +216,12 @@ cdef public class GaussianHMM[object GaussianHMMObject, type GaussianHMMType]:
         ['self', 'n_states', 'n_init', 'n_iter', 'n_lqa_iter',
          'fusion_prior', 'thresh', 'reversible_type', 'vars_prior',
          'vars_weight', 'random_state', 'timing',
-         'n_hotstart', 'init_algo'],
+         'n_hotstart', 'init_algo', 'n_jobs', 'restart_margin',
+         'covariance_type', 'forward_backward', 'transition_threshold',
+         'max_out_degree'],
           None, None,
           [10, 10, 10, 1e-2, 1e-2, 'mle', 1e-3, 1, None, False,
-          'all', 'kmeans']
+          'all', 'kmeans', 1, None, 'diag', 'log', 0, None]
         )
 
     @property
@@ -160,6 +232,12 @@ cdef public class GaussianHMM[object GaussianHMMObject, type GaussianHMMType]:
     def vars_(self):
         return self._vars_
 
+    @property
+    def covars_(self):
+        if self.covariance_type == 'full' or self._vars_ is None:
+            return self._covars_
+        return np.array([np.diag(v) for v in self._vars_])
+
     @property
     def transmat_(self):
         return self._transmat_
@@ -251,7 +329,8 @@ cdef public class GaussianHMM[object GaussianHMMObject, type GaussianHMMType]:
         """
 
         logprob = [mixture.log_multivariate_normal_density(
-            x, self._means_, self._vars_, covariance_type='diag'
+            x, self._means_, self._emission_covars(),
+            covariance_type=self.covariance_type
         ) for x in sequences]
 
         argm = np.array([lp.argmax(0) for lp in logprob])
@@ -323,7 +402,8 @@ cdef public class GaussianHMM[object GaussianHMMObject, type GaussianHMMType]:
         if scheme == 'even':
             logprob = [
                 mixture.log_multivariate_normal_density(
-                    x, self._means_, self._vars_, covariance_type='diag'
+                    x, self._means_, self._emission_covars(),
+                    covariance_type=self.covariance_type
                 ) for x in sequences]
             ass = [lp.argmax(1) for lp in logprob]
 
@@ -394,35 +474,32 @@ timescales: {timescales}
         self._validate_sequences(sequences)
         self.n_features = sequences[0].shape[1]
         dtype = sequences[0].dtype
-        best_fit = {'params': {}, 'loglikelihood': -np.inf}
+        if dtype != np.float32 and dtype != np.float64:
+            raise ValueError('Unsupported data type: '+str(dtype))
         start_time = time.time()
-        self.stats = {}
-        total_iters = 0
-        for run in range(self.n_init):
-            self._init(sequences)
-            if dtype == np.float32:
-                self._fit_float(sequences)
-            elif dtype == np.float64:
-                self._fit_double(sequences)
-            else:
-                raise ValueError('Unsupported data type: '+str(dtype))
-            total_iters += len(self.stats['log_probability'])
-
-            # If this is better than our other runs, keep it
-            if self.stats['log_probability'][-1] > best_fit['loglikelihood']:
-                best_fit['loglikelihood'] = self.stats['log_probability'][-1]
-                best_fit['params'] = {'means': self.means_,
-                                      'vars': self.vars_,
-                                      'populations': self.populations_,
-                                      'transmat': self.transmat_,
-                                      'fit_logprob': self.stats['log_probability']}
-
-        # Set the final values
-        self._means_ = best_fit['params']['means']
-        self._vars_ = best_fit['params']['vars']
-        self._transmat_ = best_fit['params']['transmat']
-        self._populations_ = best_fit['params']['populations']
-        self._fit_logprob_ = best_fit['params']['fit_logprob']
+
+        # Each restart gets its own model (the C++ fitter calls back into
+        # the model for the M-step) and its own seed for the hot start.
+        random = check_random_state(self.random_state)
+        seeds = random.randint(np.iinfo(np.int32).max, size=self.n_init)
+        runs = [self._restart(seed) for seed in seeds]
+        monitor = RestartMonitor(self.restart_margin)
+
+        def fit_one(run):
+            return runs[run]._fit_restart(sequences, monitor, run)
+
+        traces = run_restarts(fit_one, self.n_init, self.n_jobs)
+        total_iters = sum(len(trace) for trace in traces)
+
+        # Keep only the winning parameters
+        cdef GaussianHMM best = runs[monitor.best()]
+        self._means_ = best._means_
+        self._vars_ = best._vars_
+        self._covars_ = best._covars_
+        self._transmat_ = best._transmat_
+        self._populations_ = best._populations_
+        self._fit_logprob_ = best.stats['log_probability']
+        self.stats = best.stats
         self._fit_time_ = time.time() - start_time
 
         if self.timing:
@@ -432,11 +509,299 @@ timescales: {timescales}
             print('----------------------')
             print('n_features: %d' % (self.n_features))
             print('TOTAL EM Iters: %s' % total_iters)
+            print('Restarts pruned: %d / %d' % (monitor.n_pruned, self.n_init))
             print('Speed:    %.3f +/- %.3f us/(sample * em-iter)' % (
                 np.mean(s_per_sample_per_em * 10 ** 6),
                 np.std(s_per_sample_per_em * 10 ** 6)))
         return self
 
+    def fit_online(self, sequences, batch_size=16, n_epochs=10,
+                   step_decay=0.6, reservoir_size=100000):
+        """Estimate model parameters with stochastic (online) EM.
+
+        Only a minibatch of sequences is held in memory at a time, so the
+        sequences can be a dataset stored on disk, such as a
+        ``NumpyDirDataset`` or ``HDF5Dataset``. After the E-step on each
+        minibatch, the running sufficient statistics are moved towards the
+        minibatch's statistics (scaled up to the size of the whole dataset)
+        by a step size of ``(1 + update)**(-step_decay)``, and the
+        parameters are re-estimated from them.
+
+        The hot start uses a uniform sample of at most ``reservoir_size``
+        frames, drawn in a single pass over the data. Only one EM run is
+        done, regardless of n_init.
+
+        Parameters
+        ----------
+        sequences : sequence of arrays
+            Sequence (a list or a dataset) of 2-dimensional observation
+            sequences, each of which has shape (n_samples_i, n_features).
+            Each element is accessed once per epoch.
+        batch_size : int, default=16
+            Number of sequences in each minibatch.
+        n_epochs : int, default=10
+            Maximum number of passes over the data. Fitting also stops when
+            the log-likelihood of an epoch changes by less than thresh.
+        step_decay : float, default=0.6
+            Decay exponent of the step size. Values in (0.5, 1] give a
+            convergent schedule; smaller values forget old minibatches
+            faster.
+        reservoir_size : int, default=100000
+            Maximum number of frames used for the hot start.
+
+        Notes
+        -----
+        After fitting, ``fit_logprob_`` holds one entry per epoch: the sum
+        of the log-likelihoods of the minibatches, each computed with the
+        parameters at the time it was visited.
+        """
+        if len(sequences) == 0:
+            raise ValueError('sequences is empty')
+        start_time = time.time()
+        random = check_random_state(self.random_state)
+
+        reservoir, n_frames = _reservoir_sample(
+            sequences, reservoir_size, random)
+        self.n_features = reservoir.shape[1]
+        self.stats = {}
+        self._init([reservoir])
+
+        keys = ['trans', 'post', 'obs', 'obs**2']
+        if self.covariance_type == 'full':
+            keys.append('obs*obs.T')
+        running = None
+        n_updates = 0
+        epoch_logprob = []
+        for epoch in range(n_epochs):
+            order = random.permutation(len(sequences))
+            logprob = 0.0
+            for start in range(0, len(order), batch_size):
+                batch = [sequences[i] for i in order[start:start + batch_size]]
+                logprob += self._expectation_step(batch)
+
+                scale = float(n_frames) / sum(len(X) for X in batch)
+                step = (1.0 + n_updates) ** (-step_decay)
+                if running is None:
+                    running = {k: scale * self.stats[k] for k in keys}
+                else:
+                    for k in keys:
+                        running[k] *= 1 - step
+                        running[k] += step * scale * self.stats[k]
+                n_updates += 1
+
+                self.stats.update({k: running[k].copy() for k in keys})
+                self._do_mstep()
+
+            epoch_logprob.append(logprob)
+            if (epoch > 0 and
+                    abs(epoch_logprob[-1] - epoch_logprob[-2]) < self.thresh):
+                break
+
+        self._fit_logprob_ = np.array(epoch_logprob)
+        self._fit_time_ = time.time() - start_time
+        return self
+
+    def sweep_n_states(self, sequences, n_states):
+        """Fit models with an increasing number of states.
+
+        The smallest model is fit like :meth:`fit`, with this model's hot
+        start and n_init restarts. Every larger model is warm-started from
+        the previous one instead: the states whose emissions contribute the
+        most to the negative log-likelihood of the data (computed from the
+        sufficient statistics of the previous fit) are split in two along
+        their direction of largest variance, and a single EM run refines
+        the result. This is much faster than fitting each number of states
+        independently, but explores fewer local optima.
+
+        Parameters
+        ----------
+        sequences : list
+            List of 2-dimensional array observation sequences, each of which
+            has shape (n_samples_i, n_features), where n_samples_i
+            is the length of the i_th observation.
+        n_states : list of int
+            The numbers of states to fit, in increasing order.
+
+        Returns
+        -------
+        models : list of GaussianHMM
+            The fitted model for each entry of n_states. This model itself
+            is not modified.
+        logprob : np.ndarray, shape=(len(n_states),)
+            Log-likelihood of the sequences at the last EM iteration of
+            each model.
+        bic : np.ndarray, shape=(len(n_states),)
+            Bayesian information criterion of each model. Lower is better.
+        """
+        n_states = [int(k) for k in n_states]
+        if (len(n_states) == 0 or n_states[0] < 1 or
+                any(b <= a for a, b in zip(n_states, n_states[1:]))):
+            raise ValueError('n_states must be an increasing sequence of '
+                             'positive integers')
+        self._validate_sequences(sequences)
+        n_frames = sum(len(s) for s in sequences)
+        n_features = sequences[0].shape[1]
+
+        cdef GaussianHMM model = self._restart(self.random_state, n_states[0])
+        model.n_init = self.n_init
+        model.n_jobs = self.n_jobs
+        model.restart_margin = self.restart_margin
+        model.timing = self.timing
+        model.fit(sequences)
+        models = [model]
+
+        cdef GaussianHMM previous
+        for k in n_states[1:]:
+            previous = model
+            start_time = time.time()
+            model = self._restart(self.random_state, k)
+            (model._means_, model._vars_, model._covars_, model._transmat_,
+             model._populations_) = _split_states(
+                previous._means_, previous._vars_, previous._covars_,
+                previous._transmat_, previous._populations_,
+                previous._emission_logprob(), k - previous.n_states)
+            model._fit_restart(sequences, RestartMonitor(), 0, hotstart=False)
+            model._fit_logprob_ = model.stats['log_probability']
+            model._fit_time_ = time.time() - start_time
+            models.append(model)
+
+        logprob = np.array([m.fit_logprob_[-1] for m in models])
+        if self.covariance_type == 'full':
+            n_emission = n_features + n_features * (n_features + 1) // 2
+        else:
+            n_emission = 2 * n_features
+        # a reversible transition matrix has n*(n+1)/2 - 1 free parameters
+        n_parameters = np.array([k * n_emission + k * (k + 1) // 2 - 1
+                                 for k in n_states])
+        bic = -2 * logprob + n_parameters * np.log(n_frames)
+        return models, logprob, bic
+
+    def _emission_logprob(self):
+        """Expected log-likelihood of the observations emitted by each
+        state, from the sufficient statistics of the last E-step."""
+        stats = self.stats
+        post = stats['post']
+        means = self._means_
+        # scatter of the observations around the current means
+        obs_means = stats['obs'][:, :, np.newaxis] * means[:, np.newaxis, :]
+        if self.covariance_type == 'full':
+            scatter = (stats['obs*obs.T'] - obs_means
+                       - np.swapaxes(obs_means, 1, 2)
+                       + post[:, np.newaxis, np.newaxis] *
+                       means[:, :, np.newaxis] * means[:, np.newaxis, :])
+            covars = self._covars_
+        else:
+            scatter = (stats['obs**2'] - 2 * means * stats['obs']
+                       + post[:, np.newaxis] * means ** 2)
+            scatter = scatter[:, :, np.newaxis] * np.eye(self.n_features)
+            covars = self._vars_[:, :, np.newaxis] * np.eye(self.n_features)
+        logdet = np.linalg.slogdet(covars)[1]
+        mahalanobis = np.trace(np.linalg.solve(covars, scatter), axis1=1,
+                               axis2=2)
+        return -0.5 * (post * (self.n_features * np.log(2 * np.pi) + logdet)
+                       + mahalanobis)
+
+    def _expectation_step(self, sequences):
+        """Compute the expected sufficient statistics of `sequences` under
+        the current parameters into self.stats, and return their
+        log-likelihood."""
+        self._validate_sequences(sequences)
+        dtype = sequences[0].dtype
+        if dtype == np.float32:
+            return self._expectation_step_float(sequences)
+        elif dtype == np.float64:
+            return self._expectation_step_double(sequences)
+        else:
+            raise ValueError('Unsupported data type: '+str(dtype))
+
+    cdef _expectation_step_float(self, sequences):
+        cdef vector[Trajectory] trajectoryVec
+        cdef np.ndarray[double, ndim=1] startprob
+        cdef np.ndarray[double, ndim=2] transmat
+        cdef double logprob
+        trajectoryVec = self._convert_sequences_to_vector_float(sequences)
+        startprob = self.startprob
+        transmat = self._transmat_
+        cdef GaussianHMMFitter[float] *fitter = new GaussianHMMFitter[float](self, self.n_states, self.n_features, self.n_iter, <double*> &startprob[0])
+        fitter.set_scaled_lattices(self.forward_backward == 'scaled')
+        fitter.set_sparse_transitions(self._sparse_transitions())
+        fitter.set_transmat(<double*> &transmat[0,0])
+        self._set_emissions_float(fitter)
+        try:
+            with nogil:
+                logprob = fitter.expectation_step(trajectoryVec)
+            self._record_stats_float(fitter)
+            return logprob
+        finally:
+            del fitter
+
+    cdef _expectation_step_double(self, sequences):
+        cdef vector[Trajectory] trajectoryVec
+        cdef np.ndarray[double, ndim=1] startprob
+        cdef np.ndarray[double, ndim=2] transmat
+        cdef double logprob
+        trajectoryVec = self._convert_sequences_to_vector_double(sequences)
+        startprob = self.startprob
+        transmat = self._transmat_
+        cdef GaussianHMMFitter[double] *fitter = new GaussianHMMFitter[double](self, self.n_states, self.n_features, self.n_iter, <double*> &startprob[0])
+        fitter.set_scaled_lattices(self.forward_backward == 'scaled')
+        fitter.set_sparse_transitions(self._sparse_transitions())
+        fitter.set_transmat(<double*> &transmat[0,0])
+        self._set_emissions_double(fitter)
+        try:
+            with nogil:
+                logprob = fitter.expectation_step(trajectoryVec)
+            self._record_stats_double(fitter)
+            return logprob
+        finally:
+            del fitter
+
+    def _restart(self, seed, n_states=None):
+        """Create an unfit copy of this model for a single restart."""
+        if n_states is None:
+            n_states = self.n_states
+        return type(self)(
+            n_states, n_init=1, n_iter=self.n_iter,
+            n_lqa_iter=self.n_lqa_iter, fusion_prior=self.fusion_prior,
+            thresh=self.thresh, reversible_type=self.reversible_type,
+            vars_prior=self.vars_prior, vars_weight=self.vars_weight,
+            random_state=seed, n_hotstart=self.n_hotstart,
+            init_algo=self.init_algo, covariance_type=self.covariance_type,
+            forward_backward=self.forward_backward,
+            transition_threshold=self.transition_threshold,
+            max_out_degree=self.max_out_degree)
+
+    def _sparse_transitions(self):
+        return self.transition_threshold > 0 or self.max_out_degree is not None
+
+    def _fit_restart(self, sequences, monitor, run, hotstart=True):
+        """Hot start and run EM once, reporting progress to `monitor`.
+
+        With hotstart=False, EM starts from the current parameters instead.
+        Returns the log-likelihood after each iteration.
+        """
+        self.n_features = sequences[0].shape[1]
+        self.stats = {}
+        self._early_stop = partial(monitor.should_stop, run)
+        try:
+            if hotstart:
+                self._init(sequences)
+            if sequences[0].dtype == np.float32:
+                self._fit_float(sequences)
+            else:
+                self._fit_double(sequences)
+        finally:
+            self._early_stop = None
+        monitor.finish(run, self.stats['log_probability'])
+        return self.stats['log_probability']
+
+    def _emission_covars(self):
+        # covariances in the format that sklearn's mixture code expects for
+        # self.covariance_type
+        if self.covariance_type == 'full':
+            return self._covars_
+        return self._vars_
+
     def _validate_sequences(self, sequences):
         """Make sure the sequences supplied by the user are valid."""
         if len(sequences) == 0:
@@ -482,10 +847,15 @@ timescales: {timescales}
             small_dataset = np.vstack(sequences[0:min(len(sequences), self.n_hotstart)])
 
         if self.init_algo == "GMM":
-            mix = mixture.GMM(self.n_states, n_init=1, random_state=self.random_state)
+            mix = mixture.GMM(self.n_states, n_init=1, random_state=self.random_state,
+                              covariance_type=self.covariance_type)
             mix.fit(small_dataset)
             self._means_ = mix.means_
-            self._vars_ = mix.covars_
+            if self.covariance_type == 'full':
+                self._covars_ = mix.covars_
+                self._vars_ = np.array([np.diag(c) for c in mix.covars_])
+            else:
+                self._vars_ = mix.covars_
         else:
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
@@ -494,6 +864,9 @@ timescales: {timescales}
                     random_state=self.random_state).fit(
                     small_dataset).cluster_centers_
             self._vars_ = np.vstack([np.var(small_dataset, axis=0)] * self.n_states)
+            if self.covariance_type == 'full':
+                covar = np.atleast_2d(np.cov(small_dataset, rowvar=False))
+                self._covars_ = np.array([covar] * self.n_states)
         self._populations_ = np.ones(self.n_states) / self.n_states
         self._transmat_ = np.empty((self.n_states, self.n_states))
         self._transmat_.fill(1.0/self.n_states)
@@ -502,18 +875,20 @@ timescales: {timescales}
         cdef vector[Trajectory] trajectoryVec
         cdef np.ndarray[double, ndim=1] startprob
         cdef np.ndarray[double, ndim=2] transmat
-        cdef np.ndarray[double, ndim=2] means
-        cdef np.ndarray[double, ndim=2] vars
+        cdef double thresh = self.thresh
         trajectoryVec = self._convert_sequences_to_vector_float(sequences)
         startprob = self.startprob
         transmat = self._transmat_
-        means = self._means_.astype(np.float64)
-        vars = self._vars_.astype(np.float64)
         cdef GaussianHMMFitter[float] *fitter = new GaussianHMMFitter[float](self, self.n_states, self.n_features, self.n_iter, <double*> &startprob[0])
+        fitter.set_scaled_lattices(self.forward_backward == 'scaled')
+        fitter.set_sparse_transitions(self._sparse_transitions())
         fitter.set_transmat(<double*> &transmat[0,0])
-        fitter.set_means_and_variances(<double*> &means[0,0], <double*> &vars[0,0])
+        self._set_emissions_float(fitter)
         try:
-            fitter.fit(trajectoryVec, self.thresh)
+            # The GIL is only retaken for the M-step callback, so restarts
+            # running in other threads can do their E-steps meanwhile.
+            with nogil:
+                fitter.fit(trajectoryVec, thresh)
         finally:
             del fitter
 
@@ -521,27 +896,25 @@ timescales: {timescales}
         cdef vector[Trajectory] trajectoryVec
         cdef np.ndarray[double, ndim=1] startprob
         cdef np.ndarray[double, ndim=2] transmat
-        cdef np.ndarray[double, ndim=2] means
-        cdef np.ndarray[double, ndim=2] vars
+        cdef double thresh = self.thresh
         trajectoryVec = self._convert_sequences_to_vector_double(sequences)
         startprob = self.startprob
         transmat = self._transmat_
-        means = self._means_.astype(np.float64)
-        vars = self._vars_.astype(np.float64)
         cdef GaussianHMMFitter[double] *fitter = new GaussianHMMFitter[double](self, self.n_states, self.n_features, self.n_iter, <double*> &startprob[0])
+        fitter.set_scaled_lattices(self.forward_backward == 'scaled')
+        fitter.set_sparse_transitions(self._sparse_transitions())
         fitter.set_transmat(<double*> &transmat[0,0])
-        fitter.set_means_and_variances(<double*> &means[0,0], <double*> &vars[0,0])
+        self._set_emissions_double(fitter)
         try:
-            fitter.fit(trajectoryVec, self.thresh)
+            # The GIL is only retaken for the M-step callback, so restarts
+            # running in other threads can do their E-steps meanwhile.
+            with nogil:
+                fitter.fit(trajectoryVec, thresh)
         finally:
             del fitter
 
     def _getdiff(self, means, difference_cutoff):
-        diff = np.zeros((self.n_features, self.n_states, self.n_states))
-        for i in range(self.n_features):
-            diff[i] = np.maximum(
-                np.abs(np.subtract.outer(means[:, i], means[:, i])), difference_cutoff)
-        return diff
+        return _getdiff(means, difference_cutoff)
 
     def _do_mstep(self):
         stats = self.stats
@@ -561,8 +934,11 @@ timescales: {timescales}
             raise ValueError('Invalid value for reversible_type: %s '
                              'Must be either "mle" or "transpose"'
                              % self.reversible_type)
+        if self._sparse_transitions():
+            self._transmat_, self._populations_ = prune_transmat(
+                self._transmat_, self._populations_,
+                self.transition_threshold, self.max_out_degree)
 
-        difference_cutoff = 1e-10
         # we don't want denom to be zero, because then the new value of the means
         # will be nan/inf. so padd it up by a very small constant. This particular
         # padding is following the sklearn mixture model m_step code from
@@ -573,40 +949,9 @@ timescales: {timescales}
         means = stats['obs'] / denom  # unregularized means
 
         if self.fusion_prior > 0 and self.n_lqa_iter > 0:
-            # adaptive regularization strength
-            strength = self.fusion_prior / self._getdiff(means, difference_cutoff)
-            rhs = stats['obs'] / self._vars_
-            for i in range(self.n_features):
-                np.fill_diagonal(strength[i], 0)
-
-            break_lqa = False
-            for s in range(self.n_lqa_iter):
-                diff = self._getdiff(means, difference_cutoff)
-                if np.all(diff <= difference_cutoff) or break_lqa:
-                    break
-
-                offdiagonal = -strength / diff
-                diagonal_penalty = np.sum(strength / diff, axis=2)
-                for f in range(self.n_features):
-                    if np.all(diff[f] <= difference_cutoff):
-                        continue
-                    ridge_approximation = np.diag(
-                        stats['post'] / self._vars_[:, f] + diagonal_penalty[f]) + offdiagonal[f]
-                    try:
-                        means[:, f] = np.linalg.solve(ridge_approximation, rhs[:, f])
-                    except np.linalg.LinAlgError:
-                        # I'm not really sure what exactly causes the ridge
-                        # approximation to be non-solvable, but it probably
-                        # means we're too close to the merging. Maybe 1e-10
-                        # is cutting it too close. Anyways,
-                        # just break now and use the last valid value
-                        # of the means.
-                        break_lqa = True
-
-            for i in range(self.n_features):
-                for k, j in zip(*np.triu_indices(self.n_states)):
-                    if diff[i, k, j] <= difference_cutoff:
-                        means[k, i] = means[j, i]
+            means = _fused_means(means, stats['obs'], stats['post'],
+                                 self._vars_, self.fusion_prior,
+                                 self.n_lqa_iter)
 
         self._means_ = means
 
@@ -616,11 +961,22 @@ timescales: {timescales}
             vars_weight = 0
             vars_prior = 0
 
-        var_num = (stats['obs**2']
-                   - 2 * self._means_ * stats['obs']
-                   + self._means_ ** 2 * denom)
         var_denom = max(vars_weight - 1, 0) + denom
-        self._vars_ = (vars_prior + var_num) / var_denom
+        if self.covariance_type == 'full':
+            means = self._means_
+            outer_means = means[:, :, np.newaxis] * means[:, np.newaxis, :]
+            obs_means = stats['obs'][:, :, np.newaxis] * means[:, np.newaxis, :]
+            covar_num = (stats['obs*obs.T']
+                         - obs_means - np.swapaxes(obs_means, 1, 2)
+                         + outer_means * denom[:, :, np.newaxis])
+            self._covars_ = ((vars_prior * np.eye(self.n_features) + covar_num)
+                             / var_denom[:, :, np.newaxis])
+            self._vars_ = np.array([np.diag(c) for c in self._covars_])
+        else:
+            var_num = (stats['obs**2']
+                       - 2 * self._means_ * stats['obs']
+                       + self._means_ ** 2 * denom)
+            self._vars_ = (vars_prior + var_num) / var_denom
 
     def score(self, sequences):
         """Log-likelihood of sequences under the model
@@ -645,16 +1001,14 @@ timescales: {timescales}
         cdef vector[Trajectory] trajectoryVec
         cdef np.ndarray[double, ndim=1] startprob
         cdef np.ndarray[double, ndim=2] transmat
-        cdef np.ndarray[double, ndim=2] means
-        cdef np.ndarray[double, ndim=2] vars
         trajectoryVec = self._convert_sequences_to_vector_float(sequences)
         startprob = self.startprob
         transmat = self._transmat_
-        means = self._means_.astype(np.float64)
-        vars = self._vars_.astype(np.float64)
         cdef GaussianHMMFitter[float] *fitter = new GaussianHMMFitter[float](self, self.n_states, self.n_features, self.n_iter, <double*> &startprob[0])
+        fitter.set_scaled_lattices(self.forward_backward == 'scaled')
+        fitter.set_sparse_transitions(self._sparse_transitions())
         fitter.set_transmat(<double*> &transmat[0,0])
-        fitter.set_means_and_variances(<double*> &means[0,0], <double*> &vars[0,0])
+        self._set_emissions_float(fitter)
         try:
             return fitter.score_trajectories(trajectoryVec)
         finally:
@@ -664,16 +1018,14 @@ timescales: {timescales}
         cdef vector[Trajectory] trajectoryVec
         cdef np.ndarray[double, ndim=1] startprob
         cdef np.ndarray[double, ndim=2] transmat
-        cdef np.ndarray[double, ndim=2] means
-        cdef np.ndarray[double, ndim=2] vars
         trajectoryVec = self._convert_sequences_to_vector_double(sequences)
         startprob = self.startprob
         transmat = self._transmat_
-        means = self._means_.astype(np.float64)
-        vars = self._vars_.astype(np.float64)
         cdef GaussianHMMFitter[double] *fitter = new GaussianHMMFitter[double](self, self.n_states, self.n_features, self.n_iter, <double*> &startprob[0])
+        fitter.set_scaled_lattices(self.forward_backward == 'scaled')
+        fitter.set_sparse_transitions(self._sparse_transitions())
         fitter.set_transmat(<double*> &transmat[0,0])
-        fitter.set_means_and_variances(<double*> &means[0,0], <double*> &vars[0,0])
+        self._set_emissions_double(fitter)
         try:
             return fitter.score_trajectories(trajectoryVec)
         finally:
@@ -700,71 +1052,165 @@ timescales: {timescales}
         hidden_sequences : list of np.ndarrays[dtype=int, shape=n_samples_i]
             Index of the most likely states for each observation.
         """
-        self._validate_sequences(sequences)
-        dtype = sequences[0].dtype
-        if dtype == np.float32:
-            return self._predict_float(sequences)
-        elif dtype == np.float64:
-            return self._predict_double(sequences)
-        else:
-            raise ValueError('Unsupported data type: '+str(dtype))
+        logprob, hidden_sequences, _ = self.decode_batch(sequences)
+        return logprob.sum(), hidden_sequences
+
+    def predict_proba(self, sequences):
+        """Posterior probability of each hidden state in each frame of each
+        data timeseries, from the forward-backward algorithm.
+
+        Parameters
+        ----------
+        sequences : list
+            List of 2-dimensional array observation sequences, each of which
+            has shape (n_samples_i, n_features), where n_samples_i
+            is the length of the i_th observation.
+
+        Returns
+        -------
+        posteriors : list of np.ndarrays[shape=(n_samples_i, n_states)]
+        """
+        return self.decode_batch(sequences, posteriors=True)[2]
+
+    def decode_batch(self, sequences, posteriors=False, states_out=None,
+                     posteriors_out=None, chunk_size=256):
+        """Viterbi paths (and optionally state posteriors) of many sequences.
+
+        The sequences are decoded ``chunk_size`` at a time, in parallel over
+        OpenMP threads, and each thread reuses its lattices across the
+        sequences it decodes. The outputs can be written into preallocated
+        arrays or an on-disk dataset, so that ``sequences`` and the results
+        never have to fit in memory at once.
 
-    cdef _predict_float(self, sequences):
-        cdef Trajectory trajectory
+        Parameters
+        ----------
+        sequences : list or dataset
+            2-dimensional array observation sequences, each of shape
+            (n_samples_i, n_features), e.g. a ``NumpyDirDataset``.
+        posteriors : bool, default=False
+            Also compute the posterior probability of each state in each
+            frame. Implied by ``posteriors_out``.
+        states_out : list, dataset or None
+            Where to store the Viterbi paths. If ``states_out[i]`` is an int32
+            array of shape (n_samples_i,), e.g. a slice of a ``np.memmap``,
+            it is filled in place; otherwise ``states_out[i]`` is assigned
+            (for a dataset, under the key of the sequence).
+        posteriors_out : list, dataset or None
+            Where to store the posteriors, as float64 arrays of shape
+            (n_samples_i, n_states), with the same conventions.
+        chunk_size : int, default=256
+            Number of sequences loaded and decoded together.
+
+        Returns
+        -------
+        viterbi_logprob : np.ndarray, shape=(n_sequences,)
+            Log probability of the maximum likelihood path of each sequence.
+        hidden_sequences : list or dataset
+            ``states_out``, or a new list of int32 arrays.
+        posteriors : list, dataset or None
+            ``posteriors_out``, a new list of arrays if ``posteriors`` is
+            True, or None.
+        """
+        def decode_chunk(arrays, states, post):
+            self._validate_sequences(arrays)
+            dtype = arrays[0].dtype
+            if dtype == np.float32:
+                return self._decode_float(arrays, states, post)
+            elif dtype == np.float64:
+                return self._decode_double(arrays, states, post)
+            else:
+                raise ValueError('Unsupported data type: '+str(dtype))
+
+        return decode_in_chunks(decode_chunk, sequences, self.n_states,
+                                posteriors=posteriors, states_out=states_out,
+                                posteriors_out=posteriors_out,
+                                chunk_size=chunk_size)
+
+    cdef _decode_float(self, sequences, states, posteriors):
+        cdef vector[Trajectory] trajectoryVec
+        cdef vector[int*] state_pointers
+        cdef vector[double*] posterior_pointers
         cdef np.ndarray[np.int32_t, ndim=1] state_sequence
-        cdef np.ndarray[float, ndim=2] array
+        cdef np.ndarray[double, ndim=2] posterior
+        cdef np.ndarray[double, ndim=1] logprob
         cdef np.ndarray[double, ndim=1] startprob
         cdef np.ndarray[double, ndim=2] transmat
-        cdef np.ndarray[double, ndim=2] means
-        cdef np.ndarray[double, ndim=2] vars
+        trajectoryVec = self._convert_sequences_to_vector_float(sequences)
+        for i in range(len(sequences)):
+            state_sequence = states[i]
+            state_pointers.push_back(<int*> &state_sequence[0])
+            if posteriors is not None:
+                posterior = posteriors[i]
+                posterior_pointers.push_back(<double*> &posterior[0,0])
+        logprob = np.zeros(len(sequences))
         startprob = self.startprob
         transmat = self._transmat_
-        means = self._means_.astype(np.float64)
-        vars = self._vars_.astype(np.float64)
         cdef GaussianHMMFitter[float] *fitter = new GaussianHMMFitter[float](self, self.n_states, self.n_features, self.n_iter, <double*> &startprob[0])
+        fitter.set_scaled_lattices(self.forward_backward == 'scaled')
+        fitter.set_sparse_transitions(self._sparse_transitions())
         fitter.set_transmat(<double*> &transmat[0,0])
-        fitter.set_means_and_variances(<double*> &means[0,0], <double*> &vars[0,0])
+        self._set_emissions_float(fitter)
+        cdef double** posterior_array = NULL
+        if posteriors is not None:
+            posterior_array = &posterior_pointers[0]
+        cdef double* logprob_array = <double*> &logprob[0]
         try:
-            logprob = 0.0
-            viterbi_sequences = []
-            for s in sequences:
-                array = s
-                trajectory = Trajectory(<PyObject*> array, <char*> &array[0,0], array.shape[0], array.shape[1], array.strides[0], array.strides[1])
-                state_sequence = np.empty(len(s), dtype=np.int32)
-                logprob += fitter.predict_state_sequence(trajectory, <int*> &state_sequence[0])
-                viterbi_sequences.append(state_sequence)
-            return (logprob, viterbi_sequences)
+            with nogil:
+                fitter.decode_trajectories(trajectoryVec, &state_pointers[0],
+                                           posterior_array, logprob_array)
+            return logprob
         finally:
             del fitter
 
-    cdef _predict_double(self, sequences):
-        cdef Trajectory trajectory
+    cdef _decode_double(self, sequences, states, posteriors):
+        cdef vector[Trajectory] trajectoryVec
+        cdef vector[int*] state_pointers
+        cdef vector[double*] posterior_pointers
         cdef np.ndarray[np.int32_t, ndim=1] state_sequence
-        cdef np.ndarray[double, ndim=2] array
+        cdef np.ndarray[double, ndim=2] posterior
+        cdef np.ndarray[double, ndim=1] logprob
         cdef np.ndarray[double, ndim=1] startprob
         cdef np.ndarray[double, ndim=2] transmat
-        cdef np.ndarray[double, ndim=2] means
-        cdef np.ndarray[double, ndim=2] vars
+        trajectoryVec = self._convert_sequences_to_vector_double(sequences)
+        for i in range(len(sequences)):
+            state_sequence = states[i]
+            state_pointers.push_back(<int*> &state_sequence[0])
+            if posteriors is not None:
+                posterior = posteriors[i]
+                posterior_pointers.push_back(<double*> &posterior[0,0])
+        logprob = np.zeros(len(sequences))
         startprob = self.startprob
         transmat = self._transmat_
-        means = self._means_.astype(np.float64)
-        vars = self._vars_.astype(np.float64)
         cdef GaussianHMMFitter[double] *fitter = new GaussianHMMFitter[double](self, self.n_states, self.n_features, self.n_iter, <double*> &startprob[0])
+        fitter.set_scaled_lattices(self.forward_backward == 'scaled')
+        fitter.set_sparse_transitions(self._sparse_transitions())
         fitter.set_transmat(<double*> &transmat[0,0])
-        fitter.set_means_and_variances(<double*> &means[0,0], <double*> &vars[0,0])
+        self._set_emissions_double(fitter)
+        cdef double** posterior_array = NULL
+        if posteriors is not None:
+            posterior_array = &posterior_pointers[0]
+        cdef double* logprob_array = <double*> &logprob[0]
         try:
-            logprob = 0.0
-            viterbi_sequences = []
-            for s in sequences:
-                array = s
-                trajectory = Trajectory(<PyObject*> array, <char*> &array[0,0], array.shape[0], array.shape[1], array.strides[0], array.strides[1])
-                state_sequence = np.empty(len(s), dtype=np.int32)
-                logprob += fitter.predict_state_sequence(trajectory, <int*> &state_sequence[0])
-                viterbi_sequences.append(state_sequence)
-            return (logprob, viterbi_sequences)
+            with nogil:
+                fitter.decode_trajectories(trajectoryVec, &state_pointers[0],
+                                           posterior_array, logprob_array)
+            return logprob
         finally:
             del fitter
 
+    cdef _set_emissions_float(self, GaussianHMMFitter[float]* fitter):
+        """Copy the parameters of the emission distributions to the C++ class."""
+        cdef np.ndarray[double, ndim=2] means
+        cdef np.ndarray[double, ndim=2] vars
+        cdef np.ndarray[double, ndim=3] cholesky
+        means = np.ascontiguousarray(self._means_, dtype=np.float64)
+        if self.covariance_type == 'full':
+            cholesky = np.ascontiguousarray(np.linalg.cholesky(self._covars_), dtype=np.float64)
+            fitter.set_means_and_covariance_factors(<double*> &means[0,0], <double*> &cholesky[0,0,0])
+        else:
+            vars = np.ascontiguousarray(self._vars_, dtype=np.float64)
+            fitter.set_means_and_variances(<double*> &means[0,0], <double*> &vars[0,0])
+
     cdef _record_stats_float(self, GaussianHMMFitter[float]* fitter):
         """Copy various statistics from the C++ class to this one."""
         cdef np.ndarray[double, ndim=2] transition_counts
@@ -772,6 +1218,7 @@ timescales: {timescales}
         cdef np.ndarray[double, ndim=2] obs2
         cdef np.ndarray[double, ndim=1] post
         cdef np.ndarray[double, ndim=1] log_probability
+        cdef np.ndarray[double, ndim=3] obs_outer
         transition_counts = np.empty((self.n_states, self.n_states))
         obs = np.empty((self.n_states, self.n_features))
         obs2 = np.empty((self.n_states, self.n_features))
@@ -781,13 +1228,31 @@ timescales: {timescales}
         fitter.get_obs(<double*> &obs[0,0])
         fitter.get_obs2(<double*> &obs2[0,0])
         fitter.get_post(<double*> &post[0])
-        fitter.get_log_probability(<double*> &log_probability[0])
+        if log_probability.shape[0] > 0:
+            fitter.get_log_probability(<double*> &log_probability[0])
+        if self.covariance_type == 'full':
+            obs_outer = np.empty((self.n_states, self.n_features, self.n_features))
+            fitter.get_obs_outer(<double*> &obs_outer[0,0,0])
+            self.stats['obs*obs.T'] = obs_outer
         self.stats['trans'] = transition_counts
         self.stats['obs'] = obs
         self.stats['obs**2'] = obs2
         self.stats['post'] = post
         self.stats['log_probability'] = log_probability
 
+    cdef _set_emissions_double(self, GaussianHMMFitter[double]* fitter):
+        """Copy the parameters of the emission distributions to the C++ class."""
+        cdef np.ndarray[double, ndim=2] means
+        cdef np.ndarray[double, ndim=2] vars
+        cdef np.ndarray[double, ndim=3] cholesky
+        means = np.ascontiguousarray(self._means_, dtype=np.float64)
+        if self.covariance_type == 'full':
+            cholesky = np.ascontiguousarray(np.linalg.cholesky(self._covars_), dtype=np.float64)
+            fitter.set_means_and_covariance_factors(<double*> &means[0,0], <double*> &cholesky[0,0,0])
+        else:
+            vars = np.ascontiguousarray(self._vars_, dtype=np.float64)
+            fitter.set_means_and_variances(<double*> &means[0,0], <double*> &vars[0,0])
+
     cdef _record_stats_double(self, GaussianHMMFitter[double]* fitter):
         """Copy various statistics from the C++ class to this one."""
         cdef np.ndarray[double, ndim=2] transition_counts
@@ -795,6 +1260,7 @@ timescales: {timescales}
         cdef np.ndarray[double, ndim=2] obs2
         cdef np.ndarray[double, ndim=1] post
         cdef np.ndarray[double, ndim=1] log_probability
+        cdef np.ndarray[double, ndim=3] obs_outer
         transition_counts = np.empty((self.n_states, self.n_states))
         obs = np.empty((self.n_states, self.n_features))
         obs2 = np.empty((self.n_states, self.n_features))
@@ -804,7 +1270,12 @@ timescales: {timescales}
         fitter.get_obs(<double*> &obs[0,0])
         fitter.get_obs2(<double*> &obs2[0,0])
         fitter.get_post(<double*> &post[0])
-        fitter.get_log_probability(<double*> &log_probability[0])
+        if log_probability.shape[0] > 0:
+            fitter.get_log_probability(<double*> &log_probability[0])
+        if self.covariance_type == 'full':
+            obs_outer = np.empty((self.n_states, self.n_features, self.n_features))
+            fitter.get_obs_outer(<double*> &obs_outer[0,0,0])
+            self.stats['obs*obs.T'] = obs_outer
         self.stats['trans'] = transition_counts
         self.stats['obs'] = obs
         self.stats['obs**2'] = obs2
@@ -815,8 +1286,11 @@ timescales: {timescales}
         """Pickle support"""
         args = (self.n_states, self.n_init, self.n_iter, self.n_lqa_iter, self.fusion_prior, self.thresh,
                 self.reversible_type, self.vars_prior, self.vars_weight, self.random_state,
-                self.timing, self.n_hotstart, self.init_algo)
-        state = (self._means_, self._vars_, self._transmat_, self._populations_, self._fit_logprob_, self._fit_time_)
+                self.timing, self.n_hotstart, self.init_algo, self.n_jobs,
+                self.restart_margin, self.covariance_type, self.forward_backward,
+                self.transition_threshold, self.max_out_degree)
+        state = (self._means_, self._vars_, self._transmat_, self._populations_, self._fit_logprob_, self._fit_time_,
+                 self._covars_)
         return (self.__class__, args, state)
     
     def __setstate__(self, state):
@@ -827,29 +1301,185 @@ timescales: {timescales}
         self._populations_ = state[3]
         self._fit_logprob_ = state[4]
         self._fit_time_ = state[5]
+        if len(state) > 6:
+            self._covars_ = state[6]
+        if self._means_ is not None:
+            self.n_features = self._means_.shape[1]
+
+def _getdiff(means, difference_cutoff):
+    """Pairwise absolute differences between the means of the states, for
+    each feature, clipped from below at `difference_cutoff`.
+
+    Returns an array of shape (n_features, n_states, n_states).
+    """
+    means_T = np.asarray(means).T
+    return np.maximum(np.abs(means_T[:, :, np.newaxis] - means_T[:, np.newaxis, :]),
+                      difference_cutoff)
 
-cdef public void _do_mstep_float(GaussianHMM hmm, GaussianHMMFitter[float]* fitter):
+
+def _fused_means(means, obs, post, vars, fusion_prior, n_lqa_iter,
+                 difference_cutoff=1e-10):
+    """M-step for the means under the L1 fusion prior.
+
+    Iterates the local quadratic approximation (LQA) to the penalty. Each
+    iteration solves one (n_states, n_states) linear system per feature,
+    and all of them are assembled and solved as a single batch. Finally,
+    means closer than `difference_cutoff` are fused.
+    """
+    means = np.array(means, dtype=np.float64)
+    n_states, n_features = means.shape
+    diagonal = np.arange(n_states)
+
+    # adaptive regularization strength
+    strength = fusion_prior / _getdiff(means, difference_cutoff)
+    strength[:, diagonal, diagonal] = 0
+    rhs = (obs / vars).T
+    post_over_vars = (post[:, np.newaxis] / vars).T
+
+    break_lqa = False
+    for s in range(n_lqa_iter):
+        diff = _getdiff(means, difference_cutoff)
+        if np.all(diff <= difference_cutoff) or break_lqa:
+            break
+
+        ridge_approximation = -strength / diff
+        ridge_approximation[:, diagonal, diagonal] = (
+            post_over_vars + np.sum(strength / diff, axis=2))
+        active = np.flatnonzero(~np.all(
+            diff.reshape(n_features, -1) <= difference_cutoff, axis=1))
+        try:
+            means[:, active] = np.linalg.solve(
+                ridge_approximation[active], rhs[active, :, np.newaxis])[:, :, 0].T
+        except np.linalg.LinAlgError:
+            # Solve the features one by one, keeping the last valid value
+            # of the means for any that fail. I'm not really sure what
+            # exactly causes the ridge approximation to be non-solvable,
+            # but it probably means we're too close to the merging. Maybe
+            # 1e-10 is cutting it too close. Anyways, stop after this
+            # iteration.
+            for f in active:
+                try:
+                    means[:, f] = np.linalg.solve(ridge_approximation[f], rhs[f])
+                except np.linalg.LinAlgError:
+                    break_lqa = True
+
+    # Fuse the means of each pair of states (k, j), j >= k, that are within
+    # difference_cutoff: state k takes the (pre-fusion) mean of the last
+    # such j. (If its own mean is nan, there is no such j.)
+    close = np.triu(np.ones((n_states, n_states), dtype=bool)) & (diff <= difference_cutoff)
+    last = n_states - 1 - np.argmax(close[:, :, ::-1], axis=2)
+    last = np.where(np.any(close, axis=2), last, diagonal)
+    return means[last, np.arange(n_features)[:, np.newaxis]].T
+
+
+def _split_states(means, vars, covars, transmat, populations,
+                  emission_logprob, n_new):
+    """Grow an HMM by `n_new` states for a warm start.
+
+    The state with the lowest `emission_logprob` is repeatedly split into
+    two, whose means are half a standard deviation on either side of the
+    original mean along its direction of largest variance. The variance in
+    that direction shrinks so that the pair covers the same spread. The new
+    state copies the row of the transition matrix of the original one, and
+    the transitions into and the population of the original state are
+    shared equally between the two, which preserves detailed balance.
+    Each half of a split state is credited with half its emission_logprob.
+
+    `covars` is None for diagonal covariances. Returns the new means, vars,
+    covars, transmat and populations.
+    """
+    means = np.array(means, dtype=np.float64)
+    vars = np.array(vars, dtype=np.float64)
+    if covars is not None:
+        covars = np.array(covars, dtype=np.float64)
+    transmat = np.array(transmat, dtype=np.float64)
+    populations = np.array(populations, dtype=np.float64)
+    score = np.array(emission_logprob, dtype=np.float64)
+
+    for _ in range(n_new):
+        i = np.argmin(score)
+        if covars is None:
+            feature = np.argmax(vars[i])
+            direction = np.zeros(means.shape[1])
+            direction[feature] = 1
+            variance = vars[i, feature]
+        else:
+            eigenvalues, eigenvectors = np.linalg.eigh(covars[i])
+            direction = eigenvectors[:, -1]
+            variance = eigenvalues[-1]
+        offset = 0.5 * np.sqrt(variance) * direction
+
+        # within-pair variance along `direction` is 3/4 of the original
+        if covars is None:
+            vars[i, feature] *= 0.75
+        else:
+            covars[i] -= 0.25 * variance * np.outer(direction, direction)
+            vars[i] = np.diag(covars[i])
+            covars = np.concatenate([covars, covars[i:i + 1]])
+        vars = np.concatenate([vars, vars[i:i + 1]])
+        means = np.concatenate([means, means[i:i + 1] + offset])
+        means[i] -= offset
+
+        n = len(transmat)
+        grown = np.zeros((n + 1, n + 1))
+        grown[:n, :n] = transmat
+        grown[n, :n] = transmat[i]
+        grown[:, i] *= 0.5
+        grown[:, n] = grown[:, i]
+        transmat = grown
+        populations[i] *= 0.5
+        populations = np.append(populations, populations[i])
+        score[i] *= 0.5
+        score = np.append(score, score[i])
+
+    return means, vars, covars, transmat, populations
+
+
+def _reservoir_sample(sequences, size, random):
+    """Draw a uniform sample of at most `size` frames from `sequences` in a
+    single pass (Vitter's algorithm R, vectorized over each sequence).
+
+    Returns the sample and the total number of frames.
+    """
+    reservoir = None
+    n_seen = 0
+    for X in sequences:
+        X = np.asarray(X)
+        if reservoir is None:
+            reservoir = np.empty((size, X.shape[1]), dtype=X.dtype)
+        n_fill = min(max(size - n_seen, 0), len(X))
+        reservoir[n_seen:n_seen + n_fill] = X[:n_fill]
+        # Once the reservoir is full, the frame with (0-based) index i
+        # replaces a random slot with probability size / (i + 1).
+        index = np.arange(n_seen + n_fill, n_seen + len(X))
+        if len(index) > 0:
+            slots = random.randint(0, index + 1)
+            keep = slots < size
+            reservoir[slots[keep]] = X[n_fill:][keep]
+        n_seen += len(X)
+    return reservoir[:min(n_seen, size)], n_seen
+
+
+cdef public void _do_mstep_float(GaussianHMM hmm, GaussianHMMFitter[float]* fitter) with gil:
     """This function exists to let the C++ code call back into Cython."""
     cdef np.ndarray[double, ndim=2] transmat
-    cdef np.ndarray[double, ndim=2] means
-    cdef np.ndarray[double, ndim=2] vars
     hmm._record_stats_float(fitter)
+    if hmm._early_stop is not None and hmm._early_stop(hmm.stats['log_probability']):
+        fitter.request_stop()
+        return
     hmm._do_mstep()
     transmat = hmm._transmat_
-    means = hmm._means_.astype(np.float64)
-    vars = hmm._vars_.astype(np.float64)
     fitter.set_transmat(<double*> &transmat[0,0])
-    fitter.set_means_and_variances(<double*> &means[0,0], <double*> &vars[0,0])
+    hmm._set_emissions_float(fitter)
 
-cdef public void _do_mstep_double(GaussianHMM hmm, GaussianHMMFitter[double]* fitter):
+cdef public void _do_mstep_double(GaussianHMM hmm, GaussianHMMFitter[double]* fitter) with gil:
     """This function exists to let the C++ code call back into Cython."""
     cdef np.ndarray[double, ndim=2] transmat
-    cdef np.ndarray[double, ndim=2] means
-    cdef np.ndarray[double, ndim=2] vars
     hmm._record_stats_double(fitter)
+    if hmm._early_stop is not None and hmm._early_stop(hmm.stats['log_probability']):
+        fitter.request_stop()
+        return
     hmm._do_mstep()
     transmat = hmm._transmat_
-    means = hmm._means_.astype(np.float64)
-    vars = hmm._vars_.astype(np.float64)
     fitter.set_transmat(<double*> &transmat[0,0])
-    fitter.set_means_and_variances(<double*> &means[0,0], <double*> &vars[0,0])
+    hmm._set_emissions_double(fitter)
@@ -5,13 +5,15 @@
 #define _USE_MATH_DEFINES
 #include "GaussianHMMFitter.h"
 #include "gaussian.h"
+#include <algorithm>
 #include <cmath>
 
 namespace msmbuilder {
 
 template <class T>
 GaussianHMMFitter<T>::GaussianHMMFitter(void* owner, int n_states, int n_features, int n_iter, const double* log_startprob) :
-        HMMFitter<T>(n_states, n_features, n_iter, log_startprob), owner(owner), a0(n_states*n_features), a1(n_states*n_features), a2(n_states*n_features) {
+        HMMFitter<T>(n_states, n_features, n_iter, log_startprob), owner(owner), full_covariance(false),
+        a0(n_states), a1(n_states*n_features), a2(n_states*n_features) {
 }
 
 template <class T>
@@ -20,40 +22,122 @@ GaussianHMMFitter<T>::~GaussianHMMFitter() {
 
 template <class T>
 void GaussianHMMFitter<T>::set_means_and_variances(const double* means, const double* variances) {
-    int n_elements = this->n_states*this->n_features;
-    for (int i = 0; i < n_elements; i++) {
-        this->a0[i] = means[i]*means[i]/variances[i] + log(variances[i]);
-        this->a1[i] = -2.0*means[i]/variances[i];
-        this->a2[i] = 1.0/variances[i];
+    // -2 times the log likelihood of state j is a0[j] + sum_i x_i*(a1[j,i] + x_i*a2[j,i]), where a0 collects the
+    // terms that do not depend on the frame.
+    full_covariance = false;
+    const int n_features = this->n_features;
+    for (int j = 0; j < this->n_states; j++) {
+        this->a0[j] = n_features*log(2*M_PI);
+        for (int i = 0; i < n_features; i++) {
+            int index = j*n_features+i;
+            this->a0[j] += means[index]*means[index]/variances[index] + log(variances[index]);
+            this->a1[index] = -2.0*means[index]/variances[index];
+            this->a2[index] = 1.0/variances[index];
+        }
     }
 }
 
 template <class T>
-void GaussianHMMFitter<T>::initialize_sufficient_statistics() {
-    obs.resize(this->n_states*this->n_features);
-    obs2.resize(this->n_states*this->n_features);
-    for (int i = 0; i < (int) obs.size(); i++) {
-        obs[i] = 0;
-        obs2[i] = 0;
+void GaussianHMMFitter<T>::set_means_and_covariance_factors(const double* means, const double* cholesky) {
+    full_covariance = true;
+    int n_features = this->n_features;
+    this->means.assign(means, means+this->n_states*n_features);
+    this->cholesky.assign(cholesky, cholesky+this->n_states*n_features*n_features);
+    inv_cholesky_diagonal.resize(this->n_states*n_features);
+    log_det.resize(this->n_states);
+    for (int j = 0; j < this->n_states; j++) {
+        log_det[j] = 0;
+        for (int i = 0; i < n_features; i++) {
+            double diagonal = cholesky[(j*n_features+i)*n_features+i];
+            inv_cholesky_diagonal[j*n_features+i] = 1.0/diagonal;
+            log_det[j] += 2*log(diagonal);
+        }
     }
-    this->post.resize(this->n_states);
-    for (int i = 0; i < this->n_states; i++)
-        this->post[i] = 0;
+}
+
+template <class T>
+int GaussianHMMFitter<T>::sufficient_statistics_size() const {
+    // obs followed by obs**2, or by the sums of outer products with full covariance matrices
+    if (full_covariance)
+        return this->n_states*this->n_features*(1+this->n_features);
+    return 2*this->n_states*this->n_features;
 }
 
 template <class T>
 void GaussianHMMFitter<T>::compute_log_likelihood(const Trajectory& trajectory,
                             std::vector<std::vector<double> >& frame_log_probability) const {
-    static const float log_M_2_PI = std::log(2*M_PI);
-    for (int t = 0; t < trajectory.frames(); t++) {
+    if (full_covariance) {
+        compute_log_likelihood_full(trajectory, frame_log_probability);
+        return;
+    }
+    // Blocks of frames are copied into a feature-major buffer, so that the inner loops run over contiguous frames
+    // with the coefficients of one state and feature held fixed, and can be vectorized.
+    static const int block_size = 64;
+    const int n_features = this->n_features;
+    const int traj_length = trajectory.frames();
+    std::vector<double> work(n_features*block_size);
+    double sum[block_size];
+    for (int start = 0; start < traj_length; start += block_size) {
+        int n_frames = std::min(block_size, traj_length-start);
+        for (int i = 0; i < n_features; i++)
+            for (int b = 0; b < n_frames; b++)
+                work[i*block_size+b] = trajectory.get<T>(start+b, i);
+        for (int j = 0; j < this->n_states; j++) {
+            for (int b = 0; b < n_frames; b++)
+                sum[b] = a0[j];
+            for (int i = 0; i < n_features; i++) {
+                const double c1 = a1[j*n_features+i];
+                const double c2 = a2[j*n_features+i];
+                const double* x = &work[i*block_size];
+                for (int b = 0; b < n_frames; b++)
+                    sum[b] += x[b]*(c1 + x[b]*c2);
+            }
+            for (int b = 0; b < n_frames; b++)
+                frame_log_probability[start+b][j] = -0.5*sum[b];
+        }
+    }
+}
+
+template <class T>
+void GaussianHMMFitter<T>::compute_log_likelihood_full(const Trajectory& trajectory,
+                            std::vector<std::vector<double> >& frame_log_probability) const {
+    // The Mahalanobis distances are |y|^2, where L y = x - mean.  The triangular systems for a block of frames are
+    // solved together, with the residuals stored feature-major so that the inner loops run over frames.
+    static const int block_size = 64;
+    const double log_M_2_PI = std::log(2*M_PI);
+    const int n_features = this->n_features;
+    const int traj_length = trajectory.frames();
+    std::vector<double> work(n_features*block_size);
+    for (int start = 0; start < traj_length; start += block_size) {
+        int n_frames = std::min(block_size, traj_length-start);
         for (int j = 0; j < this->n_states; j++) {
-            double temp = 0;
-            for (int i = 0; i < this->n_features; i++) {
-                T element = trajectory.get<T>(t, i);
-                int index = j*this->n_features+i;
-                temp += a0[index] + element*(a1[index] + element*a2[index]);
+            const double* L = &cholesky[j*n_features*n_features];
+            const double* mean = &means[j*n_features];
+            for (int i = 0; i < n_features; i++)
+                for (int b = 0; b < n_frames; b++)
+                    work[i*block_size+b] = trajectory.get<T>(start+b, i) - mean[i];
+
+            // Forward substitution, in place.
+            for (int i = 0; i < n_features; i++) {
+                double* y_i = &work[i*block_size];
+                for (int k = 0; k < i; k++) {
+                    const double L_ik = L[i*n_features+k];
+                    const double* y_k = &work[k*block_size];
+                    for (int b = 0; b < n_frames; b++)
+                        y_i[b] -= L_ik*y_k[b];
+                }
+                const double scale = inv_cholesky_diagonal[j*n_features+i];
+                for (int b = 0; b < n_frames; b++)
+                    y_i[b] *= scale;
+            }
+
+            const double constant = n_features*log_M_2_PI + log_det[j];
+            for (int b = 0; b < n_frames; b++) {
+                double distance = 0;
+                for (int i = 0; i < n_features; i++)
+                    distance += work[i*block_size+b]*work[i*block_size+b];
+                frame_log_probability[start+b][j] = -0.5*(constant+distance);
             }
-            frame_log_probability[t][j] = -0.5*(this->n_features*log_M_2_PI+temp);
         }
     }
 }
@@ -63,10 +147,31 @@ void GaussianHMMFitter<T>::accumulate_sufficient_statistics(const Trajectory& tr
                                       const std::vector<std::vector<double> >& frame_log_probability,
                                       const std::vector<std::vector<double> >& posteriors,
                                       const std::vector<std::vector<double> >& fwdlattice,
-                                      const std::vector<std::vector<double> >& bwdlattice) {
+                                      const std::vector<std::vector<double> >& bwdlattice,
+                                      double* statistics) const {
     int traj_length = trajectory.frames();
-    std::vector<double> traj_obs(this->n_states*this->n_features, 0);
-    std::vector<double> traj_obs2(this->n_states*this->n_features, 0);
+    double* obs = statistics;
+    double* obs2 = statistics + this->n_states*this->n_features;
+    if (full_covariance) {
+        // obs2 holds the lower triangles of sum_t posterior_t x_t x_t^T for each state.
+        const int n_features = this->n_features;
+        std::vector<double> frame(n_features);
+        for (int t = 0; t < traj_length; t++) {
+            for (int i = 0; i < n_features; i++)
+                frame[i] = trajectory.get<T>(t, i);
+            for (int j = 0; j < this->n_states; j++) {
+                const double weight = posteriors[t][j];
+                double* outer = obs2 + j*n_features*n_features;
+                for (int i = 0; i < n_features; i++) {
+                    const double weighted = weight*frame[i];
+                    obs[j*n_features+i] += weighted;
+                    for (int k = 0; k <= i; k++)
+                        outer[i*n_features+k] += weighted*frame[k];
+                }
+            }
+        }
+        return;
+    }
     std::vector<double> state_posteriors(traj_length);
     for (int i = 0; i < this->n_states; i++) {
         // Copy the posteriors into a compact array.  This makes memory access more efficient in the inner loop.
@@ -80,23 +185,15 @@ void GaussianHMMFitter<T>::accumulate_sufficient_statistics(const Trajectory& tr
                 temp1 += element*state_posteriors[k];
                 temp2 += element*element*state_posteriors[k];
             }
-            traj_obs[i*this->n_features+j] += temp1;
-            traj_obs2[i*this->n_features+j] += temp2;
-        }
-    }
-#pragma omp critical
-    {
-        for (int i = 0; i < this->n_states; i++) {
-            for (int j = 0; j < this->n_features; j++) {
-                obs[i*this->n_features+j] += traj_obs[i*this->n_features+j];
-                obs2[i*this->n_features+j] += traj_obs2[i*this->n_features+j];
-            }
+            obs[i*this->n_features+j] += temp1;
+            obs2[i*this->n_features+j] += temp2;
         }
     }
 }
 
 template <class T>
 void GaussianHMMFitter<T>::get_obs(double* output) {
+    const double* obs = &this->sufficient_statistics[0];
     for (int i = 0; i < this->n_states; i++)
         for (int j = 0; j < this->n_features; j++)
             output[i*this->n_features+j] = obs[i*this->n_features+j];
@@ -104,9 +201,30 @@ void GaussianHMMFitter<T>::get_obs(double* output) {
 
 template <class T>
 void GaussianHMMFitter<T>::get_obs2(double* output) {
+    const double* obs2 = &this->sufficient_statistics[this->n_states*this->n_features];
+    const int n_features = this->n_features;
     for (int i = 0; i < this->n_states; i++)
-        for (int j = 0; j < this->n_features; j++)
-            output[i*this->n_features+j] = obs2[i*this->n_features+j];
+        for (int j = 0; j < n_features; j++) {
+            if (full_covariance)
+                output[i*n_features+j] = obs2[(i*n_features+j)*n_features+j];
+            else
+                output[i*n_features+j] = obs2[i*n_features+j];
+        }
+}
+
+template <class T>
+void GaussianHMMFitter<T>::get_obs_outer(double* output) {
+    const double* outer = &this->sufficient_statistics[this->n_states*this->n_features];
+    const int n_features = this->n_features;
+    for (int i = 0; i < this->n_states; i++) {
+        const double* lower = outer + i*n_features*n_features;
+        double* result = output + i*n_features*n_features;
+        for (int j = 0; j < n_features; j++)
+            for (int k = 0; k <= j; k++) {
+                result[j*n_features+k] = lower[j*n_features+k];
+                result[k*n_features+j] = lower[j*n_features+k];
+            }
+    }
 }
 
 template <>
@@ -6,7 +6,8 @@
 namespace msmbuilder {
 
 /**
- * This subclass of HMMFitter computes Gaussian HMMs.
+ * This subclass of HMMFitter computes Gaussian HMMs.  The emission distributions have either diagonal covariance
+ * matrices (set_means_and_variances) or full ones, given by their Cholesky factors (set_means_and_covariance_factors).
  */
 template <class T>
 class GaussianHMMFitter : public HMMFitter<T> {
@@ -16,8 +17,17 @@ public:
     ~GaussianHMMFitter();
     
     void set_means_and_variances(const double* means, const double* variances);
+
+    /**
+     * Use full covariance matrices.
+     *
+     * @param means     the means, of shape (n_states, n_features)
+     * @param cholesky  the lower triangular Cholesky factors of the covariance matrices, of shape
+     *                  (n_states, n_features, n_features)
+     */
+    void set_means_and_covariance_factors(const double* means, const double* cholesky);
     
-    void initialize_sufficient_statistics();
+    int sufficient_statistics_size() const;
     
     void compute_log_likelihood(const Trajectory& trajectory,
                                 std::vector<std::vector<double> >& frame_log_probability) const;
@@ -26,16 +36,25 @@ public:
                                           const std::vector<std::vector<double> >& frame_log_probability,
                                           const std::vector<std::vector<double> >& posteriors,
                                           const std::vector<std::vector<double> >& fwdlattice,
-                                          const std::vector<std::vector<double> >& bwdlattice);
+                                          const std::vector<std::vector<double> >& bwdlattice,
+                                          double* statistics) const;
     
     void get_obs(double* output);
     
     void get_obs2(double* output);
 
+    /** Get the posterior-weighted sums of the outer products of the frames (full covariance only). */
+    void get_obs_outer(double* output);
+
     void do_mstep();
 private:
     void* owner;
-    std::vector<double> obs, obs2, a0, a1, a2;
+    bool full_covariance;
+    std::vector<double> a0, a1, a2;  // coefficients of the diagonal log likelihood, see set_means_and_variances()
+    std::vector<double> means, cholesky, inv_cholesky_diagonal, log_det;
+
+    void compute_log_likelihood_full(const Trajectory& trajectory,
+                                     std::vector<std::vector<double> >& frame_log_probability) const;
 };
 
 } // namespace msmbuilder
@@ -6,6 +6,9 @@
 #include <algorithm>
 #include <cmath>
 #include <vector>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 namespace msmbuilder {
 
@@ -28,23 +31,68 @@ public:
      */
     HMMFitter(int n_states, int n_features, int n_iter, const double* log_startprob) :
             n_states(n_states), n_features(n_features), n_iter(n_iter), log_startprob(log_startprob), log_transmat(n_states*n_states),
-            transition_counts(n_states, std::vector<double>(n_states, 0)), post(n_states, 0) {
+            transmat(n_states*n_states), transmat_float(n_states*n_states),
+            transition_counts(n_states, std::vector<double>(n_states, 0)), post(n_states, 0), stop_requested(false),
+            scaled_lattices(false), sparse_transitions(false) {
     }
 
     virtual ~HMMFitter() {
     }
     
-    /** Set the transition matrix. */
+    /**
+     * Set the transition matrix.  With sparse transitions, its zero entries are excluded from the model and the
+     * others are stored by row (CSR) and by column (CSC).
+     */
     void set_transmat(const double* transmat) {
         for (int i = 0; i < n_states*n_states; i++) {
             log_transmat[i] = std::log(std::max(transmat[i], 1e-20));
+            this->transmat[i] = std::exp(log_transmat[i]);
+            transmat_float[i] = (float) this->transmat[i];
         }
+        if (!sparse_transitions)
+            return;
+        csr.clear();
+        csc.clear();
+        csr.start.push_back(0);
+        for (int i = 0; i < n_states; i++) {
+            for (int j = 0; j < n_states; j++)
+                if (transmat[i*n_states+j] > 0)
+                    csr.append(j, this->transmat[i*n_states+j], log_transmat[i*n_states+j]);
+            csr.start.push_back(csr.index.size());
+        }
+        csc.start.push_back(0);
+        for (int j = 0; j < n_states; j++) {
+            for (int i = 0; i < n_states; i++)
+                if (transmat[i*n_states+j] > 0)
+                    csc.append(i, this->transmat[i*n_states+j], log_transmat[i*n_states+j]);
+            csc.start.push_back(csc.index.size());
+        }
+    }
+
+    /**
+     * Choose whether the zero entries of the transition matrix are dropped, so that the log-space forward-backward
+     * and Viterbi recursions cost O(n_nonzero) per frame instead of O(n_states**2).  The scaled forward-backward
+     * algorithm still uses the dense matrix (with the zeros raised to 1e-20): in single precision, the probability
+     * of a state that is only reachable through dropped transitions can vanish for good.  This must be called
+     * before set_transmat().
+     */
+    void set_sparse_transitions(bool sparse) {
+        sparse_transitions = sparse;
     }
 
     /**
-     * Initialize the sufficient statistics are the start of an iteration.  Subclasses must implement this.
+     * Choose how the forward-backward algorithm is computed.  By default the lattices hold log probabilities in
+     * double precision.  With scaled lattices they hold probabilities in single precision, normalized at every
+     * frame, which needs no exponentials in the recursions and half the memory, but is less accurate.
      */
-    virtual void initialize_sufficient_statistics() = 0;
+    void set_scaled_lattices(bool scaled) {
+        scaled_lattices = scaled;
+    }
+
+    /**
+     * Get the number of values in the emission-specific sufficient statistics.  Subclasses must implement this.
+     */
+    virtual int sufficient_statistics_size() const = 0;
 
     /**
      * Compute the log likelihood of each state in each frame of a trajectory.  Subclasses must implement this.
@@ -53,18 +101,29 @@ public:
                                         std::vector<std::vector<double> >& frame_log_probability) const = 0;
 
     /**
-     * Accumulate the sufficient statistics computed during an iteration.  Subclasses must implement this.
+     * Add the emission-specific sufficient statistics of one trajectory to a buffer of size
+     * sufficient_statistics_size().  Each thread accumulates into its own buffer, so this needs no locking.
+     * Subclasses must implement this.
      */
     virtual void accumulate_sufficient_statistics(const Trajectory& trajectory,
                                                   const std::vector<std::vector<double> >& frame_log_probability,
                                                   const std::vector<std::vector<double> >& posteriors,
                                                   const std::vector<std::vector<double> >& fwdlattice,
-                                                  const std::vector<std::vector<double> >& bwdlattice) = 0;
+                                                  const std::vector<std::vector<double> >& bwdlattice,
+                                                  double* statistics) const = 0;
 
     /**
      * Perform the M step of an iteration.  Subclasses must implement this.
      */
     virtual void do_mstep() = 0;
+
+    /**
+     * Ask fit() to return after the current iteration.  This may be called from do_mstep(), which can then leave
+     * the parameters unchanged.
+     */
+    void request_stop() {
+        stop_requested = true;
+    }
     
     /**
      * Fit the model to a set of Trajectories.
@@ -74,40 +133,10 @@ public:
      */
     void fit(const std::vector<Trajectory>& trajectories, double convergence_threshold) {
         iter_log_probability.clear();
+        stop_requested = false;
         for (int i = 0; i < n_iter; i++) {
             // Expectation step
-            initialize_sufficient_statistics();
-            double current_log_probability = 0.0;
-            for (int i = 0; i < n_states; i++)
-                for (int j = 0; j < n_states; j++)
-                    transition_counts[i][j] = 0.0;
-#pragma omp parallel for default(shared)
-            for (int j = 0; j < (int) trajectories.size(); j++) {
-                const Trajectory& trajectory = trajectories[j];
-                std::vector<std::vector<double> > frame_log_probability(trajectory.frames(), std::vector<double>(n_states));
-                std::vector<std::vector<double> > fwdlattice(trajectory.frames(), std::vector<double>(n_states));
-                std::vector<std::vector<double> > bwdlattice(trajectory.frames(), std::vector<double>(n_states));
-                std::vector<std::vector<double> > posteriors(trajectory.frames(), std::vector<double>(n_states));
-                std::vector<std::vector<double> > traj_transition_counts(n_states, std::vector<double>(n_states));
-                compute_log_likelihood(trajectory, frame_log_probability);
-                do_forward_pass(frame_log_probability, fwdlattice);
-                do_backward_pass(frame_log_probability, bwdlattice);
-                compute_posteriors(fwdlattice, bwdlattice, posteriors);
-                compute_transition_counts(frame_log_probability, fwdlattice, bwdlattice, traj_transition_counts);
-                double traj_log_probability = logsumexp(&fwdlattice[trajectory.frames()-1][0], n_states);
-                accumulate_sufficient_statistics(trajectory, frame_log_probability, posteriors, fwdlattice, bwdlattice);
-#pragma omp critical
-                {
-                    for (int k = 0; k < n_states; k++) {
-                        for (int m = 0; m < n_states; m++)
-                            transition_counts[k][m] += traj_transition_counts[k][m];
-                        for (int frame = 0; frame < trajectory.frames(); frame++)
-                            post[k] += posteriors[frame][k];
-                    }
-                    current_log_probability += traj_log_probability;
-                }
-            }
-            iter_log_probability.push_back(current_log_probability);
+            iter_log_probability.push_back(expectation_step(trajectories));
 
             // Check for convergence
             if (i > 0 && fabs(iter_log_probability[i]-iter_log_probability[i-1]) < convergence_threshold)
@@ -115,8 +144,83 @@ public:
 
             // Maximization step
             do_mstep();
+            if (stop_requested)
+                break;
         }
     }
+
+    /**
+     * Compute the expected sufficient statistics of a set of Trajectories under the current parameters, without
+     * updating the parameters.  The statistics can then be retrieved with get_transition_counts(), get_post() and
+     * the subclass accessors.
+     *
+     * @param trajectories  the set of Trajectories to compute statistics for
+     * @returns the log probability of the Trajectories
+     */
+    double expectation_step(const std::vector<Trajectory>& trajectories) {
+        // Every thread accumulates into its own buffer, laid out as
+        // [transition counts | posteriors | log probability | emission statistics],
+        // and the buffers are combined by a tree reduction at the end.
+        int n_threads = 1;
+#ifdef _OPENMP
+        n_threads = omp_get_max_threads();
+#endif
+        const int counts_offset = 0;
+        const int post_offset = counts_offset + n_states*n_states;
+        const int log_probability_offset = post_offset + n_states;
+        const int statistics_offset = log_probability_offset + 1;
+        const int buffer_size = statistics_offset + sufficient_statistics_size();
+        std::vector<std::vector<double> > thread_buffers(n_threads, std::vector<double>(buffer_size, 0.0));
+#pragma omp parallel default(shared)
+        {
+            int thread = 0;
+#ifdef _OPENMP
+            thread = omp_get_thread_num();
+#endif
+            double* buffer = &thread_buffers[thread][0];
+            ScaledLattices scaled;
+#pragma omp for schedule(dynamic)
+            for (int j = 0; j < (int) trajectories.size(); j++) {
+                const Trajectory& trajectory = trajectories[j];
+                int n_frames = trajectory.frames();
+                std::vector<std::vector<double> > frame_log_probability(n_frames, std::vector<double>(n_states));
+                std::vector<std::vector<double> > fwdlattice, bwdlattice;
+                std::vector<std::vector<double> > posteriors(n_frames, std::vector<double>(n_states));
+                std::vector<std::vector<double> > traj_transition_counts(n_states, std::vector<double>(n_states));
+                compute_log_likelihood(trajectory, frame_log_probability);
+                if (scaled_lattices) {
+                    buffer[log_probability_offset] += do_scaled_forward_backward(frame_log_probability, n_frames, scaled,
+                                                                                 &posteriors, &traj_transition_counts);
+                }
+                else {
+                    fwdlattice.resize(n_frames, std::vector<double>(n_states));
+                    bwdlattice.resize(n_frames, std::vector<double>(n_states));
+                    do_forward_pass(frame_log_probability, n_frames, fwdlattice);
+                    do_backward_pass(frame_log_probability, n_frames, bwdlattice);
+                    compute_posteriors(fwdlattice, bwdlattice, posteriors);
+                    compute_transition_counts(frame_log_probability, fwdlattice, bwdlattice, traj_transition_counts);
+                    buffer[log_probability_offset] += logsumexp(&fwdlattice[n_frames-1][0], n_states);
+                }
+                for (int k = 0; k < n_states; k++)
+                    for (int m = 0; m < n_states; m++)
+                        buffer[counts_offset+k*n_states+m] += traj_transition_counts[k][m];
+                for (int frame = 0; frame < n_frames; frame++)
+                    for (int k = 0; k < n_states; k++)
+                        buffer[post_offset+k] += posteriors[frame][k];
+                accumulate_sufficient_statistics(trajectory, frame_log_probability, posteriors, fwdlattice, bwdlattice,
+                                                 buffer+statistics_offset);
+            }
+        }
+        reduce_thread_buffers(thread_buffers);
+        const std::vector<double>& totals = thread_buffers[0];
+        for (int k = 0; k < n_states; k++) {
+            for (int m = 0; m < n_states; m++)
+                transition_counts[k][m] = totals[counts_offset+k*n_states+m];
+            post[k] = totals[post_offset+k];
+        }
+        sufficient_statistics.assign(totals.begin()+statistics_offset, totals.end());
+        return totals[log_probability_offset];
+    }
     
     /**
      * Compute the log probability of a set of Trajectories given this model.
@@ -125,13 +229,18 @@ public:
      */
     double score_trajectories(const std::vector<Trajectory>& trajectories) const {
         std::vector<std::vector<double> > frame_log_probability, fwdlattice;
+        ScaledLattices scaled;
         double log_probability = 0.0;
         for (int j = 0; j < (int) trajectories.size(); j++) {
             const Trajectory& trajectory = trajectories[j];
             frame_log_probability.resize(trajectory.frames(), std::vector<double>(n_states));
-            fwdlattice.resize(trajectory.frames(), std::vector<double>(n_states));
             compute_log_likelihood(trajectory, frame_log_probability);
-            do_forward_pass(frame_log_probability, fwdlattice);
+            if (scaled_lattices) {
+                log_probability += do_scaled_forward_backward(frame_log_probability, trajectory.frames(), scaled, NULL, NULL);
+                continue;
+            }
+            fwdlattice.resize(trajectory.frames(), std::vector<double>(n_states));
+            do_forward_pass(frame_log_probability, trajectory.frames(), fwdlattice);
             log_probability += logsumexp(&fwdlattice[trajectory.frames()-1][0], n_states);
         }
         return log_probability;
@@ -146,43 +255,69 @@ public:
      */
     double predict_state_sequence(const Trajectory& trajectory, int* state_sequence) const {
         std::vector<std::vector<double> > frame_log_probability(trajectory.frames(), std::vector<double>(n_states));
-        compute_log_likelihood(trajectory, frame_log_probability);
         std::vector<std::vector<double> > viterbi_lattice(trajectory.frames(), std::vector<double>(n_states));
-        std::vector<std::vector<double> > work_buffer(n_states, std::vector<double>(n_states));
-        
-        // Initialization.
-        
-        for (int i = 0; i < n_states; i++)
-            viterbi_lattice[0][i] = log_startprob[i]+frame_log_probability[0][i];
-        
-        // Induction.
-        
-        for (int t = 1; t < trajectory.frames(); t++) {
-            for (int i = 0; i < n_states; i++)
-                for (int j = 0; j < n_states; j++)
-                    work_buffer[i][j] = viterbi_lattice[t-1][j]+log_transmat[j*n_states+i]; // ???
-            for (int i = 0; i < n_states; i++)
-                viterbi_lattice[t][i] = *std::max_element(work_buffer[i].begin(), work_buffer[i].end()) + frame_log_probability[t][i];
-        }
-        
-        // Observation traceback.
-        
-        int max_pos = 0;
-        for (int i = 1; i < n_states; i++)
-            if (viterbi_lattice.back()[i] > viterbi_lattice.back()[max_pos])
-                max_pos = i;
-        state_sequence[trajectory.frames()-1] = max_pos;
-        double logprob = viterbi_lattice.back()[max_pos];
-        for (int t = trajectory.frames()-2; t >= 0; t--) {
-            max_pos = 0;
-            for (int i = 1; i < n_states; i++) {
-                double value = viterbi_lattice[t][i]+log_transmat[i*n_states+state_sequence[t+1]];
-                if (viterbi_lattice[t][i]+log_transmat[i*n_states+state_sequence[t+1]] > viterbi_lattice[t][max_pos]+log_transmat[max_pos*n_states+state_sequence[t+1]])
-                    max_pos = i;
+        compute_log_likelihood(trajectory, frame_log_probability);
+        return do_viterbi(frame_log_probability, trajectory.frames(), viterbi_lattice, state_sequence);
+    }
+
+    /**
+     * Decode a set of Trajectories in parallel: compute the Viterbi path of each one and, optionally, the posterior
+     * probability of each state in each frame.  The outputs are written into buffers supplied by the caller, so
+     * they can be preallocated (or memory mapped) arrays.  Each thread allocates its lattices once and reuses them
+     * for all the Trajectories it decodes.
+     *
+     * @param trajectories       the Trajectories to decode
+     * @param state_sequences    state_sequences[j] receives the Viterbi path of trajectory j (frames() values)
+     * @param posteriors         if not NULL, posteriors[j] receives the posterior probabilities of trajectory j as a
+     *                           row major frames() x n_states array (or is skipped if it is NULL)
+     * @param log_probabilities  log_probabilities[j] receives the log probability of the Viterbi path of trajectory j
+     */
+    void decode_trajectories(const std::vector<Trajectory>& trajectories, int* const* state_sequences,
+                             double* const* posteriors, double* log_probabilities) const {
+#pragma omp parallel default(shared)
+        {
+            std::vector<std::vector<double> > frame_log_probability, viterbi_lattice, fwdlattice, bwdlattice, scaled_posteriors;
+            ScaledLattices scaled;
+#pragma omp for schedule(dynamic)
+            for (int j = 0; j < (int) trajectories.size(); j++) {
+                const Trajectory& trajectory = trajectories[j];
+                int n_frames = trajectory.frames();
+                bool want_posteriors = (posteriors != NULL && posteriors[j] != NULL);
+                if ((int) frame_log_probability.size() < n_frames) {
+                    frame_log_probability.resize(n_frames, std::vector<double>(n_states));
+                    viterbi_lattice.resize(n_frames, std::vector<double>(n_states));
+                }
+                if (want_posteriors && scaled_lattices) {
+                    if ((int) scaled_posteriors.size() < n_frames)
+                        scaled_posteriors.resize(n_frames, std::vector<double>(n_states));
+                }
+                else if (want_posteriors && (int) fwdlattice.size() < n_frames) {
+                    fwdlattice.resize(n_frames, std::vector<double>(n_states));
+                    bwdlattice.resize(n_frames, std::vector<double>(n_states));
+                }
+                compute_log_likelihood(trajectory, frame_log_probability);
+                log_probabilities[j] = do_viterbi(frame_log_probability, n_frames, viterbi_lattice, state_sequences[j]);
+                if (want_posteriors && scaled_lattices) {
+                    do_scaled_forward_backward(frame_log_probability, n_frames, scaled, &scaled_posteriors, NULL);
+                    double* output = posteriors[j];
+                    for (int t = 0; t < n_frames; t++)
+                        std::copy(scaled_posteriors[t].begin(), scaled_posteriors[t].end(), output+t*n_states);
+                }
+                else if (want_posteriors) {
+                    do_forward_pass(frame_log_probability, n_frames, fwdlattice);
+                    do_backward_pass(frame_log_probability, n_frames, bwdlattice);
+                    double* output = posteriors[j];
+                    for (int t = 0; t < n_frames; t++) {
+                        double* row = output+t*n_states;
+                        for (int i = 0; i < n_states; i++)
+                            row[i] = fwdlattice[t][i] + bwdlattice[t][i];
+                        double normalizer = logsumexp(row, n_states);
+                        for (int i = 0; i < n_states; i++)
+                            row[i] = std::exp(row[i]-normalizer);
+                    }
+                }
             }
-            state_sequence[t] = max_pos;
         }
-        return logprob;
     }
     
     void get_transition_counts(double* output) {
@@ -207,36 +342,232 @@ public:
 protected:
     int n_states, n_features, n_iter;
     const double* log_startprob;
-    std::vector<double> log_transmat, iter_log_probability;
+    std::vector<double> log_transmat, transmat, iter_log_probability;
+    std::vector<float> transmat_float;
     std::vector<std::vector<double> > transition_counts;
-    std::vector<double> post;
+    std::vector<double> post, sufficient_statistics;
+    bool stop_requested, scaled_lattices, sparse_transitions;
+
+    /** The nonzero entries of the transition matrix, compressed by rows (CSR) or by columns (CSC). */
+    struct SparseTransitions {
+        std::vector<int> start, index;
+        std::vector<double> value, log_value;
+
+        void clear() {
+            start.clear();
+            index.clear();
+            value.clear();
+            log_value.clear();
+        }
+
+        void append(int i, double p, double log_p) {
+            index.push_back(i);
+            value.push_back(p);
+            log_value.push_back(log_p);
+        }
+    };
+    SparseTransitions csr, csc;
+
+    /** Scratch space for do_scaled_forward_backward(), which only ever grows. */
+    struct ScaledLattices {
+        std::vector<float> emission, fwdlattice, bwdlattice, work;
+        std::vector<double> log_scale, inv_scale, counts;
+    };
+
+    /**
+     * Sum a set of per-thread buffers into the first one.  Pairs of buffers are added in
+     * log2(n_buffers) rounds, and the pairs within a round are independent of each other.
+     */
+    static void reduce_thread_buffers(std::vector<std::vector<double> >& buffers) {
+        int n_buffers = buffers.size();
+        for (int stride = 1; stride < n_buffers; stride *= 2) {
+#pragma omp parallel for default(shared) if (n_buffers > 2*stride)
+            for (int k = 0; k < n_buffers-stride; k += 2*stride) {
+                std::vector<double>& target = buffers[k];
+                const std::vector<double>& source = buffers[k+stride];
+                for (int m = 0; m < (int) target.size(); m++)
+                    target[m] += source[m];
+            }
+        }
+    }
     
-    void do_forward_pass(const std::vector<std::vector<double> >& frame_log_probability,
+    /** Compute out = in P, where P is the transition matrix. */
+    void forward_product(const double* in, double* out) const {
+        if (sparse_transitions) {
+            for (int j = 0; j < n_states; j++) {
+                double sum = 0;
+                for (int k = csc.start[j]; k < csc.start[j+1]; k++)
+                    sum += in[csc.index[k]]*csc.value[k];
+                out[j] = sum;
+            }
+            return;
+        }
+        std::fill(out, out+n_states, 0.0);
+        for (int i = 0; i < n_states; i++) {
+            const double weight = in[i];
+            const double* row = &transmat[i*n_states];
+            for (int j = 0; j < n_states; j++)
+                out[j] += weight*row[j];
+        }
+    }
+
+    /** Compute out = P in, where P is the transition matrix. */
+    void backward_product(const double* in, double* out) const {
+        if (sparse_transitions) {
+            for (int i = 0; i < n_states; i++) {
+                double sum = 0;
+                for (int k = csr.start[i]; k < csr.start[i+1]; k++)
+                    sum += csr.value[k]*in[csr.index[k]];
+                out[i] = sum;
+            }
+            return;
+        }
+        for (int i = 0; i < n_states; i++) {
+            const double* row = &transmat[i*n_states];
+            double sum = 0;
+            for (int j = 0; j < n_states; j++)
+                sum += row[j]*in[j];
+            out[i] = sum;
+        }
+    }
+
+    /**
+     * Add the outer product of from and to to the expected transition counts, which are stored densely or, with
+     * sparse transitions, at the nonzero entries in CSR order.
+     */
+    void add_transition_outer(const double* from, const double* to, double* counts) const {
+        if (sparse_transitions) {
+            for (int i = 0; i < n_states; i++) {
+                const double weight = from[i];
+                for (int k = csr.start[i]; k < csr.start[i+1]; k++)
+                    counts[k] += weight*to[csr.index[k]];
+            }
+            return;
+        }
+        for (int i = 0; i < n_states; i++) {
+            const double weight = from[i];
+            double* row = &counts[i*n_states];
+            for (int j = 0; j < n_states; j++)
+                row[j] += weight*to[j];
+        }
+    }
+
+    /** The number of transition counts accumulated by add_transition_outer(). */
+    int transition_outer_size() const {
+        return sparse_transitions ? csr.index.size() : n_states*n_states;
+    }
+
+    /** Multiply the accumulated outer products by the transition probabilities to get the expected counts. */
+    void finish_transition_counts(const double* counts, std::vector<std::vector<double> >& transition_counts) const {
+        if (sparse_transitions) {
+            for (int i = 0; i < n_states; i++) {
+                std::fill(transition_counts[i].begin(), transition_counts[i].end(), 0.0);
+                for (int k = csr.start[i]; k < csr.start[i+1]; k++)
+                    transition_counts[i][csr.index[k]] = counts[k]*csr.value[k];
+            }
+            return;
+        }
+        for (int i = 0; i < n_states; i++)
+            for (int j = 0; j < n_states; j++)
+                transition_counts[i][j] = counts[i*n_states+j]*transmat[i*n_states+j];
+    }
+
+    /**
+     * Compute the most likely sequence of states for the first n_frames frames of a precomputed emission log
+     * likelihood matrix, and return its log probability.  viterbi_lattice must have at least n_frames rows.
+     */
+    double do_viterbi(const std::vector<std::vector<double> >& frame_log_probability, int n_frames,
+                      std::vector<std::vector<double> >& viterbi_lattice, int* state_sequence) const {
+        // Initialization.
+        
+        for (int i = 0; i < n_states; i++)
+            viterbi_lattice[0][i] = log_startprob[i]+frame_log_probability[0][i];
+        
+        // Induction.
+        
+        for (int t = 1; t < n_frames; t++) {
+            const double* previous = &viterbi_lattice[t-1][0];
+            for (int i = 0; i < n_states; i++) {
+                double best;
+                if (sparse_transitions) {
+                    best = -INFINITY;
+                    for (int k = csc.start[i]; k < csc.start[i+1]; k++)
+                        best = std::max(best, previous[csc.index[k]]+csc.log_value[k]);
+                }
+                else {
+                    best = previous[0]+log_transmat[i];
+                    for (int j = 1; j < n_states; j++)
+                        best = std::max(best, previous[j]+log_transmat[j*n_states+i]);
+                }
+                viterbi_lattice[t][i] = best + frame_log_probability[t][i];
+            }
+        }
+        
+        // Observation traceback.
+        
+        int max_pos = 0;
+        for (int i = 1; i < n_states; i++)
+            if (viterbi_lattice[n_frames-1][i] > viterbi_lattice[n_frames-1][max_pos])
+                max_pos = i;
+        state_sequence[n_frames-1] = max_pos;
+        double logprob = viterbi_lattice[n_frames-1][max_pos];
+        for (int t = n_frames-2; t >= 0; t--) {
+            const int next = state_sequence[t+1];
+            if (sparse_transitions) {
+                double best = -INFINITY;
+                max_pos = csc.index[csc.start[next]];
+                for (int k = csc.start[next]; k < csc.start[next+1]; k++) {
+                    if (viterbi_lattice[t][csc.index[k]]+csc.log_value[k] > best) {
+                        best = viterbi_lattice[t][csc.index[k]]+csc.log_value[k];
+                        max_pos = csc.index[k];
+                    }
+                }
+            }
+            else {
+                max_pos = 0;
+                for (int i = 1; i < n_states; i++) {
+                    if (viterbi_lattice[t][i]+log_transmat[i*n_states+next] > viterbi_lattice[t][max_pos]+log_transmat[max_pos*n_states+next])
+                        max_pos = i;
+                }
+            }
+            state_sequence[t] = max_pos;
+        }
+        return logprob;
+    }
+    
+    void do_forward_pass(const std::vector<std::vector<double> >& frame_log_probability, int n_frames,
                          std::vector<std::vector<double> >& fwdlattice) const {
         for (int i = 0; i < n_states; i++)
             fwdlattice[0][i] = log_startprob[i] + frame_log_probability[0][i];
-        std::vector<double> work_buffer(n_states);
-        for (int t = 1; t < (int) fwdlattice.size(); t++) {
-            for (int j = 0; j < n_states; j++) {
-                for (int i = 0; i < n_states; i++)
-                    work_buffer[i] = fwdlattice[t-1][i] + log_transmat[i*n_states+j];
-                fwdlattice[t][j] = logsumexp(&work_buffer[0], n_states) + frame_log_probability[t][j];
-            }
+        // Shifting by the largest log probability of the previous frame turns the sum over the previous states into
+        // a product with the transition matrix, with n_states exponentials per frame instead of n_states**2.
+        std::vector<double> scaled(n_states), sum(n_states);
+        for (int t = 1; t < n_frames; t++) {
+            const double* previous = &fwdlattice[t-1][0];
+            double shift = *std::max_element(previous, previous+n_states);
+            for (int i = 0; i < n_states; i++)
+                scaled[i] = std::exp(previous[i]-shift);
+            forward_product(&scaled[0], &sum[0]);
+            for (int j = 0; j < n_states; j++)
+                fwdlattice[t][j] = shift + std::log(sum[j]) + frame_log_probability[t][j];
         }
     }
     
-    void do_backward_pass(const std::vector<std::vector<double> >& frame_log_probability,
+    void do_backward_pass(const std::vector<std::vector<double> >& frame_log_probability, int n_frames,
                           std::vector<std::vector<double> >& bwdlattice) const {
-        int sequence_length = bwdlattice.size();
+        int sequence_length = n_frames;
         for (int i = 0; i < n_states; i++)
             bwdlattice[sequence_length-1][i] = 0;
-        std::vector<double> work_buffer(n_states);
+        std::vector<double> work_buffer(n_states), scaled(n_states), sum(n_states);
         for (int t = sequence_length-2; t >= 0; t--) {
-            for (int i = 0; i < n_states; i++) {
-                for (int j = 0; j < n_states; j++)
-                    work_buffer[j] = frame_log_probability[t+1][j] + bwdlattice[t+1][j] + log_transmat[i*n_states+j];
-                bwdlattice[t][i] = logsumexp(&work_buffer[0], n_states);
-            }
+            for (int j = 0; j < n_states; j++)
+                work_buffer[j] = frame_log_probability[t+1][j] + bwdlattice[t+1][j];
+            double shift = *std::max_element(work_buffer.begin(), work_buffer.end());
+            for (int j = 0; j < n_states; j++)
+                scaled[j] = std::exp(work_buffer[j]-shift);
+            backward_product(&scaled[0], &sum[0]);
+            for (int i = 0; i < n_states; i++)
+                bwdlattice[t][i] = shift + std::log(sum[i]);
         }
     }
     
@@ -257,16 +588,153 @@ protected:
                                      const std::vector<std::vector<double> >& fwdlattice,
                                      const std::vector<std::vector<double> >& bwdlattice,
                                      std::vector<std::vector<double> >& transition_counts) const {
+        // The expected number of i -> j transitions at frame t factors into a term for i, one for j and the transition
+        // probability, which is applied once at the end.  Shifting each factor by its largest value keeps the
+        // exponentials in range, with 2*n_states exponentials per frame instead of n_states**2.
         int sequence_length = fwdlattice.size();
-        std::vector<double> work_buffer(sequence_length);
         double logprob = logsumexp(&fwdlattice[sequence_length-1][0], n_states);
-        for (int i = 0; i < n_states; i++) {
-            for (int j = 0; j < n_states; j++) {
-                for (int t = 0; t < sequence_length-1; t++)
-                    work_buffer[t] = fwdlattice[t][i] + log_transmat[i*n_states+j] + frame_log_probability[t+1][j] + bwdlattice[t+1][j] - logprob;
-                transition_counts[i][j] = std::exp(logsumexp(&work_buffer[0], sequence_length-1));
+        std::vector<double> from(n_states), to(n_states), counts(transition_outer_size(), 0.0);
+        for (int t = 0; t < sequence_length-1; t++) {
+            const double* fwd = &fwdlattice[t][0];
+            double from_shift = *std::max_element(fwd, fwd+n_states);
+            for (int j = 0; j < n_states; j++)
+                to[j] = frame_log_probability[t+1][j] + bwdlattice[t+1][j];
+            double to_shift = *std::max_element(to.begin(), to.end());
+            double scale = std::exp(from_shift+to_shift-logprob);
+            for (int i = 0; i < n_states; i++)
+                from[i] = scale*std::exp(fwd[i]-from_shift);
+            for (int j = 0; j < n_states; j++)
+                to[j] = std::exp(to[j]-to_shift);
+            add_transition_outer(&from[0], &to[0], &counts[0]);
+        }
+        finish_transition_counts(&counts[0], transition_counts);
+    }
+
+    /**
+     * Run the forward-backward algorithm on probabilities in single precision, normalized at every frame (the
+     * scaled forward-backward algorithm), instead of log probabilities.
+     *
+     * @param frame_log_probability  the log likelihood of each state in each frame
+     * @param n_frames               the number of frames to use from frame_log_probability
+     * @param scratch                scratch space, reused between calls
+     * @param posteriors             if not NULL, receives the posterior probability of each state in each frame
+     * @param transition_counts      if not NULL, receives the expected number of transitions between each pair of
+     *                               states
+     * @returns the log probability of the trajectory
+     */
+    double do_scaled_forward_backward(const std::vector<std::vector<double> >& frame_log_probability, int n_frames,
+                                      ScaledLattices& scratch, std::vector<std::vector<double> >* posteriors,
+                                      std::vector<std::vector<double> >* transition_counts) const {
+        const int K = n_states;
+        if ((int) scratch.log_scale.size() < n_frames) {
+            scratch.emission.resize(n_frames*K);
+            scratch.fwdlattice.resize(n_frames*K);
+            scratch.bwdlattice.resize(n_frames*K);
+            scratch.log_scale.resize(n_frames);
+            scratch.inv_scale.resize(n_frames);
+        }
+        scratch.work.resize(K);
+        float* emission = &scratch.emission[0];
+        float* fwd = &scratch.fwdlattice[0];
+        float* bwd = &scratch.bwdlattice[0];
+        float* work = &scratch.work[0];
+        const float* trans = &transmat_float[0];
+
+        // Products of small probabilities quickly reach the subnormal range in single precision, where arithmetic is
+        // very slow.  They are negligible next to the normalization, so they are flushed to zero.
+        const unsigned int csr = _mm_getcsr();
+        _mm_setcsr(csr | 0x8040);
+
+        // Emission probabilities, relative to the most likely state of each frame.
+        double log_probability = 0;
+        for (int t = 0; t < n_frames; t++) {
+            const double* row = &frame_log_probability[t][0];
+            double shift = *std::max_element(row, row+K);
+            for (int j = 0; j < K; j++)
+                emission[t*K+j] = (float) std::exp(row[j]-shift);
+            log_probability += shift;
+        }
+
+        // Forward pass.
+        for (int j = 0; j < K; j++)
+            fwd[j] = (float) std::exp(log_startprob[j])*emission[j];
+        for (int t = 0; t < n_frames; t++) {
+            float* alpha = fwd+t*K;
+            if (t > 0) {
+                const float* previous = alpha-K;
+                std::fill(alpha, alpha+K, 0.0f);
+                for (int i = 0; i < K; i++) {
+                    const float weight = previous[i];
+                    const float* row = trans+i*K;
+                    for (int j = 0; j < K; j++)
+                        alpha[j] += weight*row[j];
+                }
+                for (int j = 0; j < K; j++)
+                    alpha[j] *= emission[t*K+j];
+            }
+            double sum = 0;
+            for (int j = 0; j < K; j++)
+                sum += alpha[j];
+            const float inv_sum = (float) (1.0/sum);
+            for (int j = 0; j < K; j++)
+                alpha[j] *= inv_sum;
+            scratch.log_scale[t] = std::log(sum);
+            scratch.inv_scale[t] = 1.0/sum;
+            log_probability += scratch.log_scale[t];
+        }
+        if (posteriors == NULL && transition_counts == NULL) {
+            _mm_setcsr(csr);
+            return log_probability;
+        }
+
+        // Backward pass, with the same scaling as the forward pass.
+        std::fill(bwd+(n_frames-1)*K, bwd+n_frames*K, 1.0f);
+        for (int t = n_frames-2; t >= 0; t--) {
+            const float inv_scale = (float) scratch.inv_scale[t+1];
+            for (int j = 0; j < K; j++)
+                work[j] = emission[(t+1)*K+j]*bwd[(t+1)*K+j]*inv_scale;
+            for (int i = 0; i < K; i++) {
+                const float* row = trans+i*K;
+                float sum = 0;
+                for (int j = 0; j < K; j++)
+                    sum += row[j]*work[j];
+                bwd[t*K+i] = sum;
+            }
+        }
+
+        if (posteriors != NULL) {
+            for (int t = 0; t < n_frames; t++) {
+                double* gamma = &(*posteriors)[t][0];
+                double sum = 0;
+                for (int i = 0; i < K; i++) {
+                    gamma[i] = (double) fwd[t*K+i]*bwd[t*K+i];
+                    sum += gamma[i];
+                }
+                for (int i = 0; i < K; i++)
+                    gamma[i] /= sum;
+            }
+        }
+
+        if (transition_counts != NULL) {
+            scratch.counts.assign(K*K, 0.0);
+            double* counts = &scratch.counts[0];
+            for (int t = 0; t < n_frames-1; t++) {
+                const float inv_scale = (float) scratch.inv_scale[t+1];
+                for (int j = 0; j < K; j++)
+                    work[j] = emission[(t+1)*K+j]*bwd[(t+1)*K+j]*inv_scale;
+                for (int i = 0; i < K; i++) {
+                    const float weight = fwd[t*K+i];
+                    double* row = counts+i*K;
+                    for (int j = 0; j < K; j++)
+                        row[j] += weight*work[j];
+                }
             }
+            for (int i = 0; i < K; i++)
+                for (int j = 0; j < K; j++)
+                    (*transition_counts)[i][j] = counts[i*K+j]*transmat[i*K+j];
         }
+        _mm_setcsr(csr);
+        return log_probability;
     }
 };
 
@@ -17,7 +17,7 @@ public:
     
     void set_means_and_kappas(const double* means, const double* kappas);
     
-    void initialize_sufficient_statistics();
+    int sufficient_statistics_size() const;
     
     void compute_log_likelihood(const Trajectory& trajectory,
                                 std::vector<std::vector<double> >& frame_log_probability) const;
@@ -26,7 +26,8 @@ public:
                                           const std::vector<std::vector<double> >& frame_log_probability,
                                           const std::vector<std::vector<double> >& posteriors,
                                           const std::vector<std::vector<double> >& fwdlattice,
-                                          const std::vector<std::vector<double> >& bwdlattice);
+                                          const std::vector<std::vector<double> >& bwdlattice,
+                                          double* statistics) const;
     
     void get_cosobs(double* output);
 
@@ -35,7 +36,8 @@ public:
     void do_mstep();
 private:
     void* owner;
-    std::vector<double> cosobs, sinobs, means, kappas;
+    std::vector<double> means, kappas;
+    std::vector<double> log_normalizer, kappa_cos_means, kappa_sin_means;  // precomputed by set_means_and_kappas()
 };
 
 } // namespace msmbuilder
@@ -2,6 +2,7 @@ from __future__ import print_function, division, absolute_import
 
 import numpy as np
 from ..msm import MarkovStateModel
+from ..msm.core import _fill_or_clip
 
 
 class PCCA(MarkovStateModel):
@@ -82,20 +83,32 @@ class PCCA(MarkovStateModel):
         self.microstate_mapping_ = microstate_mapping
 
     def partial_transform(self, sequence, mode='clip'):
-        trimmed_sequence = super(PCCA, self).partial_transform(sequence, mode)
-        if mode == 'clip':
-            return [self.microstate_mapping_[seq] for seq in trimmed_sequence]
-        elif mode == 'fill':
-            def nan_get(x):
-                try:
-                    x = int(x)
-                    return self.microstate_mapping_[x]
-                except ValueError:
-                    return np.nan
-
-            return np.asarray([nan_get(x) for x in trimmed_sequence])
-        else:
-            raise ValueError
+        """Transform a sequence of microstate labels to macrostates.
+
+        The labels are looked up in ``mapping_`` and ``microstate_mapping_``
+        at once, by gathering from a single integer lookup table.
+
+        Parameters
+        ----------
+        sequence : array-like
+            A 1D iterable of state labels.
+        mode : {'clip', 'fill'}
+            Method by which to treat labels in `sequence` which do not have
+            a corresponding microstate. See
+            ``MarkovStateModel.partial_transform``.
+
+        Returns
+        -------
+        mapped_sequence : list or ndarray
+            If mode is "fill", return an ndarray of macrostates, with NaN
+            for the unmapped labels. If mode is "clip", return a list of
+            ndarrays of macrostates.
+        """
+        if mode not in ['clip', 'fill']:
+            raise ValueError('mode must be one of ["clip", "fill"]: %s' % mode)
+        # the last entry maps the -1 of unmapped labels to -1
+        lookup = np.append(self.microstate_mapping_, -1)
+        return _fill_or_clip(lookup[self._label_indices(sequence)], mode)
 
     @classmethod
     def from_msm(cls, msm, n_macrostates):
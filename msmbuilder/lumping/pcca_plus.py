@@ -5,6 +5,10 @@ from numpy import dot, diag, trace as tr
 from numpy.linalg import inv, norm
 
 import scipy.optimize
+import scipy.sparse
+from sklearn.externals.joblib import Parallel, delayed
+from sklearn.utils import check_random_state
+
 from .pcca import PCCA
 
 
@@ -24,6 +28,15 @@ class PCCAPlus(PCCA):
     objective_function: {'crisp_metastablility', 'metastability',
                          'metastability'}
         Possible objective functions.  See objective for details.
+    n_restarts : int, default=10
+        Number of random perturbations of the initial transformation matrix
+        from which the optimization is restarted, besides the initial
+        matrix itself.
+    n_jobs : int, default=1
+        Number of restarts to optimize in parallel using joblib.Parallel.
+    random_state : int or RandomState instance or None (default)
+        Pseudo Random Number generator seed control. If None, use the
+        numpy.random singleton.
     kwargs : optional
         Additional keyword arguments to be passed to MarkovStateModel.  See
         msmbuilder.msm.MarkovStateModel for possible options.
@@ -42,7 +55,12 @@ class PCCAPlus(PCCA):
     The membership matrix chi is given by chi = dot(vr,A).
 
     The transformation matrix A is the output of a constrained
-    optimization problem.
+    optimization problem. The metastability and crispness objectives are
+    maximized with L-BFGS-B using their analytic gradients, from the
+    initial guess of [1] and from ``n_restarts`` random perturbations of
+    it. The crisp_metastability objective is piecewise constant, so the
+    restarts maximize the (fuzzy) metastability instead, and the restart
+    with the largest crisp_metastability is kept.
 
     You have three choices for objective function: crispness, metastability,
     or crisp_metastability
@@ -91,7 +109,8 @@ class PCCAPlus(PCCA):
     """
 
     def __init__(self, n_macrostates, do_minimization=True,
-                 objective_function='crisp_metastability', **kwargs):
+                 objective_function='crisp_metastability', n_restarts=10,
+                 n_jobs=1, random_state=None, **kwargs):
 
         super(PCCAPlus, self).__init__(n_macrostates, **kwargs)
         obj_functions = dict(
@@ -107,6 +126,9 @@ class PCCAPlus(PCCA):
 
         self.objective_function = objective_function
         self.do_minimization = do_minimization
+        self.n_restarts = n_restarts
+        self.n_jobs = n_jobs
+        self.random_state = random_state
 
     def _do_lumping(self):
         """Perform PCCA+ algorithm by optimizing transformation matrix A.
@@ -155,29 +177,215 @@ class PCCAPlus(PCCA):
         flat_map, square_map = get_maps(A)
         alpha = to_flat(1.0 * A, flat_map)
 
+        # small perturbations: larger ones mostly land in worse local optima
+        random = check_random_state(self.random_state)
+        scale = 0.01 * np.mean(np.abs(alpha))
+        starts = [alpha] + [alpha + random.uniform(-scale, scale, alpha.shape)
+                            for _ in range(self.n_restarts)]
+
+        # crisp_metastability is piecewise constant, so the restarts
+        # maximize the fuzzy metastability instead
+        if self.objective_function == 'crispness':
+            smooth_objective = 'crispness'
+        else:
+            smooth_objective = 'metastability'
+        terms = objective_terms(self.transmat_, right_eigenvectors,
+                                self.populations_)
+
+        results = Parallel(n_jobs=self.n_jobs)(
+            delayed(_maximize_smooth)(start, right_eigenvectors, square_map,
+                                      smooth_objective, terms)
+            for start in starts)
+
         def obj(x):
-            return -1 * self._objective_function(
-                    x, self.transmat_, right_eigenvectors, square_map,
-                    self.populations_
+            return -1 * evaluate_objective(
+                    x, right_eigenvectors, square_map,
+                    self.objective_function, terms
             )
 
-        alpha = scipy.optimize.basinhopping(
-                obj, alpha, niter_success=1000,
-        )['x']
+        # keep the initial guess, in case every restart ends at a degenerate
+        # lumping
+        candidates = [alpha] + results
+        alpha = candidates[np.argmin([obj(x) for x in candidates])]
+        if np.isposinf(obj(alpha)):
+            raise ValueError(
+                    "Error: minimization has not located a feasible point.")
 
         alpha = scipy.optimize.fmin(
                 obj, alpha, full_output=True, xtol=1E-4, ftol=1E-4,
                 maxfun=5000, maxiter=100000
         )[0]
 
-        if np.isneginf(obj(alpha)):
-            raise ValueError(
-                    "Error: minimization has not located a feasible point.")
-
         A = to_square(alpha, square_map)
         return A
 
 
+def _maximize_smooth(alpha, right_eigenvectors, square_map, objective,
+                     terms):
+    """Maximize the crispness or metastability from alpha with L-BFGS-B."""
+
+    def obj(x):
+        value, gradient = objective_and_gradient(
+            x, right_eigenvectors, square_map, objective, terms)
+        return -value, -gradient
+
+    return scipy.optimize.minimize(obj, alpha, jac=True,
+                                   method='L-BFGS-B')['x']
+
+
+def objective_terms(T, right_eigenvectors, pi):
+    """Precompute the parts of the PCCA+ objective functions that do not
+    depend on the transformation matrix.
+
+    Parameters
+    ----------
+    T : ndarray or sparse matrix
+        Transition matrix
+    right_eigenvectors : ndarray
+        The right eigenvectors.
+    pi : ndarray
+        Equilibrium Populations of transition matrix.
+
+    Returns
+    -------
+    M : ndarray
+        The symmetric part of V^T diag(pi) T V, so that the numerator of
+        the metastability of macrostate j is dot(A[:, j], M.dot(A[:, j])).
+    p : ndarray
+        V^T pi, so that the population of macrostate j is dot(p, A[:, j]).
+    flux : scipy.sparse.coo_matrix
+        The nonzero entries of diag(pi) T.
+    pi : ndarray
+        Equilibrium Populations of transition matrix.
+    """
+    V = right_eigenvectors.real
+    M = dot(V.T, pi[:, np.newaxis] * T.dot(V))
+    flux = scipy.sparse.coo_matrix(scipy.sparse.diags(pi).dot(T))
+    return (M + M.T) / 2, dot(V.T, pi), flux, pi
+
+
+def evaluate_objective(alpha, right_eigenvectors, square_map, objective,
+                       terms):
+    """Return a PCCA+ objective function from precomputed terms.
+
+    This is equal to crispness(), metastability() or crisp_metastability(),
+    including their feasibility checks, but only costs O(n_states *
+    n_macrostates^2) operations plus, for crisp_metastability, one pass
+    over the nonzero transition probabilities.
+
+    Parameters
+    ----------
+    alpha : ndarray
+        Parameters of objective function (e.g. flattened A)
+    right_eigenvectors : ndarray
+        The right eigenvectors.
+    square_map : ndarray
+        Mapping from square indices (i,j) to flat indices (k).
+    objective : {'crispness', 'metastability', 'crisp_metastability'}
+        The objective function.
+    terms : tuple
+        The output of objective_terms.
+
+    Returns
+    -------
+    obj : float
+        The objective function
+    """
+    M, p, flux, pi = terms
+    num_eigen = right_eigenvectors.shape[1]
+
+    A, chi, mapping = calculate_fuzzy_chi(alpha, square_map,
+                                          right_eigenvectors)
+
+    # If current point is infeasible or leads to degenerate lumping.
+    if (len(np.unique(mapping)) != num_eigen or
+            has_constraint_violation(A, right_eigenvectors)):
+        return -1.0 * np.inf
+
+    if objective == 'crispness':
+        return tr(dot(diag(1. / A[0]), dot(A.transpose(), A)))
+    elif objective == 'metastability':
+        return ((A * dot(M, A)).sum(0) / dot(p, A)).sum()
+    elif objective == 'crisp_metastability':
+        same = mapping[flux.row] == mapping[flux.col]
+        numerators = np.bincount(mapping[flux.row[same]],
+                                 weights=flux.data[same],
+                                 minlength=num_eigen)
+        return (numerators / np.bincount(mapping, weights=pi,
+                                         minlength=num_eigen)).sum()
+    raise ValueError("objective must be one of 'crispness', "
+                     "'metastability', 'crisp_metastability'")
+
+
+def objective_and_gradient(alpha, right_eigenvectors, square_map, objective,
+                           terms):
+    """Return a smooth PCCA+ objective function and its gradient.
+
+    Parameters
+    ----------
+    alpha : ndarray
+        Parameters of objective function (e.g. flattened A)
+    right_eigenvectors : ndarray
+        The right eigenvectors.
+    square_map : ndarray
+        Mapping from square indices (i,j) to flat indices (k).
+    objective : {'crispness', 'metastability'}
+        The objective function.
+    terms : tuple
+        The output of objective_terms.
+
+    Returns
+    -------
+    obj : float
+        The objective function, without the feasibility checks of
+        crispness() and metastability().
+    gradient : ndarray
+        The gradient of obj with respect to alpha.
+
+    Notes
+    -------
+    The gradient is propagated back through fill_A, whose first row is
+    linear in A[1:] given the microstate at which each column attains its
+    minimum, so it is exact wherever that microstate is unique.
+    """
+    num_eigen = right_eigenvectors.shape[1]
+    V1 = right_eigenvectors[:, 1:].real
+    columns = np.arange(num_eigen)
+
+    # fill_A, keeping the intermediates
+    A_raw = to_square(alpha, square_map).astype(float)
+    A_raw[1:, 0] = -1 * A_raw[1:, 1:].sum(1)
+    chi = dot(V1, A_raw[1:])
+    argmin = chi.argmin(0)
+    A_raw[0] = -1 * chi[argmin, columns]
+    scale = A_raw[0].sum()
+    A = A_raw / scale
+
+    if objective == 'crispness':
+        norms = (A ** 2).sum(0)
+        obj = (norms / A[0]).sum()
+        grad = 2 * A / A[0]
+        grad[0] -= norms / A[0] ** 2
+    elif objective == 'metastability':
+        M, p = terms[:2]
+        MA = dot(M, A)
+        numerators = (A * MA).sum(0)
+        populations = dot(p, A)
+        obj = (numerators / populations).sum()
+        grad = (2 * MA / populations -
+                np.outer(p, numerators / populations ** 2))
+    else:
+        raise ValueError("objective must be 'crispness' or 'metastability'")
+
+    # back through the rescaling, the first row and the first column
+    grad = grad / scale
+    grad[0] -= (grad * A_raw).sum() / scale
+    grad[1:] -= V1[argmin].T * grad[0]
+    grad[1:, 1:] -= grad[1:, :1]
+
+    return obj, grad[1:, 1:].ravel()
+
+
 def metastability(alpha, T, right_eigenvectors, square_map, pi):
     """Return the metastability PCCA+ objective function.
 
@@ -215,10 +423,9 @@ def metastability(alpha, T, right_eigenvectors, square_map, pi):
             has_constraint_violation(A, right_eigenvectors)):
         return -1.0 * np.inf
 
-    obj = 0.0
     # Calculate  metastabilty of the lumped model.  Eqn 4.20 in LAA.
-    for i in range(num_eigen):
-        obj += np.dot(T.dot(chi[:, i]), pi * chi[:, i]) / np.dot(chi[:, i], pi)
+    obj = ((T.dot(chi) * (pi[:, np.newaxis] * chi)).sum(0) /
+           dot(pi, chi)).sum()
 
     return obj
 
@@ -265,10 +472,9 @@ def crisp_metastability(alpha, T, right_eigenvectors, square_map, pi):
             has_constraint_violation(A, right_eigenvectors)):
         return -1.0 * np.inf
 
-    obj = 0.0
     # Calculate  metastabilty of the lumped model.  Eqn 4.20 in LAA.
-    for i in range(num_eigen):
-        obj += np.dot(T.dot(chi[:, i]), pi * chi[:, i]) / np.dot(chi[:, i], pi)
+    obj = ((T.dot(chi) * (pi[:, np.newaxis] * chi)).sum(0) /
+           dot(pi, chi)).sum()
 
     return obj
 
@@ -445,18 +651,16 @@ def index_search(right_eigenvectors):
     index = np.zeros(num_eigen, 'int')
 
     # first vertex: row with largest norm
-    index[0] = np.argmax(
-            [norm(right_eigenvectors[i]) for i in range(num_micro)])
+    index[0] = np.argmax(norm(right_eigenvectors, axis=1))
 
     ortho_sys = right_eigenvectors - np.outer(np.ones(num_micro),
                                               right_eigenvectors[index[0]])
 
     for j in range(1, num_eigen):
         temp = ortho_sys[index[j - 1]].copy()
-        for l in range(num_micro):
-            ortho_sys[l] -= temp * dot(ortho_sys[l], temp)
+        ortho_sys -= np.outer(dot(ortho_sys, temp), temp)
 
-        dist_list = np.array([norm(ortho_sys[l]) for l in range(num_micro)])
+        dist_list = norm(ortho_sys, axis=1)
 
         index[j] = np.argmax(dist_list)
 
@@ -6,6 +6,7 @@
 from __future__ import print_function, division, absolute_import
 
 import collections
+import numbers
 
 import numpy as np
 import scipy.linalg
@@ -17,7 +18,8 @@ from . import _ratematrix
 from ..utils import list_of_1d
 
 __all__ = [
-    '_MappingTransformMixin', '_dict_compose', '_strongly_connected_subgraph',
+    '_MappingTransformMixin', '_dict_compose', '_fill_or_clip',
+    '_strongly_connected_subgraph',
     '_transition_counts', '_solve_ratemat_eigensystem',
     '_normalize_eigensystem',
     '_solve_msm_eigensystem',
@@ -65,26 +67,37 @@ class _MappingTransformMixin(TransformerMixin):
         """
         if mode not in ['clip', 'fill']:
             raise ValueError('mode must be one of ["clip", "fill"]: %s' % mode)
+        return _fill_or_clip(self._label_indices(sequence), mode)
+
+    def _label_indices(self, sequence):
+        """Internal indices of the labels in `sequence`, -1 where a label
+        does not have one.
+
+        The lookup table for ``mapping_`` is built once and reused until
+        ``mapping_`` is replaced.
+        """
         sequence = np.asarray(sequence)
         if sequence.ndim != 1:
             raise ValueError("Each sequence must be 1D")
 
-        f = np.vectorize(lambda k: self.mapping_.get(k, np.nan),
-                         otypes=[np.float])
-
-        a = f(sequence)
-        if mode == 'fill':
-            if np.all(np.mod(a, 1) == 0):
-                result = a.astype(int)
-            else:
-                result = a
-        elif mode == 'clip':
-            result = [a[s].astype(int) for s in
-                      np.ma.clump_unmasked(np.ma.masked_invalid(a))]
-        else:
-            raise RuntimeError()
-
-        return result
+        cached = getattr(self, '_mapping_table', None)
+        if cached is None or cached[0] is not self.mapping_:
+            cached = (self.mapping_, _mapping_table(self.mapping_))
+            self._mapping_table = cached
+        table = cached[1]
+
+        if table is None or sequence.dtype.kind not in 'iuf':
+            get = self.mapping_.get
+            return np.fromiter((get(label, -1) for label in sequence),
+                               dtype=int, count=len(sequence))
+
+        valid = (sequence >= 0) & (sequence < len(table))
+        if sequence.dtype.kind == 'f':
+            # NaN fails the comparisons above, and e.g. 1.5 is not a label
+            valid &= (np.mod(sequence, 1) == 0)
+        indices = np.full(len(sequence), -1, dtype=int)
+        indices[valid] = table[sequence[valid].astype(int)]
+        return indices
 
     def transform(self, sequences, mode='clip'):
         """Transform a list of sequences to internal indexing
@@ -308,6 +321,167 @@ class _SampleMSMMixin(object):
         return np.array(selected_pairs_by_state)
 
 
+class _PropagateMSMMixin(object):
+    """Provides msm.propagate() and correlation functions for continuous and
+    discrete time MSMs.
+
+    Distributions and observables are evolved with one product with the
+    transition or rate matrix per step, so that no powers or exponentials of
+    the matrix are formed, and sparse matrices stay sparse. Subclasses
+    provide ``_evolve(vectors, increments, transpose)``, which yields the
+    columns of ``vectors`` evolved by each of the time increments in turn.
+    """
+
+    def propagate(self, initial, times):
+        """Evolve probability distributions over the states in time.
+
+        Parameters
+        ----------
+        initial : array_like, shape=(n_states_,) or (n_distributions, n_states_)
+            Initial distribution(s), in the internal indexing of this model.
+        times : int or array_like
+            Times at which to report the distributions, in units of the lag
+            time of a discrete time model, which must be whole numbers. If an
+            int ``n``, the times ``0, 1, ..., n``.
+
+        Returns
+        -------
+        distributions : np.ndarray, shape=(n_times, n_states_) or (n_times, n_distributions, n_states_)
+            The distribution(s) at each time.
+        """
+        initial, squeeze = self._as_vectors(initial, 'initial')
+        times = self._parse_times(times)
+        result = np.empty((len(times), initial.shape[1], self.n_states_))
+        for i, vectors in self._evolve_to(initial, times, transpose=True):
+            result[i] = vectors.T
+        return result[:, 0] if squeeze else result
+
+    def propagate_observables(self, observables, times):
+        """Evolve observables of the states in time.
+
+        The evolved observable :math:`a(i, t)` is the expected value of
+        observable a after a time t, starting from state i.
+
+        Parameters
+        ----------
+        observables : array_like, shape=(n_states_,) or (n_observables, n_states_)
+            Value(s) of the observable(s) in each state, in the internal
+            indexing of this model.
+        times : int or array_like
+            Times at which to report the observables, in units of the lag
+            time of a discrete time model, which must be whole numbers. If an
+            int ``n``, the times ``0, 1, ..., n``.
+
+        Returns
+        -------
+        observables : np.ndarray, shape=(n_times, n_states_) or (n_times, n_observables, n_states_)
+            The evolved observable(s) at each time.
+        """
+        observables, squeeze = self._as_vectors(observables, 'observables')
+        times = self._parse_times(times)
+        result = np.empty((len(times), observables.shape[1], self.n_states_))
+        for i, vectors in self._evolve_to(observables, times,
+                                          transpose=False):
+            result[i] = vectors.T
+        return result[:, 0] if squeeze else result
+
+    def relaxation(self, initial, observables, times):
+        """Expected value of observables in time, from an initial
+        distribution.
+
+        Only the distribution at the current time is kept in memory, so the
+        relaxation of models with very many states can be followed over very
+        many times.
+
+        Parameters
+        ----------
+        initial : array_like, shape=(n_states_,)
+            Initial distribution, in the internal indexing of this model.
+        observables : array_like, shape=(n_states_,) or (n_observables, n_states_)
+            Value(s) of the observable(s) in each state.
+        times : int or array_like
+            Times at which to report the expected values, in units of the lag
+            time of a discrete time model, which must be whole numbers. If an
+            int ``n``, the times ``0, 1, ..., n``.
+
+        Returns
+        -------
+        relaxation : np.ndarray, shape=(n_times,) or (n_times, n_observables)
+            The expected value of the observable(s) at each time.
+        """
+        initial = np.asarray(initial, dtype=float)
+        if initial.shape != (self.n_states_,):
+            raise ValueError('initial must have shape (%d,)' % self.n_states_)
+        observables, squeeze = self._as_vectors(observables, 'observables')
+        times = self._parse_times(times)
+        result = np.empty((len(times), observables.shape[1]))
+        for i, vectors in self._evolve_to(initial[:, np.newaxis], times,
+                                          transpose=True):
+            result[i] = vectors[:, 0].dot(observables)
+        return result[:, 0] if squeeze else result
+
+    def correlation(self, observable_a, times, observable_b=None):
+        r"""Equilibrium time correlation function of two observables.
+
+        Parameters
+        ----------
+        observable_a : array_like, shape=(n_states_,)
+            Value of the first observable in each state, in the internal
+            indexing of this model.
+        times : int or array_like
+            Times at which to report the correlation function, in units of
+            the lag time of a discrete time model, which must be whole
+            numbers. If an int ``n``, the times ``0, 1, ..., n``.
+        observable_b : array_like, shape=(n_states_,), optional
+            Value of the second observable in each state. If not given, the
+            autocorrelation function of ``observable_a`` is computed.
+
+        Returns
+        -------
+        correlation : np.ndarray, shape=(n_times,)
+            :math:`\langle a(0) b(t) \rangle = \sum_{ij} \pi_i a_i
+            P_{ij}(t) b_j` at each time, where :math:`\pi` is
+            ``populations_``.
+        """
+        observable_a = np.asarray(observable_a, dtype=float)
+        if observable_b is None:
+            observable_b = observable_a
+        for name, observable in [('observable_a', observable_a),
+                                 ('observable_b', observable_b)]:
+            if np.shape(observable) != (self.n_states_,):
+                raise ValueError('%s must have shape (%d,)'
+                                 % (name, self.n_states_))
+        return self.relaxation(self.populations_ * observable_a,
+                               observable_b, times)
+
+    def _as_vectors(self, vectors, name):
+        """Columns of the 1D or 2D array ``vectors`` of values of the states,
+        and whether it was 1D."""
+        vectors = np.asarray(vectors, dtype=float)
+        if vectors.ndim not in (1, 2) or vectors.shape[-1] != self.n_states_:
+            raise ValueError('%s must have shape (%d,) or (n, %d)'
+                             % (name, self.n_states_, self.n_states_))
+        return np.atleast_2d(vectors).T, vectors.ndim == 1
+
+    @staticmethod
+    def _parse_times(times):
+        if np.ndim(times) == 0:
+            times = np.arange(int(times) + 1)
+        times = np.asarray(times).reshape((-1,))
+        if np.any(times < 0):
+            raise ValueError('times must be non-negative')
+        return times
+
+    def _evolve_to(self, vectors, times, transpose):
+        """Yield the index of each of the times, from the earliest to the
+        latest, with the columns of ``vectors`` evolved to that time."""
+        order = np.argsort(times, kind='mergesort')
+        increments = np.diff(np.concatenate([[0], times[order]]))
+        for i, evolved in zip(order, self._evolve(vectors, increments,
+                                                  transpose)):
+            yield i, evolved
+
+
 def _solve_ratemat_eigensystem(theta, k, n):
     """Find the dominant eigenpairs of a reversible rate matrix (master
     equation)
@@ -557,9 +731,14 @@ def _transition_counts(sequences, lag_time=1, sliding_window=True):
                            and not contains_none
                            and classes.dtype.kind == 'i'
                            and np.all(classes == np.arange(n_states)))
-    mapping_fn = np.vectorize(mapping.get, otypes=[np.int])
+    if isinstance(classes, np.ndarray):
+        # classes is sorted, so the index of each label is a binary search
+        def mapping_fn(states):
+            return np.searchsorted(classes, states)
+    else:
+        mapping_fn = np.vectorize(mapping.get, otypes=[int])
     none_to_nan = np.vectorize(lambda x: np.nan if x is None else x,
-                               otypes=[np.float])
+                               otypes=[float])
 
     counts = np.zeros((n_states, n_states), dtype=float)
     _transitions = []
@@ -602,6 +781,47 @@ def _transition_counts(sequences, lag_time=1, sliding_window=True):
     return counts, mapping
 
 
+def _mapping_table(mapping):
+    """Dense lookup table for a mapping from labels to internal indices.
+
+    Returns an array ``table`` with ``table[label] = mapping[label]`` and -1
+    for the integers that are not labels, or None if the labels are not all
+    non-negative integers (possibly stored as floats), or are too sparse
+    for a table.
+    """
+    if not all(isinstance(k, numbers.Real) for k in mapping):
+        return None
+    labels = np.fromiter(mapping.keys(), dtype=float, count=len(mapping))
+    if len(labels) == 0:
+        return np.zeros(0, dtype=int)
+    if (labels.min() < 0 or np.any(np.mod(labels, 1) != 0) or
+            labels.max() >= 4 * len(labels) + 2 ** 20):
+        return None
+
+    table = np.full(int(labels.max()) + 1, -1, dtype=int)
+    table[labels.astype(int)] = np.fromiter(mapping.values(), dtype=int,
+                                            count=len(mapping))
+    return table
+
+
+def _fill_or_clip(indices, mode):
+    """Handle the -1 entries of `indices` (labels without an internal index)
+    as ``_MappingTransformMixin.partial_transform`` does in `mode`.
+    """
+    mapped = indices >= 0
+    if mode == 'fill':
+        if np.all(mapped):
+            return indices
+        result = indices.astype(float)
+        result[~mapped] = np.nan
+        return result
+
+    # the runs of mapped labels
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mapped, [0]])))
+    return [indices[start:stop]
+            for start, stop in zip(edges[::2], edges[1::2])]
+
+
 def _dict_compose(dict1, dict2):
     """
     Example
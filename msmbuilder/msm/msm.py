@@ -22,7 +22,8 @@ from ._markovstatemodel import _transmat_mle_prinz
 from .core import (_MappingTransformMixin, _CountsMSMMixin,
                    _dict_compose,
                    _transition_counts,
-                   _solve_msm_eigensystem, _SampleMSMMixin)
+                   _solve_msm_eigensystem, _SampleMSMMixin,
+                   _PropagateMSMMixin)
 
 __all__ = ['MarkovStateModel']
 
@@ -31,7 +32,7 @@ __all__ = ['MarkovStateModel']
 #-----------------------------------------------------------------------------
 
 class MarkovStateModel(BaseEstimator, _MappingTransformMixin,
-                        _SampleMSMMixin, _CountsMSMMixin):
+                        _SampleMSMMixin, _CountsMSMMixin, _PropagateMSMMixin):
     """Reversible Markov State Model
 
     This model fits a first-order Markov model to a dataset of integer-valued
@@ -285,6 +286,18 @@ class MarkovStateModel(BaseEstimator, _MappingTransformMixin,
         return self.sample_discrete(state=state, n_steps=n_steps,
                                     random_state=random_state)
 
+    def _evolve(self, vectors, increments, transpose):
+        # one product with the transition matrix per lag time, which may
+        # be dense or sparse
+        n_steps = np.asarray(increments, dtype=int)
+        if np.any(n_steps != increments):
+            raise ValueError('times must be whole multiples of the lag time')
+        tprob = self.transmat_.T if transpose else self.transmat_
+        for n in n_steps:
+            for _ in range(n):
+                vectors = tprob.dot(vectors)
+            yield vectors
+
     def score_ll(self, sequences):
         r"""log of the likelihood of sequences with respect to the model
 
@@ -8,18 +8,23 @@ from __future__ import print_function, division
 import numpy as np
 import scipy.linalg
 import scipy.optimize
+import scipy.sparse.linalg
 from six.moves import cStringIO
 
 from . import _ratematrix
 from ._markovstatemodel import _transmat_mle_prinz
 from .core import (_MappingTransformMixin, _CountsMSMMixin, _dict_compose,
-                   _solve_ratemat_eigensystem, _SampleMSMMixin)
+                   _solve_ratemat_eigensystem, _SampleMSMMixin,
+                   _PropagateMSMMixin)
 from ..base import BaseEstimator
 from ..utils import printoptions
 
+#: largest size of the evolved vectors that are kept in memory at once
+PROPAGATE_BYTES = 2 ** 27
+
 
 class ContinuousTimeMSM(BaseEstimator, _MappingTransformMixin,
-                        _CountsMSMMixin, _SampleMSMMixin):
+                        _CountsMSMMixin, _SampleMSMMixin, _PropagateMSMMixin):
     """Reversible first order master equation model
 
     This model fits a continuous-time Markov model (master equation) from
@@ -167,6 +172,41 @@ class ContinuousTimeMSM(BaseEstimator, _MappingTransformMixin,
 
         return self
 
+    def _evolve(self, vectors, increments, transpose):
+        # the action of the exponential of the rate matrix, which may be
+        # dense or sparse, from truncated Taylor series. The rate matrix is
+        # used through a LinearOperator, with its trace given, so that
+        # expm_multiply neither scales nor shifts a copy of it. Runs of
+        # equal increments are evolved together, in chunks of at most
+        # PROPAGATE_BYTES, so that the series parameters are chosen once.
+        ratemat = self.ratemat_.T if transpose else self.ratemat_
+        trace = ratemat.diagonal().sum()
+        operator = scipy.sparse.linalg.aslinearoperator(ratemat)
+        chunk = max(1, PROPAGATE_BYTES // (8 * vectors.size))
+        start = 0
+        while start < len(increments):
+            dt = increments[start]
+            stop = start + 1
+            while (stop < len(increments) and stop - start < chunk
+                   and increments[stop] == dt):
+                stop += 1
+            if dt == 0:
+                evolved = [vectors] * (stop - start)
+            else:
+                # an interval from 0 is faster than one from dt
+                interval = dict(start=0, stop=dt * (stop - start),
+                                num=stop - start + 1, endpoint=True)
+                try:
+                    evolved = scipy.sparse.linalg.expm_multiply(
+                        operator, vectors, traceA=trace, **interval)[1:]
+                except TypeError:
+                    # scipy < 1.9 has no traceA, and needs the matrix itself
+                    evolved = scipy.sparse.linalg.expm_multiply(
+                        ratemat, vectors, **interval)[1:]
+            for vectors in evolved:
+                yield vectors
+            start = stop
+
     def summarize(self):
         out = cStringIO()
         with printoptions(precision=4):
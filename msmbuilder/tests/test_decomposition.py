@@ -9,8 +9,9 @@ from sklearn.decomposition import PCA as PCAr
 
 from msmbuilder.example_datasets import AlanineDipeptide
 from ..cluster import KCenters
-from ..decomposition import (FactorAnalysis, FastICA, KernelTICA,
-                             MiniBatchSparsePCA, PCA, SparsePCA, tICA)
+from ..decomposition import (FactorAnalysis, FastICA, IncrementalPCA,
+                             KernelTICA, MiniBatchSparsePCA, PCA, SparsePCA,
+                             tICA)
 from ..decomposition.kernel_approximation import LandmarkNystroem
 from ..featurizer import DihedralFeaturizer
 
@@ -110,6 +111,36 @@ def test_tica_kinetic_mapping():
     assert eq(y2, y1 * tica1.eigenvalues_)
 
 
+def test_tica_transform_out_and_threads():
+    X = [random.randn(100, 5), random.randn(50, 5)]
+    tica = tICA(n_components=2, lag_time=1, kinetic_mapping=True).fit(X)
+
+    ref = [np.dot(x - tica.means_, tica.components_.T) * tica.eigenvalues_
+           for x in X]
+
+    out = [np.zeros((100, 2)), np.zeros((50, 2))]
+    y = tica.transform(X, out=out, n_jobs=2)
+    for a, b, c in zip(y, out, ref):
+        assert a is b
+        assert_array_almost_equal(a, c)
+
+    # the cached projection follows changes to n_components
+    tica.n_components = 1
+    eq(tica.partial_transform(X[0]).shape, (100, 1))
+
+
+def test_tica_mixed_precision():
+    X = [random.randn(1000, 4), random.randn(5000, 4).astype(np.float32)]
+
+    tica1 = tICA(n_components=2, lag_time=3).fit(X)
+    tica2 = tICA(n_components=2, lag_time=3, precision='mixed').fit(X)
+
+    eq(tica1.n_observations_, tica2.n_observations_)
+    assert_array_almost_equal(tica1.means_, tica2.means_, decimal=5)
+    assert_array_almost_equal(tica1.eigenvalues_, tica2.eigenvalues_,
+                              decimal=5)
+
+
 def test_pca_vs_sklearn():
     # Compare msmbuilder.pca with sklearn.decomposition
 
@@ -164,6 +195,59 @@ def test_pca_generator():
                                          pcar.noise_variance_)
 
 
+def test_incrementalpca_vs_sklearn():
+    pcar = PCAr()
+    pcar.fit(np.concatenate(trajs))
+
+    ipca = IncrementalPCA()
+    ipca.fit(trajs)
+
+    y_ref1 = pcar.transform(trajs[0])
+    y1 = ipca.transform(trajs)[0]
+
+    np.testing.assert_array_almost_equal(np.abs(y_ref1), np.abs(y1))
+    np.testing.assert_array_almost_equal(np.abs(ipca.components_),
+                                         np.abs(pcar.components_))
+    np.testing.assert_array_almost_equal(ipca.explained_variance_,
+                                         pcar.explained_variance_)
+    np.testing.assert_array_almost_equal(ipca.mean_, pcar.mean_)
+
+
+def test_incrementalpca_partial_fit_float32():
+    X = [random.randn(100, 5).astype(np.float32) for _ in range(3)]
+
+    ipca1 = IncrementalPCA(n_components=2, batch_size=20).fit(X)
+    ipca2 = IncrementalPCA(n_components=2, batch_size=20)
+    for x in X:
+        ipca2.partial_fit(x)
+
+    eq(int(ipca1.n_samples_seen_), 300)
+    eq(int(ipca2.n_samples_seen_), 300)
+    np.testing.assert_array_almost_equal(ipca1.mean_, ipca2.mean_)
+
+    y = ipca1.transform(X)
+    eq(y[0].shape, (100, 2))
+    assert y[0].dtype == np.float32
+    ipca1.summarize()
+
+
+def test_incrementalpca_long_sequence():
+    X = random.randn(20003, 4)
+
+    ipca1 = IncrementalPCA(batch_size=50).fit([X])
+    # the same batches, split across sequences
+    ipca2 = IncrementalPCA(batch_size=50).fit(
+        [X[:7], X[7:30], X[30:31], X[31:10000], X[10000:]])
+    pcar = PCAr().fit(X)
+
+    eq(int(ipca1.n_samples_seen_), 20003)
+    np.testing.assert_array_almost_equal(ipca1.components_,
+                                         ipca2.components_)
+    np.testing.assert_array_almost_equal(np.abs(ipca1.components_),
+                                         np.abs(pcar.components_))
+    np.testing.assert_array_almost_equal(ipca1.mean_, pcar.mean_)
+
+
 def test_sparsepca():
     pca = SparsePCA()
     pca.fit_transform(trajs)
@@ -226,3 +310,34 @@ def test_ktica_compare_to_pipeline():
     y2_2 = tica.fit_transform(y2_1)[0]
 
     assert_array_almost_equal(y1, y2_2)
+
+
+def test_ktica_chunked_matches_dense():
+    X = [random.randn(100, 5), random.randn(37, 5)]
+
+    ktica = KernelTICA(kernel='rbf', lag_time=5, n_components=2,
+                       random_state=42)
+    y1 = ktica.fit_transform(X)
+
+    ktica_chunked = KernelTICA(kernel='rbf', lag_time=5, n_components=2,
+                               landmarks=ktica.landmarks, chunk_size=16,
+                               random_state=42)
+    y2 = ktica_chunked.fit_transform(X)
+
+    assert_array_almost_equal(ktica.eigenvalues_,
+                              ktica_chunked.eigenvalues_)
+    for a, b in zip(y1, y2):
+        assert_array_almost_equal(np.abs(a), np.abs(b))
+
+
+def test_ktica_bounded_landmarks():
+    X = [random.randn(100, 5), random.randn(50, 5)]
+
+    for strategy in ['reservoir', 'kcenters']:
+        ktica = KernelTICA(kernel='rbf', lag_time=5, n_components=2,
+                           n_landmarks=20, landmark_strategy=strategy,
+                           chunk_size=16, random_state=42)
+        y = ktica.fit_transform(X)
+
+        eq(ktica.landmarks.shape, (20, 5))
+        eq(y[0].shape, (100, 2))
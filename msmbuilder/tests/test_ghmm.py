@@ -9,6 +9,8 @@ import numpy as np
 from msmbuilder.example_datasets import AlanineDipeptide
 from msmbuilder.featurizer import SuperposeFeaturizer
 from msmbuilder.hmm import GaussianHMM
+from msmbuilder.hmm.gaussian import _fused_means, _split_states
+from msmbuilder.hmm._transitions import prune_transmat
 
 rs = np.random.RandomState(42)
 
@@ -132,3 +134,206 @@ def test_3_state():
     for init_algo in ('kmeans', 'GMM'):
         for reversible_type in ('mle', 'transpose'):
             yield three_state_tester(init_algo, reversible_type)
+
+
+def test_parallel_restarts():
+    transmat = np.array([[0.7, 0.3], [0.4, 0.6]])
+    means = np.array([[0.0], [5.0]])
+    vars = np.array([[1.0], [1.0]])
+    X = [create_timeseries(means, vars, transmat) for i in range(5)]
+
+    # Every restart draws its seed up front, so running them concurrently
+    # must pick the same winner as running them one after another
+    serial = GaussianHMM(n_states=2, n_init=4, n_iter=20, random_state=0)
+    serial.fit(X)
+    threaded = GaussianHMM(n_states=2, n_init=4, n_iter=20, random_state=0,
+                           n_jobs=2)
+    threaded.fit(X)
+    np.testing.assert_array_almost_equal(serial.means_, threaded.means_)
+    np.testing.assert_array_almost_equal(serial.fit_logprob_,
+                                         threaded.fit_logprob_)
+
+    # Abandoning trailing restarts stays within the margin of the full search
+    pruned = GaussianHMM(n_states=2, n_init=4, n_iter=20, random_state=0,
+                         n_jobs=2, restart_margin=10.0)
+    pruned.fit(X)
+    assert pruned.fit_logprob_[-1] >= serial.fit_logprob_[-1] - 10.0
+
+
+def test_fit_online():
+    transmat = np.array([[0.9, 0.1], [0.1, 0.9]])
+    means = np.array([[0.0], [5.0]])
+    vars = np.array([[1.0], [1.0]])
+    X = [create_timeseries(means, vars, transmat) for i in range(16)]
+
+    batch = GaussianHMM(n_states=2, n_init=1, n_iter=30, random_state=0)
+    batch.fit(X)
+    online = GaussianHMM(n_states=2, random_state=0)
+    online.fit_online(X, batch_size=4, n_epochs=5, reservoir_size=2000)
+
+    # one log-likelihood per epoch, ending close to the batch EM optimum
+    assert 1 < len(online.fit_logprob_) <= 5
+    assert abs(online.score(X) - batch.score(X)) < 1e-3 * abs(batch.score(X))
+    np.testing.assert_array_almost_equal(np.sort(online.means_, axis=0),
+                                         np.sort(batch.means_, axis=0),
+                                         decimal=1)
+
+
+def test_fused_means():
+    post = np.array([100.0, 120.0, 80.0])
+    means = np.array([[0.0, 1.0], [0.5, 3.0], [2.0, 3.5]])
+    obs = means * post[:, np.newaxis]
+    vars = np.ones_like(means)
+
+    # a negligible prior leaves the unregularized means
+    weak = _fused_means(means, obs, post, vars, 1e-12, 10)
+    np.testing.assert_array_almost_equal(weak, means)
+
+    # a strong prior pulls the means of each feature together
+    strong = _fused_means(means, obs, post, vars, 1e3, 10)
+    assert np.ptp(strong[:, 0]) < np.ptp(means[:, 0])
+    assert np.ptp(strong[:, 1]) < np.ptp(means[:, 1])
+
+
+def test_full_covariance():
+    rs = np.random.RandomState(0)
+    means = np.array([[0.0, 0.0], [5.0, 5.0]])
+    covars = np.array([[[1.0, 0.8], [0.8, 1.0]], [[0.5, -0.3], [-0.3, 0.5]]])
+    chol = np.linalg.cholesky(covars)
+    X = []
+    for i in range(10):
+        states = np.repeat(rs.randint(2, size=50), 20)
+        X.append(means[states] +
+                 np.einsum('nij,nj->ni', chol[states], rs.randn(1000, 2)))
+
+    full = GaussianHMM(n_states=2, n_init=2, n_iter=30, random_state=0,
+                       covariance_type='full', reversible_type='transpose')
+    full.fit(X)
+    diag = GaussianHMM(n_states=2, n_init=2, n_iter=30, random_state=0,
+                       reversible_type='transpose')
+    diag.fit(X)
+
+    order = np.argsort(full.means_[:, 0])
+    np.testing.assert_array_almost_equal(full.means_[order], means, decimal=1)
+    np.testing.assert_array_almost_equal(full.covars_[order], covars,
+                                         decimal=1)
+    np.testing.assert_array_almost_equal(
+        full.vars_, np.diagonal(full.covars_, axis1=1, axis2=2))
+    # the correlations make the data much more likely than under diagonal
+    # covariances
+    assert full.score(X) > diag.score(X)
+
+
+def test_decode_batch():
+    transmat = np.array([[0.9, 0.1], [0.1, 0.9]])
+    means = np.array([[0.0], [5.0]])
+    vars = np.array([[1.0], [1.0]])
+    X = [create_timeseries(means, vars, transmat)[:n] for n in (10, 500, 1000)]
+    model = GaussianHMM(n_states=2, n_init=1, n_iter=10, random_state=0)
+    model.fit(X)
+    logprob, hidden_sequences = model.predict(X)
+
+    # outputs are written in place into views of preallocated arrays
+    lengths = [len(x) for x in X]
+    offsets = np.cumsum(lengths)[:-1]
+    states = np.split(np.empty(sum(lengths), dtype=np.int32), offsets)
+    posteriors = np.split(np.empty((sum(lengths), 2)), offsets)
+    batch_logprob, states_out, posteriors_out = model.decode_batch(
+        X, states_out=states, posteriors_out=posteriors, chunk_size=2)
+    assert all(a is b for a, b in zip(states_out, states))
+    assert all(a is b for a, b in zip(posteriors_out, posteriors))
+    np.testing.assert_almost_equal(batch_logprob.sum(), logprob)
+    for x, s, expected, p in zip(X, states, hidden_sequences, posteriors):
+        np.testing.assert_array_equal(s, expected)
+        np.testing.assert_array_almost_equal(p.sum(axis=1), np.ones(len(x)))
+
+    posteriors = model.predict_proba(X)
+    np.testing.assert_array_almost_equal(np.concatenate(posteriors),
+                                         np.concatenate(posteriors_out))
+
+
+def test_scaled_forward_backward():
+    transmat = np.array([[0.9, 0.1], [0.1, 0.9]])
+    means = np.array([[0.0], [5.0]])
+    vars = np.array([[1.0], [1.0]])
+    X = [create_timeseries(means, vars, transmat) for i in range(3)]
+
+    log = GaussianHMM(n_states=2, n_init=1, n_iter=10, random_state=0)
+    log.fit(X)
+    scaled = GaussianHMM(n_states=2, n_init=1, n_iter=10, random_state=0,
+                         forward_backward='scaled')
+    scaled.fit(X)
+
+    # single precision lattices, double precision accumulators
+    np.testing.assert_allclose(scaled.fit_logprob_, log.fit_logprob_,
+                               rtol=1e-6)
+    np.testing.assert_allclose(scaled.means_, log.means_, rtol=1e-4)
+    np.testing.assert_allclose(scaled.score(X), log.score(X), rtol=1e-6)
+    for a, b in zip(scaled.predict_proba(X), log.predict_proba(X)):
+        np.testing.assert_allclose(a, b, atol=1e-4)
+
+
+def test_sweep_n_states():
+    transmat = np.array([[0.8, 0.1, 0.1], [0.1, 0.8, 0.1], [0.1, 0.1, 0.8]])
+    means = np.array([[0.0], [5.0], [10.0]])
+    vars = np.array([[1.0], [1.0], [1.0]])
+    X = [create_timeseries(means, vars, transmat) for i in range(5)]
+
+    model = GaussianHMM(n_states=1, n_init=2, n_iter=30, random_state=0,
+                        reversible_type='transpose')
+    models, logprob, bic = model.sweep_n_states(X, [1, 2, 3, 4])
+    assert [len(m.means_) for m in models] == [1, 2, 3, 4]
+    assert np.all(np.diff(logprob[:3]) > 0)
+    assert np.argmin(bic) == 2
+
+    # the warm-started model finds the true states
+    order = np.argsort(models[2].means_[:, 0])
+    np.testing.assert_array_almost_equal(models[2].means_[order], means,
+                                         decimal=1)
+
+    # splitting a state keeps the transition matrix stochastic and the
+    # populations stationary
+    means, vars, covars, transmat, populations = _split_states(
+        models[2].means_, models[2].vars_, None, models[2].transmat_,
+        models[2].populations_, [-1.0, -3.0, -2.0], 2)
+    assert means.shape == (5, 1) and transmat.shape == (5, 5)
+    np.testing.assert_array_almost_equal(transmat.sum(axis=1), np.ones(5))
+    np.testing.assert_array_almost_equal(populations.dot(transmat),
+                                         populations)
+
+
+def test_sparse_transitions():
+    transmat = np.array([[0.9, 0.1, 0.0], [0.05, 0.9, 0.05], [0.0, 0.1, 0.9]])
+    means = np.array([[0.0], [5.0], [10.0]])
+    vars = np.array([[1.0], [1.0], [1.0]])
+    X = [create_timeseries(means, vars, transmat) for i in range(3)]
+
+    sparse = GaussianHMM(n_states=3, n_init=1, n_iter=20, random_state=0,
+                         transition_threshold=1e-3)
+    sparse.fit(X)
+    # the transitions between the outer states are dropped
+    order = np.argsort(sparse.means_[:, 0])
+    assert sparse.transmat_[order[0], order[2]] == 0
+    assert sparse.transmat_[order[2], order[0]] == 0
+    np.testing.assert_array_almost_equal(
+        sparse.populations_.dot(sparse.transmat_), sparse.populations_)
+
+    # they were negligible, so the dense recursions agree
+    dense = GaussianHMM(n_states=3)
+    dense.__setstate__(sparse.__reduce__()[2])
+    np.testing.assert_allclose(sparse.score(X), dense.score(X), rtol=1e-8)
+    for a, b in zip(sparse.predict(X)[1], dense.predict(X)[1]):
+        np.testing.assert_array_equal(a, b)
+
+    # capping the out-degree keeps detailed balance
+    random = np.random.RandomState(0)
+    counts = random.rand(10, 10)
+    counts += counts.T
+    populations = counts.sum(axis=1) / counts.sum()
+    pruned, pruned_populations = prune_transmat(
+        counts / counts.sum(axis=1)[:, np.newaxis], populations,
+        max_out_degree=3)
+    assert np.all(np.count_nonzero(pruned, axis=1) <= 4)
+    flux = pruned_populations[:, np.newaxis] * pruned
+    np.testing.assert_array_almost_equal(flux, flux.T)
+    np.testing.assert_array_almost_equal(pruned.sum(axis=1), np.ones(10))
@@ -103,3 +103,68 @@ def test_ntimescales_3():
     lumped_trajs = pccap.transform(trajs)
     observed_macros = len(np.unique(lumped_trajs))
     assert observed_macros == 11, observed_macros
+
+
+def test_partial_transform_unmapped():
+    assignments, _ = _metastable_system()
+    pcca = PCCA(2).fit(assignments)
+    macro = pcca.microstate_mapping_[pcca.mapping_[0]]
+    other = 1 - macro
+
+    sequence = [0, 2, 7, 3, 0]
+    clipped = pcca.partial_transform(sequence, mode='clip')
+    assert len(clipped) == 2
+    np.testing.assert_array_equal(clipped[0], [macro, other])
+    np.testing.assert_array_equal(clipped[1], [other, macro])
+
+    filled = pcca.partial_transform(np.array(sequence + [np.nan]),
+                                    mode='fill')
+    np.testing.assert_array_equal(filled,
+                                  [macro, other, np.nan, other, macro, np.nan])
+    assert pcca.partial_transform([0, 2], mode='fill').dtype.kind == 'i'
+
+
+def test_pcca_plus_objective_gradient():
+    from msmbuilder.lumping import pcca_plus
+
+    trajs = [random.randint(0, 20, size=500) for _ in range(5)]
+    pccap = PCCAPlus(4, do_minimization=False).fit(trajs)
+    right_eigenvectors = pccap.right_eigenvectors_[:, :4]
+    flat_map, square_map = pcca_plus.get_maps(pccap.A_)
+    alpha = pcca_plus.to_flat(pccap.A_, flat_map)
+    terms = pcca_plus.objective_terms(pccap.transmat_, right_eigenvectors,
+                                      pccap.populations_)
+
+    for objective in ['metastability', 'crisp_metastability', 'crispness']:
+        ref = getattr(pcca_plus, objective)(
+            alpha, pccap.transmat_, right_eigenvectors, square_map,
+            pccap.populations_)
+        value = pcca_plus.evaluate_objective(
+            alpha, right_eigenvectors, square_map, objective, terms)
+        np.testing.assert_allclose(value, ref)
+
+    for objective in ['metastability', 'crispness']:
+        value, grad = pcca_plus.objective_and_gradient(
+            alpha, right_eigenvectors, square_map, objective, terms)
+        np.testing.assert_allclose(value, pcca_plus.evaluate_objective(
+            alpha, right_eigenvectors, square_map, objective, terms))
+
+        eps = 1e-6
+        numerical = np.zeros_like(alpha)
+        for i in range(len(alpha)):
+            step = np.zeros_like(alpha)
+            step[i] = eps
+            numerical[i] = (pcca_plus.evaluate_objective(
+                alpha + step, right_eigenvectors, square_map, objective,
+                terms) - pcca_plus.evaluate_objective(
+                alpha - step, right_eigenvectors, square_map, objective,
+                terms)) / (2 * eps)
+        np.testing.assert_allclose(grad, numerical, rtol=1e-4, atol=1e-7)
+
+
+def test_pcca_plus_restarts():
+    assignments, _ = _metastable_system()
+    lumpings = [PCCAPlus(2, n_restarts=3, n_jobs=n_jobs, random_state=0)
+                .fit(assignments).microstate_mapping_
+                for n_jobs in [1, 2]]
+    np.testing.assert_array_equal(lumpings[0], lumpings[1])
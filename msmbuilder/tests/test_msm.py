@@ -6,9 +6,10 @@ import tempfile
 import mdtraj as md
 import numpy as np
 import pandas as pd
+import scipy.sparse
 import sklearn.pipeline
 from mdtraj.testing import eq
-from numpy.testing import assert_approx_equal
+from numpy.testing import assert_approx_equal, assert_raises
 from six import PY3
 from sklearn.externals.joblib import load, dump
 from sklearn.pipeline import Pipeline
@@ -387,3 +388,42 @@ def test_ergodic_cutoff():
     for cut_off in [0.01, 'on', 'off']:
         assert (MarkovStateModel(ergodic_cutoff=cut_off).ergodic_cutoff ==
                 BayesianMarkovStateModel(ergodic_cutoff=cut_off).ergodic_cutoff)
+
+
+def test_propagate():
+    model = MarkovStateModel()
+    model.fit([[0, 0, 0, 1, 2, 1, 0, 0, 0, 1, 3, 3, 3, 1, 1, 2, 2, 0, 0]])
+    T = model.transmat_
+    initial = np.array([[1.0, 0, 0, 0], [0, 0.5, 0.5, 0]])
+    observables = np.array([[0.0, 1, 2, 3], [1.0, 0, 0, 0]])
+    times = [5, 0, 2]
+
+    def powers():
+        return [np.linalg.matrix_power(T, t) for t in times]
+
+    for transmat in [T, scipy.sparse.csr_matrix(T)]:
+        model.transmat_ = transmat
+        distributions = model.propagate(initial, times)
+        assert distributions.shape == (3, 2, 4)
+        for d, Tt in zip(distributions, powers()):
+            np.testing.assert_array_almost_equal(d, initial.dot(Tt))
+        np.testing.assert_array_almost_equal(
+            model.propagate(initial[0], times),
+            [initial[0].dot(Tt) for Tt in powers()])
+
+        evolved = model.propagate_observables(observables, times)
+        for o, Tt in zip(evolved, powers()):
+            np.testing.assert_array_almost_equal(o, observables.dot(Tt.T))
+
+        np.testing.assert_array_almost_equal(
+            model.relaxation(initial[1], observables, times),
+            [initial[1].dot(Tt).dot(observables.T) for Tt in powers()])
+
+        a, b = observables
+        np.testing.assert_array_almost_equal(
+            model.correlation(a, times, b),
+            [(model.populations_ * a).dot(Tt).dot(b) for Tt in powers()])
+        assert model.correlation(a, 10).shape == (11,)
+
+    assert_raises(ValueError, lambda: model.propagate(initial, [0.5]))
+    assert_raises(ValueError, lambda: model.propagate(initial[:, :3], 1))
@@ -2,6 +2,7 @@ from __future__ import print_function
 
 import numpy as np
 import scipy.linalg
+import scipy.sparse
 from scipy.optimize import check_grad, approx_fprime
 
 try:
@@ -472,3 +473,31 @@ def test_dump():
         np.testing.assert_array_almost_equal(model.transmat_, m2.transmat_)
     finally:
         shutil.rmtree(d)
+
+
+def test_propagate():
+    sequence = [0, 0, 0, 1, 1, 1, 0, 0, 2, 2, 0, 1, 1, 1, 2, 2, 2, 2, 2]
+    model = ContinuousTimeMSM(verbose=False)
+    model.fit([sequence])
+    K = model.ratemat_
+    initial = np.array([1.0, 0, 0])
+    observable = np.array([0.0, 1, 2])
+    times = [2.5, 0, 0.5, 1.0, 1.5]
+
+    for ratemat in [K, scipy.sparse.csr_matrix(K)]:
+        model.ratemat_ = ratemat
+        expected = [scipy.linalg.expm(K * t) for t in times]
+        np.testing.assert_array_almost_equal(
+            model.propagate(initial, times),
+            [initial.dot(P) for P in expected])
+        np.testing.assert_array_almost_equal(
+            model.propagate_observables(observable, times),
+            [P.dot(observable) for P in expected])
+        np.testing.assert_array_almost_equal(
+            model.correlation(observable, times),
+            [(model.populations_ * observable).dot(P).dot(observable)
+             for P in expected])
+
+    # at a time of 1, the discrete time model agrees
+    np.testing.assert_array_almost_equal(
+        model.propagate(initial, 1)[1], initial.dot(model.transmat_))
@@ -26,3 +26,32 @@ def test_doublewell():
 
     np.testing.assert_array_almost_equal(stic0[1:], np.zeros(9))
     np.testing.assert_almost_equal(stic0[0], 0.58, decimal=1)
+
+
+def test_regularization_path():
+    data = build_dataset()
+    rhos = [0.02, 0.005, 0.01]
+    stica = SparseTICA(n_components=2).fit(data)
+
+    vals, vecs = stica.regularization_path(rhos)
+    assert vals.shape == (3, 2)
+    assert vecs.shape == (3, 10, 2)
+
+    for i, rho in enumerate(rhos):
+        ref = SparseTICA(n_components=2, rho=rho).fit(data)
+        np.testing.assert_array_almost_equal(vals[i], ref.eigenvalues_,
+                                             decimal=3)
+
+    cold_vals, _ = stica.regularization_path(rhos, warm_start=False)
+    np.testing.assert_array_almost_equal(vals, cold_vals, decimal=3)
+
+
+def test_rho_change_resolves():
+    data = build_dataset()
+    stica = SparseTICA(n_components=1, rho=0.01).fit(data)
+    stica.eigenvalues_
+
+    stica.rho = 0.05
+    ref = SparseTICA(n_components=1, rho=0.05).fit(data)
+    np.testing.assert_array_almost_equal(stica.eigenvalues_,
+                                         ref.eigenvalues_, decimal=3)
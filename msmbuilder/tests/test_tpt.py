@@ -2,8 +2,15 @@ from __future__ import print_function, division, absolute_import
 
 import numpy as np
 import numpy.testing as npt
+import scipy.sparse
 
 from msmbuilder import tpt
+from msmbuilder.tpt import _linalg
+from msmbuilder.tpt.committor import (_batch_committors, _committors,
+                                      _conditional_committors)
+from msmbuilder.tpt.flux import _fluxes
+from msmbuilder.tpt.mfpt import _all_pairs_mfpts, _mfpts
+from msmbuilder.tpt.path import _remove_bottleneck, _subtract_path_flux
 from msmbuilder.msm import MarkovStateModel, BayesianMarkovStateModel
 
 
@@ -35,6 +42,47 @@ def test_paths():
             npt.assert_array_equal(paths[i], ref_paths[i])
 
 
+def test_paths_sparse():
+    # paths on a sparse net flux must find the same fluxes as on a dense one
+    assignments = np.random.randint(30, size=(10, 2000))
+    msm = MarkovStateModel(lag_time=1)
+    msm.fit(assignments)
+    sources, sinks = [0, 1], [28, 29]
+    net_flux = tpt.net_fluxes(sources, sinks, msm)
+
+    paths, fluxes = tpt.paths(sources, sinks, net_flux, num_paths=20)
+    sparse_paths, sparse_fluxes = tpt.paths(
+        sources, sinks, scipy.sparse.csr_matrix(net_flux), num_paths=20)
+    npt.assert_array_equal(fluxes, sparse_fluxes)
+
+    for path, flux in zip(paths, fluxes):
+        top_path, top_flux = tpt.top_path(sources, sinks, net_flux)
+        npt.assert_almost_equal(flux, top_flux)
+        npt.assert_almost_equal(flux, net_flux[path[:-1], path[1:]].min())
+        net_flux[path[:-1], path[1:]] -= flux
+
+
+def test_paths_baseline_sequence():
+    # with many ties between the fluxes, paths must extract the same
+    # sequence as finding the top path again after every removal
+    assignments = np.random.RandomState(0).randint(26, size=(10, 2000))
+    msm = MarkovStateModel(lag_time=1)
+    msm.fit(assignments)
+    sources, sinks = [0, 1], [24, 25]
+    net_flux = np.round(tpt.net_fluxes(sources, sinks, msm), 3)
+
+    for remove_path, remove in [('subtract', _subtract_path_flux),
+                                ('bottleneck', _remove_bottleneck)]:
+        paths, fluxes = tpt.paths(sources, sinks, net_flux,
+                                  remove_path=remove_path, num_paths=30)
+        reduced = net_flux.copy()
+        for path, flux in zip(paths, fluxes):
+            top_path, top_flux = tpt.top_path(sources, sinks, reduced)
+            npt.assert_array_equal(path, top_path)
+            npt.assert_equal(flux, top_flux)
+            reduced = remove(reduced, path)
+
+
 def test_committors_1():
     msm = MarkovStateModel(lag_time=1)
     assignments = np.random.randint(3, size=(10, 1000))
@@ -191,6 +239,23 @@ def test_fluxes_2():
     npt.assert_array_almost_equal(ref_net_fluxes, net_fluxes, decimal=2)
 
 
+def test_fluxes_sparse():
+    msm = MarkovStateModel(lag_time=1)
+    assignments = np.random.randint(8, size=(10, 1000))
+    msm.fit(assignments)
+
+    ref_fluxes = tpt.fluxes([0], [7], msm)
+    ref_net_fluxes = tpt.net_fluxes([0], [7], msm)
+
+    msm.transmat_ = scipy.sparse.csr_matrix(msm.transmat_)
+    fluxes = tpt.fluxes([0], [7], msm)
+    net_fluxes = tpt.net_fluxes([0], [7], msm)
+    assert scipy.sparse.isspmatrix_csr(fluxes)
+    assert scipy.sparse.isspmatrix_csr(net_fluxes)
+    npt.assert_array_almost_equal(fluxes.toarray(), ref_fluxes)
+    npt.assert_array_almost_equal(net_fluxes.toarray(), ref_net_fluxes)
+
+
 def test_hubscore():
     # Make an actual hub!
 
@@ -273,3 +338,175 @@ def test_mfpt2():
     # same as the escape time of 0
     npt.assert_almost_equal(1 / (1 - tprob[0, 0]), mfpts[0, 1])
     npt.assert_almost_equal(1 / (1 - tprob[1, 1]), mfpts[1, 0])
+
+
+def test_all_pairs_mfpts():
+    assignments = np.random.randint(10, size=(10, 2000))
+    msm = MarkovStateModel(lag_time=1)
+    msm.fit(assignments)
+    tprob, populations = msm.transmat_, msm.populations_
+    ref = np.vstack([tpt.mfpts(msm, i, lag_time=2.0) for i in range(10)]).T
+
+    for method in ['dense', 'blocked']:
+        npt.assert_array_almost_equal(
+            ref, tpt.all_pairs_mfpts(msm, lag_time=2.0, method=method))
+    npt.assert_array_almost_equal(
+        ref, _all_pairs_mfpts(scipy.sparse.csr_matrix(tprob), populations,
+                              2.0))
+    npt.assert_array_almost_equal(
+        ref[:, [3, 1]], tpt.all_pairs_mfpts(msm, lag_time=2.0,
+                                            method='blocked', targets=[3, 1]))
+
+    # with all of the relaxation processes, the spectral expansion is exact
+    npt.assert_array_almost_equal(
+        ref, tpt.all_pairs_mfpts(msm, lag_time=2.0, method='approximate',
+                                 n_components=9))
+    # without any, only the mean recurrence times are left
+    npt.assert_array_almost_equal(
+        (1 - np.eye(10)) / populations,
+        _all_pairs_mfpts(tprob, populations, 1.0, 'approximate',
+                         n_components=0))
+
+
+def test_batch_committors():
+    assignments = np.random.randint(10, size=(10, 2000))
+    msm = MarkovStateModel(lag_time=1)
+    msm.fit(assignments)
+    tprob = msm.transmat_
+
+    reactions = [([0], [9]), ([0, 1], [9]), ([2, 3, 4], [8, 9]),
+                 ([5], [9]), ([9], [0]), ([], [8, 9])]
+    ref = [_committors(sources, sinks, tprob) for sources, sinks in reactions]
+    npt.assert_array_almost_equal(ref, tpt.batch_committors(reactions, msm))
+    npt.assert_array_almost_equal(
+        ref, _batch_committors(reactions, scipy.sparse.csr_matrix(tprob)))
+
+
+def test_sparse_backend():
+    # the sparse LU and iterative solvers agree with the dense one
+    assignments = np.random.randint(20, size=(10, 2000))
+    msm = MarkovStateModel(lag_time=1)
+    msm.fit(assignments)
+    tprob = msm.transmat_
+    sparse_tprob = scipy.sparse.csr_matrix(tprob)
+
+    committors = _committors([0, 1], [5], tprob)
+    cond_committors = _conditional_committors(0, 5, 3, tprob)
+    mfpts = _mfpts(tprob, msm.populations_, [2, 7], 1.0)
+    for method in ['direct', 'iterative']:
+        _linalg.METHOD = method
+        try:
+            npt.assert_array_almost_equal(
+                committors, _committors([0, 1], [5], sparse_tprob))
+            npt.assert_array_almost_equal(
+                cond_committors,
+                _conditional_committors(0, 5, 3, sparse_tprob))
+            npt.assert_array_almost_equal(
+                mfpts, _mfpts(sparse_tprob, msm.populations_, [2, 7], 1.0))
+        finally:
+            _linalg.METHOD = 'auto'
+
+    # the factorization is reused when only the right-hand side changes
+    solve = _linalg.absorbing_solver(sparse_tprob, [0, 5])[1]
+    assert _linalg.absorbing_solver(sparse_tprob.copy(), [5, 0])[1] is solve
+
+    # dense factorizations are not kept, and clear_cache drops the others
+    dense_solve = _linalg.absorbing_solver(tprob, [0, 5])[1]
+    assert _linalg.absorbing_solver(tprob, [0, 5])[1] is not dense_solve
+    tpt.clear_cache()
+    assert _linalg.absorbing_solver(sparse_tprob, [0, 5])[1] is not solve
+
+
+def test_coarse_tpt():
+    # two metastable sets of 20 states
+    random = np.random.RandomState(0)
+    states = [0]
+    for _ in range(20000):
+        well = states[-1] // 20
+        if random.rand() < 0.01:
+            well = 1 - well
+        states.append(20 * well + random.randint(20))
+    msm = MarkovStateModel(lag_time=1).fit([np.array(states)])
+    tprob = msm.transmat_
+
+    committors = _committors([0], [39], tprob)
+    mfpts = _mfpts(tprob, msm.populations_, [39], 1.0)
+    for transmat in [tprob, scipy.sparse.csr_matrix(tprob)]:
+        msm.transmat_ = transmat
+        coarse = tpt.CoarseTPT(msm, n_macrostates=2)
+        assert len(coarse.lumpings_[0]) == 40
+        assert len(np.unique(coarse.lumpings_[0])) <= 2
+
+        for tol in [1e-1, 1e-3, 0]:
+            q, error = coarse.committors([0], [39], tol=tol)
+            assert error <= tol
+            assert np.max(np.abs(q - committors)) <= error + 1e-10
+
+            m, error = coarse.mfpts([39], lag_time=2.0, tol=tol)
+            assert error <= tol
+            assert (np.max(np.abs(m - 2.0 * mfpts)) <=
+                    (error + 1e-10) * np.max(m))
+
+        flux, error = coarse.fluxes([0], [39], tol=0)
+        assert error == 0
+        npt.assert_array_almost_equal(
+            scipy.sparse.csr_matrix(flux).toarray(),
+            scipy.sparse.csr_matrix(_fluxes([0], [39], tprob,
+                                            msm.populations_)).toarray())
+        net_flux, error = coarse.net_fluxes([0], [39], tol=0)
+        npt.assert_array_almost_equal(
+            scipy.sparse.csr_matrix(net_flux).toarray(),
+            scipy.sparse.csr_matrix(
+                tpt.net_fluxes([0], [39], msm)).toarray())
+
+    # lumpings can be given, e.g. by PCCA
+    msm.transmat_ = tprob
+    coarse = tpt.CoarseTPT(msm, lumpings=[np.arange(40) // 20,
+                                          np.arange(40) // 5])
+    assert [len(np.unique(labels)) for labels in coarse.lumpings_] == [2, 8]
+    q, error = coarse.committors([0], [39], tol=1e-3)
+    assert np.max(np.abs(q - committors)) <= error + 1e-10
+
+
+def test_ensemble_samples():
+    # the stacked solves of an ensemble agree with solving each sample
+    bmsm = BayesianMarkovStateModel(lag_time=1, n_samples=20)
+    assignments = np.random.randint(6, size=(10, 1000))
+    bmsm.fit(assignments)
+    samples = list(zip(bmsm.all_transmats_, bmsm.all_populations_))
+
+    committors = tpt.committors([0], [5], bmsm, return_samples=True)
+    npt.assert_array_almost_equal(
+        committors, [_committors([0], [5], tprob) for tprob, _ in samples])
+    npt.assert_array_almost_equal(
+        np.median(committors, axis=0), tpt.committors([0], [5], bmsm))
+    npt.assert_array_almost_equal(
+        tpt.batch_committors([([0], [5]), ([1], [4])], bmsm,
+                             return_samples=True)[:, 0], committors)
+
+    cond_committors = tpt.conditional_committors(0, 5, 2, bmsm,
+                                                 return_samples=True)
+    npt.assert_array_almost_equal(
+        cond_committors,
+        [_conditional_committors(0, 5, 2, tprob) for tprob, _ in samples])
+
+    mfpts = tpt.mfpts(bmsm, [3], return_samples=True)
+    npt.assert_array_almost_equal(
+        mfpts, [_mfpts(tprob, pops, [3], 1.0) for tprob, pops in samples])
+    assert tpt.mfpts(bmsm, [3]).shape == (6,)
+    mfpts = tpt.mfpts(bmsm, return_samples=True)
+    npt.assert_array_almost_equal(
+        mfpts, [_mfpts(tprob, pops, None, 1.0) for tprob, pops in samples])
+
+    fluxes = tpt.fluxes([0], [5], bmsm, return_samples=True)
+    assert fluxes.shape == (20, 6, 6)
+    npt.assert_array_almost_equal(
+        np.median(fluxes, axis=0), tpt.fluxes([0], [5], bmsm))
+
+    fractions = tpt.fraction_visited(0, 5, 2, bmsm, return_samples=True)
+    npt.assert_array_almost_equal(
+        fractions,
+        [tprob[0].dot(cond) / tprob[0].dot(q) for (tprob, _), cond, q in
+         zip(samples, cond_committors, committors)])
+    npt.assert_almost_equal(np.median(fractions),
+                            tpt.fraction_visited(0, 5, 2, bmsm))
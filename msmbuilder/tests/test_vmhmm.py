@@ -9,6 +9,7 @@ from scipy.stats.distributions import vonmises
 from msmbuilder.example_datasets import AlanineDipeptide
 from msmbuilder.featurizer import DihedralFeaturizer
 from msmbuilder.hmm import VonMisesHMM
+from msmbuilder.hmm.vonmises import inverse_mbessel_ratio
 
 
 def test_code_works():
@@ -115,3 +116,15 @@ def test_3_state():
         model.fit(X)
         validate_timeseries(means, kappas, transmat, model, 0.1, 0.5, 0.1)
         assert abs(model.fit_logprob_[-1] - model.score(X)) < 0.5
+
+
+def test_inverse_mbessel_ratio():
+    kappas = np.logspace(-4, np.log10(600), 1000)
+    y = inverse_mbessel_ratio.bessel_ratio(kappas)
+    np.testing.assert_allclose(inverse_mbessel_ratio(y), kappas, rtol=1e-9)
+    np.testing.assert_allclose(
+        inverse_mbessel_ratio(y.reshape(10, 100)), kappas.reshape(10, 100),
+        rtol=1e-9)
+    # values outside of the tabulated range are clipped
+    np.testing.assert_array_equal(inverse_mbessel_ratio([0.0, 1.0]),
+                                  [1e-5, 700])
@@ -26,12 +26,15 @@ References
 
 from __future__ import absolute_import
 
-from .committor import committors, conditional_committors
+from .committor import committors, conditional_committors, batch_committors
 from .flux import fluxes, net_fluxes
 from .hub import fraction_visited, hub_scores
 from .path import paths, top_path
-from .mfpt import mfpts
+from .mfpt import mfpts, all_pairs_mfpts
+from .coarse import CoarseTPT
+from ._linalg import clear_cache
 
 __all__ = ['fluxes', 'net_fluxes', 'fraction_visited',
            'hub_scores', 'paths', 'top_path', 'committors',
-           'conditional_committors', 'mfpts']
+           'conditional_committors', 'batch_committors', 'mfpts',
+           'all_pairs_mfpts', 'CoarseTPT', 'clear_cache']
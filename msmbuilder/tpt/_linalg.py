@@ -0,0 +1,239 @@
+# Author: MSMBuilder Developers
+# Contributors:
+# Copyright (c) 2026, Stanford University and the Authors
+# All rights reserved.
+
+"""
+Linear solvers for the absorbing Markov chain problems of TPT.
+
+Committors, conditional committors and mean first passage times all solve
+systems (I - P) x = r, where P is the transition matrix restricted to the
+states that are not absorbing. Dense transition matrices are factored with
+LAPACK. Sparse (e.g. CSR) transition matrices are factored with SuperLU, so
+that MSMs with 10^4-10^5 states fit in memory, and fall back to GMRES
+preconditioned by an incomplete LU factorization when the complete
+factorization runs out of memory. The most recent sparse factorizations
+are cached, so solving again with the same transition matrix and absorbing
+states only costs the triangular solves; ``clear_cache`` releases them.
+Dense factorizations are not cached, since each would hold on to an
+n_states x n_states matrix.
+
+The ensembles of transition matrices of e.g. ``BayesianMarkovStateModel``
+are solved all at once by stacking their systems, in batches that fit in
+``BATCH_BYTES``.
+"""
+from __future__ import print_function, division, absolute_import
+import collections
+import hashlib
+import threading
+import warnings
+
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
+
+__all__ = ['absorbing_solver', 'batch_absorbing_solve', 'clear_cache']
+
+#: number of sparse factorizations that are kept for reuse
+CACHE_SIZE = 4
+#: relative residual at which the iterative solver stops
+ITERATIVE_TOL = 1e-10
+#: default method of absorbing_solver for sparse systems
+METHOD = 'auto'
+#: memory that a batch of stacked dense systems may use, in bytes
+BATCH_BYTES = 2 ** 28
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def absorbing_solver(tprob, absorbing, method=None):
+    """
+    Factor the absorbing-chain system of a transition matrix.
+
+    Parameters
+    ----------
+    tprob : np.ndarray or scipy.sparse matrix, shape=(n_states, n_states)
+        Transition matrix.
+    absorbing : array_like, int
+        The absorbing states.
+    method : {'auto', 'direct', 'iterative'}, optional
+        How to solve sparse systems. 'direct' uses a sparse LU
+        factorization, 'iterative' uses preconditioned GMRES, and 'auto'
+        uses the LU factorization unless it runs out of memory. Dense
+        systems always use a dense LU factorization. Defaults to
+        ``METHOD``.
+
+    Returns
+    -------
+    interior : np.ndarray, int
+        The states that are not absorbing, in increasing order.
+    solve : callable
+        ``solve(rhs)`` returns x such that (I - P) x = rhs, where P is
+        ``tprob`` restricted to ``interior``. ``rhs`` may have shape
+        (n_interior,) or (n_interior, n_rhs).
+    """
+    if method is None:
+        method = METHOD
+    if method not in ('auto', 'direct', 'iterative'):
+        raise ValueError("method must be one of 'auto', 'direct', "
+                         "'iterative': %r" % method)
+
+    n_states = np.shape(tprob)[0]
+    absorbing = np.unique(np.asarray(absorbing, dtype=int).reshape((-1,)))
+    interior = np.setdiff1d(np.arange(n_states), absorbing)
+
+    if not scipy.sparse.issparse(tprob):
+        return interior, _dense_solver(tprob, interior)
+
+    key = (_fingerprint(tprob), absorbing.tobytes(), method)
+    with _cache_lock:
+        solve = _cache.pop(key, None)
+        if solve is not None:
+            _cache[key] = solve
+            return interior, solve
+
+    solve = _sparse_solver(tprob, interior, method)
+    with _cache_lock:
+        _cache.pop(key, None)
+        while len(_cache) >= CACHE_SIZE:
+            _cache.popitem(last=False)
+        _cache[key] = solve
+    return interior, solve
+
+
+def clear_cache():
+    """
+    Release the cached sparse factorizations of ``absorbing_solver``.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
+def batch_absorbing_solve(tprobs, absorbing, rhs):
+    """
+    Solve the absorbing-chain systems of a stack of transition matrices.
+
+    Parameters
+    ----------
+    tprobs : np.ndarray, shape=(n_samples, n_states, n_states)
+        Transition matrices.
+    absorbing : array_like, int
+        The absorbing states.
+    rhs : np.ndarray, shape=(n_samples, n_states)
+        Right-hand sides. Only their entries for the states that are not
+        absorbing are used.
+
+    Returns
+    -------
+    x : np.ndarray, shape=(n_samples, n_states)
+        x[i] solves (I - P) x = rhs[i] on the states that are not absorbing,
+        where P is ``tprobs[i]`` restricted to them, and is zero on the
+        absorbing states.
+    """
+    tprobs = np.asarray(tprobs, dtype=np.float64)
+    rhs = np.asarray(rhs, dtype=np.float64)
+    n_samples, n_states = tprobs.shape[:2]
+    absorbing = np.unique(np.asarray(absorbing, dtype=int).reshape((-1,)))
+    interior = np.setdiff1d(np.arange(n_states), absorbing)
+    n_interior = len(interior)
+
+    x = np.zeros((n_samples, n_states))
+    if n_interior == 0:
+        return x
+
+    batch_size = max(1, BATCH_BYTES // (8 * n_interior ** 2))
+    diagonal = np.arange(n_interior)
+    for start in range(0, n_samples, batch_size):
+        batch = slice(start, start + batch_size)
+        lhs = -tprobs[batch][:, interior[:, np.newaxis], interior]
+        lhs[:, diagonal, diagonal] += 1.0
+        x[batch, interior] = np.linalg.solve(
+            lhs, rhs[batch][:, interior, np.newaxis])[:, :, 0]
+    return x
+
+
+def _fingerprint(tprob):
+    """A key that identifies the contents of a sparse transition matrix."""
+    tprob = scipy.sparse.csr_matrix(tprob)
+    digest = hashlib.sha1()
+    for array in [tprob.indptr, tprob.indices, tprob.data]:
+        digest.update(array.dtype.str.encode('ascii'))
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return np.shape(tprob), digest.hexdigest()
+
+
+def _dense_solver(tprob, interior):
+    tprob = np.asarray(tprob)
+    lhs = np.eye(len(interior)) - tprob[np.ix_(interior, interior)]
+    with warnings.catch_warnings():
+        # a singular factor raises LinAlgError below
+        warnings.simplefilter('ignore')
+        lu, piv = scipy.linalg.lu_factor(lhs, check_finite=False)
+    if np.any(np.diag(lu) == 0):
+        raise np.linalg.LinAlgError('Singular matrix')
+
+    def solve(rhs):
+        return scipy.linalg.lu_solve((lu, piv), rhs, check_finite=False)
+
+    return solve
+
+
+def _sparse_solver(tprob, interior, method):
+    tprob = scipy.sparse.csr_matrix(tprob)
+    lhs = (scipy.sparse.identity(len(interior), format='csc') -
+           tprob[interior][:, interior].tocsc())
+
+    if method != 'iterative':
+        try:
+            lu = scipy.sparse.linalg.splu(lhs)
+        except MemoryError:
+            if method == 'direct':
+                raise
+            warnings.warn('Sparse LU factorization of %d states ran out of '
+                          'memory, falling back to an iterative solver' %
+                          len(interior))
+        except RuntimeError as e:
+            # SuperLU reports an exactly singular factor this way
+            raise np.linalg.LinAlgError(str(e))
+        else:
+            def solve(rhs):
+                return lu.solve(np.asarray(rhs, dtype=np.float64))
+
+            return solve
+
+    return _iterative_solver(lhs)
+
+
+def _iterative_solver(lhs):
+    try:
+        ilu = scipy.sparse.linalg.spilu(lhs, drop_tol=1e-6, fill_factor=10)
+        preconditioner = scipy.sparse.linalg.LinearOperator(lhs.shape,
+                                                            ilu.solve)
+    except (RuntimeError, MemoryError):
+        preconditioner = None
+
+    def solve(rhs):
+        rhs = np.asarray(rhs, dtype=np.float64)
+        columns = rhs.reshape((len(rhs), -1))
+        x = np.empty_like(columns)
+        for j in range(columns.shape[1]):
+            x[:, j], info = _gmres(lhs, columns[:, j], preconditioner)
+            if info != 0:
+                warnings.warn('GMRES did not converge to a relative residual '
+                              'of %g (info=%d)' % (ITERATIVE_TOL, info))
+        return x.reshape(rhs.shape)
+
+    return solve
+
+
+def _gmres(lhs, rhs, preconditioner, x0=None, restart=50, maxiter=1000,
+           tol=ITERATIVE_TOL):
+    kwargs = dict(M=preconditioner, x0=x0, restart=restart, maxiter=maxiter)
+    try:
+        return scipy.sparse.linalg.gmres(lhs, rhs, rtol=tol, atol=0.0,
+                                         **kwargs)
+    except TypeError:
+        # scipy < 1.12 calls the relative tolerance tol
+        return scipy.sparse.linalg.gmres(lhs, rhs, tol=tol, **kwargs)
@@ -0,0 +1,481 @@
+# Author: MSMBuilder Developers
+# Contributors:
+# Copyright (c) 2026, Stanford University and the Authors
+# All rights reserved.
+
+"""
+Approximate transition path theory on a hierarchy of lumped MSMs.
+
+Committors, fluxes and mean first passage times of an MSM with many states
+require the solution of a linear system over all of its states, for every
+choice of sources and sinks. ``CoarseTPT`` instead lumps the MSM once into a
+hierarchy of models with fewer and fewer macrostates. A query is first
+answered on the coarsest model, with the states of the query split out of
+their macrostates, and is then refined on demand: the solution is improved
+by GMRES iterations on the MSM, preconditioned by finer and finer models of
+the hierarchy, until a bound on its error falls below a tolerance.
+"""
+from __future__ import print_function, division, absolute_import
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
+
+from . import _linalg
+from ._linalg import BATCH_BYTES
+from .flux import _fluxes, _net_fluxes
+
+__all__ = ['CoarseTPT']
+
+#: number of GMRES iterations of every refinement
+KRYLOV_ITERATIONS = 10
+#: number of refinements preconditioned by the finest lumped model, before
+#: the MSM is solved directly
+REFINEMENTS = 3
+
+
+class CoarseTPT(object):
+    """Approximate TPT queries on a cached hierarchy of lumped MSMs.
+
+    Parameters
+    ----------
+    msm : msmbuilder.MarkovStateModel
+        MSM fit to the data. Only its ``transmat_`` and ``populations_`` are
+        used, which may be dense or sparse.
+    lumpings : list of array_like, int, optional
+        Coarse-grainings of the states of ``msm``, each of which maps every
+        state to a macrostate, such as the ``microstate_mapping_`` of
+        ``PCCA`` or ``PCCAPlus`` models. If not provided, a hierarchy is built
+        by repeatedly lumping every state with the state it is kinetically
+        most strongly connected to, until at most ``n_macrostates``
+        macrostates remain.
+    n_macrostates : int, default=10
+        Number of macrostates at which the automatically built hierarchy
+        stops.
+
+    Attributes
+    ----------
+    lumpings_ : list of np.ndarray, int
+        The macrostate of every state of ``msm`` in each of the lumped
+        models, from the coarsest to the finest.
+    n_states_ : int
+        Number of states of ``msm``.
+
+    Notes
+    -----
+    The lumped transition matrix of a coarse-graining is
+    :math:`T^c_{IJ} = \\sum_{i \\in I, j \\in J} \\pi_i T_{ij} / \\pi_I`. The
+    equilibrium fluxes :math:`\\sum \\pi_i T_{ij}` between macrostates are
+    cached for every lumped model, so that splitting the sources and sinks
+    of a query out of their macrostates only costs the transitions into and
+    out of these states.
+
+    Every query solves :math:`(I - P) x = b`, where P is the transition
+    matrix restricted to the states that are not absorbing. The solution of
+    a lumped model is interpolated onto the states of the MSM with one step
+    of the MSM's own dynamics. This gives the first answer, from the
+    coarsest model, and preconditions the refinements, which are cycles of
+    ``KRYLOV_ITERATIONS`` GMRES iterations with finer and finer models. If
+    the error is still too large after ``REFINEMENTS`` cycles with the
+    finest model, the MSM is solved directly.
+
+    Since :math:`(I - P)^{-1}` is nonnegative, the largest error of x is at
+    most its largest residual :math:`|b - (I - P) x|` times the largest mean
+    first passage time to the absorbing states. The reported errors are
+    this bound, and are zero if the MSM was solved directly.
+
+    Examples
+    --------
+    >>> msm = MarkovStateModel().fit(assignments)
+    >>> tpt = CoarseTPT(msm)
+    >>> committors, error = tpt.committors(sources=[0], sinks=[1], tol=1e-2)
+
+    See Also
+    --------
+    msmbuilder.tpt.committors, msmbuilder.tpt.fluxes, msmbuilder.tpt.mfpts
+    """
+
+    def __init__(self, msm, lumpings=None, n_macrostates=10):
+        self.msm = msm
+        self.n_macrostates = n_macrostates
+
+        tprob = msm.transmat_
+        if scipy.sparse.issparse(tprob):
+            tprob = scipy.sparse.csr_matrix(tprob)
+            # columns of the transition matrix, for splitting states
+            self._columns = tprob.tocsc()
+        else:
+            tprob = np.asarray(tprob)
+            self._columns = tprob
+        self._tprob = tprob
+        self._populations = np.asarray(msm.populations_)
+        self.n_states_ = len(self._populations)
+
+        if lumpings is None:
+            levels = _build_hierarchy(tprob, self._populations, n_macrostates)
+        else:
+            levels = []
+            for labels in lumpings:
+                labels = np.unique(np.asarray(labels, dtype=int),
+                                   return_inverse=True)[1].reshape((-1,))
+                if len(labels) != self.n_states_:
+                    raise ValueError('Every lumping must map all %d states '
+                                     'to a macrostate' % self.n_states_)
+                levels.append((labels, _lumped_fluxes(
+                    tprob, self._populations, labels)))
+        # from the coarsest to the finest
+        levels.sort(key=lambda level: level[1].shape[0])
+        self._levels = levels
+        self.lumpings_ = [labels for labels, _ in levels]
+
+    def committors(self, sources, sinks, tol=1e-2):
+        """
+        Get the forward committors of the reaction sources -> sinks.
+
+        Parameters
+        ----------
+        sources : array_like, int
+            The set of unfolded/reactant states.
+        sinks : array_like, int
+            The set of folded/product states.
+        tol : float, default=1e-2
+            Largest acceptable error of any of the committors. With
+            ``tol=0``, the committors of the MSM are solved for directly.
+
+        Returns
+        -------
+        forward_committors : np.ndarray
+            The forward committors for the reaction sources -> sinks.
+        error : float
+            Bound on the largest error of the committors.
+        """
+        sources = np.array(sources, dtype=int).reshape((-1,))
+        sinks = np.array(sinks, dtype=int).reshape((-1,))
+        absorbing = np.concatenate([sources, sinks])
+
+        # the largest mfpt to the absorbing states is at most
+        # max(mfpts) / (1 - residual)
+        max_mfpt = 1.0
+        if tol > 0:
+            mfpts, residual = self._solve(
+                absorbing, np.zeros(self.n_states_), np.ones(self.n_states_),
+                tol=0.5)
+            max_mfpt = max(np.max(mfpts), 1.0) / (1.0 - residual)
+
+        ident_sinks = np.zeros(self.n_states_)
+        ident_sinks[sinks] = 1.0
+        forward_committors, residual = self._solve(
+            absorbing, ident_sinks, np.zeros(self.n_states_),
+            tol=tol / max_mfpt)
+        return forward_committors, min(residual * max_mfpt, 1.0)
+
+    def fluxes(self, sources, sinks, tol=1e-2):
+        """
+        Compute the transition path theory flux matrix.
+
+        Parameters
+        ----------
+        sources : array_like, int
+            The set of unfolded/reactant states.
+        sinks : array_like, int
+            The set of folded/product states.
+        tol : float, default=1e-2
+            Largest acceptable error of any of the committors that the
+            fluxes are computed from.
+
+        Returns
+        -------
+        flux_matrix : np.ndarray or scipy.sparse.csr_matrix
+            The flux matrix, sparse if the transition matrix is sparse.
+        error : float
+            Bound on the largest error of the committors. The error of the
+            flux from state i to state j is at most ``2 * error`` times the
+            equilibrium flux from i to j.
+        """
+        forward_committors, error = self.committors(sources, sinks, tol=tol)
+        return _fluxes(sources, sinks, self._tprob, self._populations,
+                       for_committors=forward_committors), error
+
+    def net_fluxes(self, sources, sinks, tol=1e-2):
+        """
+        Computes the transition path theory net flux matrix.
+
+        Parameters
+        ----------
+        sources : array_like, int
+            The set of unfolded/reactant states.
+        sinks : array_like, int
+            The set of folded/product states.
+        tol : float, default=1e-2
+            Largest acceptable error of any of the committors that the net
+            fluxes are computed from.
+
+        Returns
+        -------
+        net_flux : np.ndarray or scipy.sparse.csr_matrix
+            The net flux matrix, sparse if the transition matrix is sparse.
+        error : float
+            Bound on the largest error of the committors.
+        """
+        flux_matrix, error = self.fluxes(sources, sinks, tol=tol)
+        return _net_fluxes(flux_matrix), error
+
+    def mfpts(self, sinks, lag_time=1., tol=1e-2):
+        """
+        Get the mean first passage times of all states to a set of sinks.
+
+        Parameters
+        ----------
+        sinks : array_like, int
+            Indices of the sink states.
+        lag_time : float, optional
+            Lag time for the model. The MFPT will be reported in whatever
+            units are given here. Default is (1) which is in units of the
+            lag time of the MSM.
+        tol : float, default=1e-2
+            Largest acceptable error of any of the MFPTs, relative to the
+            largest MFPT. With ``tol=0``, the MFPTs of the MSM are solved for
+            directly.
+
+        Returns
+        -------
+        mfpts : np.ndarray, float
+            mfpts[i] is the mean first passage time from state i to any
+            state in sinks.
+        error : float
+            Bound on the largest error of the MFPTs, relative to the largest
+            MFPT.
+        """
+        sinks = np.array(sinks, dtype=int).reshape((-1,))
+
+        # relative to the largest mfpt, the error is at most the residual
+        mfpts, residual = self._solve(sinks, np.zeros(self.n_states_),
+                                      np.ones(self.n_states_), tol=tol)
+        return lag_time * mfpts, residual
+
+    def _solve(self, absorbing, boundary, rhs, tol):
+        """
+        Solve x = rhs + T x on the states that are not absorbing, with
+        x = boundary on the absorbing states, until the largest residual is
+        at most ``tol``.
+
+        Returns
+        -------
+        x : np.ndarray, shape=(n_states,)
+            The solution.
+        residual : float
+            The largest residual of x, which is zero if the MSM was solved
+            directly.
+        """
+        absorbing = np.unique(absorbing)
+        interior = np.setdiff1d(np.arange(self.n_states_), absorbing)
+        x = np.array(boundary, dtype=float)
+        n_interior = len(interior)
+
+        def matvec(x_interior):
+            # (I - P) x_interior, with zeros on the absorbing states
+            full = np.zeros(self.n_states_)
+            full[interior] = x_interior
+            return x_interior - self._tprob.dot(full)[interior]
+
+        lhs = scipy.sparse.linalg.LinearOperator(
+            (n_interior, n_interior), matvec=matvec, dtype=float)
+        b = (rhs + self._tprob.dot(x))[interior]
+
+        # the first answer comes from the coarsest model, and every
+        # refinement after it is preconditioned by the next finer one
+        n_levels = len(self._levels)
+        x_interior = None
+        if tol > 0 and n_interior > 0 and n_levels > 0:
+            for cycle in range(n_levels + REFINEMENTS):
+                if cycle < n_levels:
+                    preconditioner = self._preconditioner(
+                        cycle, absorbing, interior, matvec)
+                if x_interior is None:
+                    x_interior = preconditioner.matvec(b)
+                else:
+                    x_interior = _linalg._gmres(
+                        lhs, b, preconditioner, x0=x_interior,
+                        restart=KRYLOV_ITERATIONS, maxiter=1, tol=0.0)[0]
+                residual = np.max(np.abs(b - matvec(x_interior)))
+                if residual <= tol:
+                    x[interior] = x_interior
+                    return x, residual
+
+        if n_interior > 0:
+            solve = _linalg.absorbing_solver(self._tprob, absorbing)[1]
+            x[interior] = solve(b)
+        return x, 0.0
+
+    def _preconditioner(self, level, absorbing, interior, matvec):
+        """
+        Solve the lumped model of a level, with the absorbing states split
+        out, and interpolate with one step of the dynamics of the MSM.
+        """
+        labels, tprob, populations = self._split(level, absorbing)
+        coarse_interior, solve = _linalg.absorbing_solver(tprob,
+                                                          labels[absorbing])
+        labels = labels[interior]
+        weights = self._populations[interior]
+        n_interior = len(interior)
+
+        def precondition(r):
+            coarse_r = np.bincount(labels, weights=weights * r,
+                                   minlength=len(populations)) / populations
+            coarse = np.zeros(len(populations))
+            coarse[coarse_interior] = solve(coarse_r[coarse_interior])
+            y = coarse[labels]
+            return y + r - matvec(y)
+
+        return scipy.sparse.linalg.LinearOperator(
+            (n_interior, n_interior), matvec=precondition, dtype=float)
+
+    def _split(self, level, states):
+        """
+        The lumped model of a level, with ``states`` split out of their
+        macrostates into macrostates of their own.
+
+        Returns
+        -------
+        labels : np.ndarray, int
+            The macrostate of every state of the MSM.
+        tprob : np.ndarray or scipy.sparse.csr_matrix
+            Lumped transition matrix.
+        populations : np.ndarray
+            Lumped populations.
+        """
+        labels, level_fluxes = self._levels[level]
+        n_macrostates = level_fluxes.shape[0]
+        states = np.unique(states)
+
+        split_labels = labels.copy()
+        split_labels[states] = n_macrostates + np.arange(len(states))
+        n_split = n_macrostates + len(states)
+
+        # the equilibrium fluxes out of and into the split states are
+        # moved from their old macrostates to their new ones
+        outgoing = scipy.sparse.coo_matrix(self._tprob[states])
+        incoming = scipy.sparse.coo_matrix(self._columns[:, states])
+        keep = split_labels[incoming.row] < n_macrostates
+        i = np.concatenate([states[outgoing.row], incoming.row[keep]])
+        j = np.concatenate([outgoing.col, states[incoming.col[keep]]])
+        flux = np.concatenate([outgoing.data, incoming.data[keep]])
+        flux = flux * self._populations[i]
+
+        moved = scipy.sparse.coo_matrix(
+            (np.concatenate([-flux, flux]),
+             (np.concatenate([labels[i], split_labels[i]]),
+              np.concatenate([labels[j], split_labels[j]]))),
+            shape=(n_split, n_split))
+        if scipy.sparse.issparse(level_fluxes):
+            level_fluxes = level_fluxes.tocoo()
+            split_fluxes = scipy.sparse.coo_matrix(
+                (level_fluxes.data, (level_fluxes.row, level_fluxes.col)),
+                shape=(n_split, n_split)) + moved
+        else:
+            split_fluxes = moved.toarray()
+            split_fluxes[:n_macrostates, :n_macrostates] += level_fluxes
+
+        # drop the macrostates that consisted of split states only
+        macrostates, split_labels = np.unique(split_labels,
+                                              return_inverse=True)
+        split_labels = split_labels.reshape((-1,))
+        populations = np.bincount(split_labels, weights=self._populations)
+        if scipy.sparse.issparse(split_fluxes):
+            split_fluxes = scipy.sparse.csr_matrix(split_fluxes)
+            tprob = scipy.sparse.diags(1.0 / populations).dot(
+                split_fluxes[macrostates][:, macrostates]).tocsr()
+        else:
+            tprob = (split_fluxes[np.ix_(macrostates, macrostates)] /
+                     populations[:, np.newaxis])
+        return split_labels, tprob, populations
+
+
+def _lumped_fluxes(tprob, populations, labels):
+    """Equilibrium fluxes between the macrostates of a lumping."""
+    n_states = len(labels)
+    n_macrostates = labels.max() + 1
+    membership = scipy.sparse.csr_matrix(
+        (np.ones(n_states), (np.arange(n_states), labels)),
+        shape=(n_states, n_macrostates))
+    outgoing = scipy.sparse.diags(populations).dot(membership).T.dot(tprob)
+    lumped = membership.T.dot(outgoing.T).T
+    if scipy.sparse.issparse(lumped):
+        return scipy.sparse.csr_matrix(lumped)
+    return np.asarray(lumped)
+
+
+def _build_hierarchy(tprob, populations, n_macrostates):
+    """
+    Lump every state with its most strongly connected state, repeatedly.
+
+    Returns
+    -------
+    levels : list of (labels, fluxes)
+        The macrostate of every state, and the equilibrium fluxes between the
+        macrostates, of each lumped model from the finest to the coarsest.
+    """
+    n_states = len(populations)
+    labels = np.arange(n_states)
+    levels = []
+    while len(populations) > n_macrostates:
+        partners = _strongest_partners(tprob, populations)
+        graph = scipy.sparse.csr_matrix(
+            (np.ones(len(partners)), (np.arange(len(partners)), partners)),
+            shape=(len(partners), len(partners)))
+        n_lumped, lumping = scipy.sparse.csgraph.connected_components(
+            graph, directed=False)
+        if n_lumped == len(populations):
+            break
+
+        fluxes = _lumped_fluxes(tprob, populations, lumping)
+        labels = lumping[labels]
+        levels.append((labels, fluxes))
+
+        populations = np.bincount(lumping, weights=populations)
+        if scipy.sparse.issparse(fluxes):
+            tprob = scipy.sparse.diags(1.0 / populations).dot(fluxes).tocsr()
+        else:
+            tprob = fluxes / populations[:, np.newaxis]
+    return levels
+
+
+def _strongest_partners(tprob, populations):
+    """
+    The state that every state is kinetically most strongly connected to.
+
+    The connection of states i and j is the symmetrized equilibrium flux
+    between them, :math:`(\\pi_i T_{ij} + \\pi_j T_{ji}) /
+    \\sqrt{\\pi_i \\pi_j}`. States that are not connected to any other
+    state are their own partners.
+    """
+    n_states = len(populations)
+    scale = 1.0 / np.sqrt(populations)
+    partners = np.arange(n_states)
+
+    if scipy.sparse.issparse(tprob):
+        fluxes = scipy.sparse.diags(populations).dot(tprob)
+        strength = fluxes + fluxes.T
+        strength = strength - scipy.sparse.diags(strength.diagonal())
+        strength = scipy.sparse.csr_matrix(
+            scipy.sparse.diags(scale).dot(strength).dot(
+                scipy.sparse.diags(scale)))
+        strength.eliminate_zeros()
+        connected = np.diff(strength.indptr) > 0
+        best = np.asarray(strength.argmax(axis=1)).reshape((-1,))
+        partners[connected] = best[connected]
+        return partners
+
+    # the strengths of blocks of rows, so that they fit in BATCH_BYTES
+    batch_size = max(1, BATCH_BYTES // (16 * n_states))
+    for start in range(0, n_states, batch_size):
+        rows = np.arange(start, min(start + batch_size, n_states))
+        strength = (populations[rows, np.newaxis] * tprob[rows] +
+                    (populations[:, np.newaxis] * tprob[:, rows]).T)
+        strength *= scale[rows, np.newaxis] * scale
+        strength[np.arange(len(rows)), rows] = 0.0
+        best = np.argmax(strength, axis=1)
+        connected = strength[np.arange(len(rows)), best] > 0
+        partners[rows[connected]] = best[connected]
+    return partners
@@ -33,15 +33,18 @@ References
        19011-19016.
 """
 from __future__ import print_function, division, absolute_import
+import collections
+
 import numpy as np
 
-from mdtraj.utils.six.moves import xrange
+from . import _linalg
+from ._linalg import absorbing_solver, batch_absorbing_solve
 
-__all__ = ['committors', 'conditional_committors',
+__all__ = ['committors', 'conditional_committors', 'batch_committors',
            '_committors', '_conditional_committors']
 
 
-def committors(sources, sinks, msm):
+def committors(sources, sinks, msm, return_samples=False):
     """
     Get the forward committors of the reaction sources -> sinks.
 
@@ -53,11 +56,16 @@ def committors(sources, sinks, msm):
         The set of folded/product states.
     msm : msmbuilder.MarkovStateModel
         MSM fit to the data.
+    return_samples : bool, default=False
+        If ``msm`` is an ensemble of models with ``all_transmats_``, such as
+        a ``BayesianMarkovStateModel``, return the committors of every
+        sample instead of their median.
 
     Returns
     -------
     forward_committors : np.ndarray
-        The forward committors for the reaction sources -> sinks
+        The forward committors for the reaction sources -> sinks. With
+        ``return_samples``, the shape is (n_samples, n_states).
 
     References
     ----------
@@ -76,15 +84,15 @@ def committors(sources, sinks, msm):
     """
 
     if hasattr(msm, 'all_transmats_'):
-        commits = np.zeros(msm.all_transmats_.shape[:2])
-        for i, tprob in enumerate(msm.all_transmats_):
-            commits[i, :] = _committors(sources, sinks, tprob)
+        commits = _ensemble_committors(sources, sinks, msm.all_transmats_)
+        if return_samples:
+            return commits
         return np.median(commits, axis=0)
 
     return _committors(sources, sinks, msm.transmat_)
 
 
-def conditional_committors(source, sink, waypoint, msm):
+def conditional_committors(source, sink, waypoint, msm, return_samples=False):
     """
     Computes the conditional committors :math:`q^{ABC^+}` which are is the
     probability of starting in one state and visiting state B before A while
@@ -103,12 +111,17 @@ def conditional_committors(source, sink, waypoint, msm):
         The index of the sink state
     msm : msmbuilder.MarkovStateModel
         MSM to analyze.
+    return_samples : bool, default=False
+        If ``msm`` is an ensemble of models with ``all_transmats_``, such as
+        a ``BayesianMarkovStateModel``, return the conditional committors of
+        every sample instead of their median.
 
     Returns
     -------
     cond_committors : np.ndarray
         Conditional committors, i.e. the probability of visiting
-        a waypoint when on a path between source and sink.
+        a waypoint when on a path between source and sink. With
+        ``return_samples``, the shape is (n_samples, n_states).
 
     See Also
     --------
@@ -121,8 +134,9 @@ def conditional_committors(source, sink, waypoint, msm):
 
     Notes
     -----
-    Employs dense linear algebra, memory use scales as N^2,
-    and cycle use scales as N^3
+    Dense transition matrices use dense linear algebra, so memory use
+    scales as N^2 and cycle use scales as N^3. Sparse transition matrices
+    use a sparse LU factorization.
 
     References
     ----------
@@ -138,15 +152,59 @@ def conditional_committors(source, sink, waypoint, msm):
         raise ValueError('source, sink, waypoint must all be disjoint!')
 
     if hasattr(msm, 'all_transmats_'):
-        cond_committors = np.zeros(msm.all_transmats_.shape[:2])
-        for i, tprob in enumerate(msm.all_transmats_):
-            cond_committors[i, :] = _conditional_committors(source, sink,
-                                                            waypoint, tprob)
+        cond_committors = _ensemble_conditional_committors(
+            source, sink, waypoint, msm.all_transmats_)
+        if return_samples:
+            return cond_committors
         return np.median(cond_committors, axis=0)
 
     return _conditional_committors(source, sink, waypoint, msm.transmat_)
 
 
+def batch_committors(reactions, msm, return_samples=False):
+    """
+    Get the forward committors of many reactions at once.
+
+    The reactions are grouped by their sinks. The absorbing-chain system of
+    each set of sinks is factored only once, and the sources of each
+    reaction are imposed on it with a low-rank (Woodbury) correction.
+
+    Parameters
+    ----------
+    reactions : list of (sources, sinks)
+        The reactions, each a pair of array_like, int with its set of
+        unfolded/reactant states and its set of folded/product states.
+    msm : msmbuilder.MarkovStateModel
+        MSM fit to the data.
+    return_samples : bool, default=False
+        If ``msm`` is an ensemble of models with ``all_transmats_``, such as
+        a ``BayesianMarkovStateModel``, return the committors of every
+        sample instead of their median.
+
+    Returns
+    -------
+    forward_committors : np.ndarray, shape=(n_reactions, n_states)
+        forward_committors[i] are the forward committors of reactions[i].
+        With ``return_samples``, the shape is
+        (n_samples, n_reactions, n_states).
+
+    See Also
+    --------
+    msmbuilder.tpt.committors : function
+        The forward committors of one reaction.
+    """
+
+    if hasattr(msm, 'all_transmats_'):
+        commits = np.swapaxes([_ensemble_committors(sources, sinks,
+                                                    msm.all_transmats_)
+                               for sources, sinks in reactions], 0, 1)
+        if return_samples:
+            return commits
+        return np.median(commits, axis=0)
+
+    return _batch_committors(reactions, msm.transmat_)
+
+
 def _conditional_committors(source, sink, waypoint, tprob):
     """
     Computes the conditional committors :math:`q^{ABC^+}` which are is the
@@ -164,7 +222,7 @@ def _conditional_committors(source, sink, waypoint, tprob):
         The index of the source state
     sink : int
         The index of the sink state
-    tprob : np.ndarray
+    tprob : np.ndarray or scipy.sparse matrix
         Transition matrix
 
     Returns
@@ -175,8 +233,9 @@ def _conditional_committors(source, sink, waypoint, tprob):
 
     Notes
     -----
-    Employs dense linear algebra, memory use scales as N^2,
-    and cycle use scales as N^3
+    Dense transition matrices use dense linear algebra, so memory use
+    scales as N^2 and cycle use scales as N^3. Sparse transition matrices
+    use a sparse LU factorization.
 
     References
     ----------
@@ -187,30 +246,19 @@ def _conditional_committors(source, sink, waypoint, tprob):
 
     forward_committors = _committors([source], [sink], tprob)
 
-    # permute the transition matrix into cannonical form - send waypoint the the
-    # last row, and source + sink to the end after that
-    Bsink_indices = [source, sink, waypoint]
-    perm = np.array([i for i in xrange(n_states) if i not in Bsink_indices],
-                    dtype=int)
-    perm = np.concatenate([perm, Bsink_indices])
-    permuted_tprob = tprob[perm, :][:, perm]
-
-    # extract P, R
-    n = n_states - len(Bsink_indices)
-    P = permuted_tprob[:n, :n]
-    R = permuted_tprob[:n, n:]
-
-    # calculate the conditional committors ( B = N*R ), B[i,j] is the prob
-    # state i ends in j, where j runs over the source + sink + waypoint
-    # (waypoint is position -1)
-    B = np.dot(np.linalg.inv(np.eye(n) - P), R)
-
-    # add probs for the sinks, waypoint / b[i] is P( i --> {C & not A, B} )
-    b = np.append(B[:, -1].flatten(), [0.0] * (len(Bsink_indices) - 1) + [1.0])
-    cond_committors = b * forward_committors[waypoint]
+    # make the source, sink and waypoint absorbing. b[i] is then the
+    # probability that state i is absorbed at the waypoint, i.e. that it
+    # visits the waypoint before the source or the sink
+    interior, solve = absorbing_solver(tprob, [source, sink, waypoint])
+
+    ident_waypoint = np.zeros(n_states)
+    ident_waypoint[waypoint] = 1.0
 
-    # get the original order
-    cond_committors = cond_committors[np.argsort(perm)]
+    b = np.zeros(n_states)
+    b[waypoint] = 1.0
+    b[interior] = solve(tprob.dot(ident_waypoint)[interior])
+
+    cond_committors = b * forward_committors[waypoint]
 
     return cond_committors
 
@@ -225,7 +273,7 @@ def _committors(sources, sinks, tprob):
         The set of unfolded/reactant states.
     sinks : array_like, int
         The set of folded/product states.
-    tprob : np.ndarray
+    tprob : np.ndarray or scipy.sparse matrix
         Transition matrix
 
     Returns
@@ -250,29 +298,169 @@ def _committors(sources, sinks, tprob):
     """
     n_states = np.shape(tprob)[0]
 
-    sources = np.array(sources, dtype=int).reshape((-1, 1))
-    sinks = np.array(sinks, dtype=int).reshape((-1, 1))
+    sources = np.array(sources, dtype=int).reshape((-1,))
+    sinks = np.array(sinks, dtype=int).reshape((-1,))
+
+    # construct the committor problem, with the sources and sinks absorbing
+    interior, solve = absorbing_solver(tprob, np.concatenate([sources, sinks]))
+
+    ident_sinks = np.zeros(n_states)
+    ident_sinks[sinks] = 1.0
+
+    forward_committors = ident_sinks.copy()
+    forward_committors[interior] = solve(tprob.dot(ident_sinks)[interior])
+
+    return forward_committors
+
 
-    # construct the committor problem
-    lhs = np.eye(n_states) - tprob
+def _batch_committors(reactions, tprob):
+    """
+    Get the forward committors of many reactions at once.
 
-    for a in sources:
-        lhs[a, :] = 0.0  # np.zeros(n)
-        lhs[:, a] = 0.0
-        lhs[a, a] = 1.0
+    Parameters
+    ----------
+    reactions : list of (sources, sinks)
+        The reactions, each a pair of array_like, int with its set of
+        unfolded/reactant states and its set of folded/product states.
+    tprob : np.ndarray or scipy.sparse matrix
+        Transition matrix
 
-    for b in sinks:
-        lhs[b, :] = 0.0  # np.zeros(n)
-        lhs[:, b] = 0.0
-        lhs[b, b] = 1.0
+    Returns
+    -------
+    forward_committors : np.ndarray, shape=(n_reactions, n_states)
+        The forward committors of each reaction.
+
+    Notes
+    -----
+    For each set of sinks B, M = (I - P) restricted to the states that are
+    not in B is factored once. The committors with only B absorbing solve
+    M x0 = P 1_B. Making the sources A absorbing as well removes their rows
+    and columns from M, which is a rank |A| change. With the columns
+    G = M^-1 E_A of M^-1 for the source states, the committors are
+
+        q = x0 - G (E_A^T G)^-1 (E_A^T x0)
+
+    which vanishes on A and solves the reduced system on the other states.
+    G is computed for all of the sources of the reactions that share B at
+    once, in the same solve as x0.
+    """
+    n_states = np.shape(tprob)[0]
+
+    groups = collections.OrderedDict()
+    for i, (sources, sinks) in enumerate(reactions):
+        sources = np.unique(np.array(sources, dtype=int).reshape((-1,)))
+        sinks = np.unique(np.array(sinks, dtype=int).reshape((-1,)))
+        groups.setdefault(sinks.tobytes(), (sinks, []))[1].append((i, sources))
+
+    forward_committors = np.zeros((len(reactions), n_states))
+    for sinks, members in groups.values():
+        interior, solve = absorbing_solver(tprob, sinks)
+        position = np.zeros(n_states, dtype=int)
+        position[interior] = np.arange(len(interior))
+
+        ident_sinks = np.zeros(n_states)
+        ident_sinks[sinks] = 1.0
+
+        members = [(i, np.setdiff1d(sources, sinks)) for i, sources in members]
+        corrections = np.unique(np.concatenate(
+            [sources for _, sources in members]))
+        if len(corrections) * len(interior) * 8 > _linalg.BATCH_BYTES:
+            # too many source states to keep their columns of M^-1
+            for i, sources in members:
+                forward_committors[i] = _committors(sources, sinks, tprob)
+            continue
+
+        rhs = np.zeros((len(interior), len(corrections) + 1))
+        rhs[:, 0] = tprob.dot(ident_sinks)[interior]
+        rhs[position[corrections], np.arange(1, len(corrections) + 1)] = 1.0
+        x = solve(rhs)
+        x0, green = x[:, 0], x[:, 1:]
+
+        for i, sources in members:
+            commits = x0.copy()
+            if len(sources) > 0:
+                rows = position[sources]
+                cols = np.searchsorted(corrections, sources)
+                capacitance = green[rows][:, cols]
+                commits -= green[:, cols].dot(
+                    np.linalg.solve(capacitance, x0[rows]))
+                commits[rows] = 0.0
+            forward_committors[i] = ident_sinks
+            forward_committors[i, interior] = commits
+
+    return forward_committors
+
+
+def _ensemble_committors(sources, sinks, tprobs):
+    """
+    Get the forward committors of the reaction sources -> sinks for each of
+    an ensemble of transition matrices.
+
+    The systems of all of the transition matrices are stacked and solved at
+    once.
+
+    Parameters
+    ----------
+    sources : array_like, int
+        The set of unfolded/reactant states.
+    sinks : array_like, int
+        The set of folded/product states.
+    tprobs : np.ndarray, shape=(n_samples, n_states, n_states)
+        Transition matrices
+
+    Returns
+    -------
+    forward_committors : np.ndarray, shape=(n_samples, n_states)
+        The forward committors for the reaction sources -> sinks of each
+        transition matrix.
+    """
+    tprobs = np.asarray(tprobs)
+    n_states = tprobs.shape[1]
+
+    sources = np.array(sources, dtype=int).reshape((-1,))
+    sinks = np.array(sinks, dtype=int).reshape((-1,))
 
     ident_sinks = np.zeros(n_states)
     ident_sinks[sinks] = 1.0
 
-    rhs = np.dot(tprob, ident_sinks)
-    rhs[sources] = 0.0
-    rhs[sinks] = 1.0
+    return ident_sinks + batch_absorbing_solve(
+        tprobs, np.concatenate([sources, sinks]), tprobs.dot(ident_sinks))
 
-    forward_committors = np.linalg.solve(lhs, rhs)
 
-    return forward_committors
+def _ensemble_conditional_committors(source, sink, waypoint, tprobs):
+    """
+    Computes the conditional committors :math:`q^{ABC^+}` for each of an
+    ensemble of transition matrices.
+
+    The systems of all of the transition matrices are stacked and solved at
+    once.
+
+    Parameters
+    ----------
+    waypoint : int
+        The index of the intermediate state
+    source : int
+        The index of the source state
+    sink : int
+        The index of the sink state
+    tprobs : np.ndarray, shape=(n_samples, n_states, n_states)
+        Transition matrices
+
+    Returns
+    -------
+    cond_committors : np.ndarray, shape=(n_samples, n_states)
+        Conditional committors of each transition matrix.
+    """
+    tprobs = np.asarray(tprobs)
+    n_states = tprobs.shape[1]
+
+    forward_committors = _ensemble_committors([source], [sink], tprobs)
+
+    ident_waypoint = np.zeros(n_states)
+    ident_waypoint[waypoint] = 1.0
+
+    # the probability of visiting the waypoint before the source or sink
+    b = ident_waypoint + batch_absorbing_solve(
+        tprobs, [source, sink, waypoint], tprobs.dot(ident_waypoint))
+
+    return b * forward_committors[:, waypoint, np.newaxis]
@@ -31,13 +31,14 @@ References
 """
 from __future__ import print_function, division, absolute_import
 import numpy as np
+import scipy.sparse
 
-from .committor import _committors
+from .committor import _committors, _ensemble_committors
 
 __all__ = ['fluxes', 'net_fluxes']
 
 
-def fluxes(sources, sinks, msm, for_committors=None):
+def fluxes(sources, sinks, msm, for_committors=None, return_samples=False):
     """
     Compute the transition path theory flux matrix.
 
@@ -53,11 +54,16 @@ def fluxes(sources, sinks, msm, for_committors=None):
         The forward committors associated with `sources`, `sinks`, and `tprob`.
         If not provided, is calculated from scratch. If provided, `sources`
         and `sinks` are ignored.
+    return_samples : bool, default=False
+        If ``msm`` is an ensemble of models with ``all_transmats_``, such as
+        a ``BayesianMarkovStateModel``, return the flux matrix of every
+        sample instead of their median.
 
     Returns
     -------
-    flux_matrix : np.ndarray
-        The flux matrix
+    flux_matrix : np.ndarray or scipy.sparse.csr_matrix
+        The flux matrix, sparse if ``msm.transmat_`` is sparse. With
+        ``return_samples``, the shape is (n_samples, n_states, n_states).
 
     See Also
     --------
@@ -80,20 +86,18 @@ def fluxes(sources, sinks, msm, for_committors=None):
     """
 
     if hasattr(msm, 'all_transmats_'):
-        fluxes = np.zeros_like(msm.all_transmats_)
-
-        for i, el in enumerate(zip(msm.all_transmats_, msm.all_populations_)):
-            tprob = el[0]
-            populations = el[1]
-            fluxes[i, :, :] = _fluxes(sources, sinks, tprob,
-                                      populations, for_committors)
+        fluxes = _ensemble_fluxes(sources, sinks, msm.all_transmats_,
+                                  msm.all_populations_, for_committors)
+        if return_samples:
+            return fluxes
         return np.median(fluxes, axis=0)
 
     return _fluxes(sources, sinks, msm.transmat_, msm.populations_,
                    for_committors)
 
 
-def net_fluxes(sources, sinks, msm, for_committors=None):
+def net_fluxes(sources, sinks, msm, for_committors=None,
+               return_samples=False):
     """
     Computes the transition path theory net flux matrix.
 
@@ -109,11 +113,16 @@ def net_fluxes(sources, sinks, msm, for_committors=None):
         The forward committors associated with `sources`, `sinks`, and `tprob`.
         If not provided, is calculated from scratch. If provided, `sources`
         and `sinks` are ignored.
+    return_samples : bool, default=False
+        If ``msm`` is an ensemble of models with ``all_transmats_``, such as
+        a ``BayesianMarkovStateModel``, return the net flux matrix of every
+        sample instead of the net flux of their median flux matrix.
 
     Returns
     -------
-    net_flux : np.ndarray
-        The net flux matrix
+    net_flux : np.ndarray or scipy.sparse.csr_matrix
+        The net flux matrix, sparse if ``msm.transmat_`` is sparse. With
+        ``return_samples``, the shape is (n_samples, n_states, n_states).
 
     See Also
     --------
@@ -135,9 +144,34 @@ def net_fluxes(sources, sinks, msm, for_committors=None):
            19011-19016.
     """
 
-    flux_matrix = fluxes(sources, sinks, msm, for_committors=for_committors)
+    flux_matrix = fluxes(sources, sinks, msm, for_committors=for_committors,
+                         return_samples=return_samples)
+
+    return _net_fluxes(flux_matrix)
+
+
+def _net_fluxes(flux_matrix):
+    """
+    Compute the net flux matrix from a flux matrix, or a stack of them.
+
+    Parameters
+    ----------
+    flux_matrix : np.ndarray or scipy.sparse matrix
+        The flux matrix, or an array of flux matrices of shape
+        (n_samples, n_states, n_states).
 
-    net_flux = flux_matrix - flux_matrix.T
+    Returns
+    -------
+    net_flux : np.ndarray or scipy.sparse.csr_matrix
+        The net flux matrix, sparse if ``flux_matrix`` is sparse.
+    """
+    if scipy.sparse.issparse(flux_matrix):
+        net_flux = scipy.sparse.csr_matrix(flux_matrix - flux_matrix.T)
+        net_flux.data[net_flux.data < 0] = 0.0
+        net_flux.eliminate_zeros()
+        return net_flux
+
+    net_flux = flux_matrix - np.swapaxes(flux_matrix, -1, -2)
     net_flux[np.where(net_flux < 0)] = 0.0
 
     return net_flux
@@ -153,7 +187,7 @@ def _fluxes(sources, sinks, tprob, populations, for_committors=None):
         The set of unfolded/reactant states.
     sinks : array_like, int
         The set of folded/product states.
-    tprob : np.ndarray
+    tprob : np.ndarray or scipy.sparse matrix
         Transition matrix
     populations : np.ndarray, (n_states,)
         MSM populations
@@ -164,8 +198,8 @@ def _fluxes(sources, sinks, tprob, populations, for_committors=None):
 
     Returns
     -------
-    flux_matrix : np.ndarray
-        The flux matrix
+    flux_matrix : np.ndarray or scipy.sparse.csr_matrix
+        The flux matrix, sparse if ``tprob`` is sparse.
 
     See Also
     --------
@@ -197,17 +231,64 @@ def _fluxes(sources, sinks, tprob, populations, for_committors=None):
             raise ValueError("Shape of committors %s should be %s" %
                              (str(for_committors.shape), str((n_states,))))
 
-    sources = np.array(sources).reshape((-1,))
-    sinks = np.array(sinks).reshape((-1,))
+    if scipy.sparse.issparse(tprob):
+        fluxes = scipy.sparse.diags(populations * (1.0 - for_committors)).dot(
+            tprob).dot(scipy.sparse.diags(for_committors))
+        fluxes = scipy.sparse.csr_matrix(
+            fluxes - scipy.sparse.diags(fluxes.diagonal()))
+        fluxes.eliminate_zeros()
+        return fluxes
 
-    X = np.zeros((n_states, n_states))
-    X[(np.arange(n_states), np.arange(n_states))] = (populations *
-                                                     (1.0 - for_committors))
+    fluxes = ((populations * (1.0 - for_committors))[:, np.newaxis] *
+              np.asarray(tprob) * for_committors)
+    fluxes[(np.arange(n_states), np.arange(n_states))] = np.zeros(n_states)
 
-    Y = np.zeros((n_states, n_states))
-    Y[(np.arange(n_states), np.arange(n_states))] = for_committors
+    return fluxes
 
-    fluxes = np.dot(np.dot(X, tprob), Y)
-    fluxes[(np.arange(n_states), np.arange(n_states))] = np.zeros(n_states)
+
+def _ensemble_fluxes(sources, sinks, tprobs, all_populations,
+                     for_committors=None):
+    """
+    Compute the transition path theory flux matrix for each of an ensemble
+    of transition matrices, all at once.
+
+    Parameters
+    ----------
+    sources : array_like, int
+        The set of unfolded/reactant states.
+    sinks : array_like, int
+        The set of folded/product states.
+    tprobs : np.ndarray, shape=(n_samples, n_states, n_states)
+        Transition matrices
+    all_populations : np.ndarray, shape=(n_samples, n_states)
+        Populations of each MSM
+    for_committors : np.ndarray, optional
+        The forward committors associated with `sources`, `sinks`, and
+        `tprobs`, shared by all of the transition matrices. If not provided,
+        they are calculated for each transition matrix. If provided,
+        `sources` and `sinks` are ignored.
+
+    Returns
+    -------
+    flux_matrices : np.ndarray, shape=(n_samples, n_states, n_states)
+        The flux matrix of each transition matrix.
+    """
+    tprobs = np.asarray(tprobs)
+    n_states = tprobs.shape[1]
+
+    # check if we got the committors
+    if for_committors is None:
+        for_committors = _ensemble_committors(sources, sinks, tprobs)
+    else:
+        for_committors = np.array(for_committors)
+        if for_committors.shape != (n_states,):
+            raise ValueError("Shape of committors %s should be %s" %
+                             (str(for_committors.shape), str((n_states,))))
+        for_committors = np.tile(for_committors, (len(tprobs), 1))
+
+    fluxes = ((np.asarray(all_populations) *
+               (1.0 - for_committors))[:, :, np.newaxis] * tprobs *
+              for_committors[:, np.newaxis, :])
+    fluxes[:, np.arange(n_states), np.arange(n_states)] = 0.0
 
     return fluxes
@@ -15,16 +15,18 @@ References
 """
 from __future__ import print_function, division, absolute_import
 import numpy as np
+import scipy.linalg
 
 from . import committors, conditional_committors
+from .committor import (_ensemble_committors,
+                        _ensemble_conditional_committors)
 
 from mdtraj.utils.six.moves import xrange
-import itertools
 
 __all__ = ['fraction_visited', 'hub_scores']
 
 
-def fraction_visited(source, sink, waypoint, msm):
+def fraction_visited(source, sink, waypoint, msm, return_samples=False):
     """
     Calculate the fraction of times a walker on `tprob` going from `sources`
     to `sinks` will travel through the set of states `waypoints` en route.
@@ -47,12 +49,17 @@ def fraction_visited(source, sink, waypoint, msm):
         The index of the intermediate state
     msm : msmbuilder.MarkovStateModel
         MSM to analyze.
+    return_samples : bool, default=False
+        If ``msm`` is an ensemble of models with ``all_transmats_``, such as
+        a ``BayesianMarkovStateModel``, return the fraction of every sample
+        instead of their median.
 
     Returns
     -------
     fraction_visited : float
         The fraction of times a walker going from `sources` -> `sinks` stops
-        by `waypoints` on its way.
+        by `waypoints` on its way. With ``return_samples``, an array of shape
+        (n_samples,).
 
     See Also
     --------
@@ -68,17 +75,21 @@ def fraction_visited(source, sink, waypoint, msm):
     .. [1] Dickson & Brooks (2012), J. Chem. Theory Comput., 8, 3044-3052.
     """
 
-    for_committors = committors([source], [sink], msm)
-    cond_committors = conditional_committors(source, sink, waypoint, msm)
-
     if hasattr(msm, 'all_transmats_'):
-        frac_visited = np.zeros((msm.n_states,))
-        for i, tprob in enumerate(msm.all_transmats_):
-            frac_visited[i] = _fraction_visited(source, sink, waypoint,
-                                                msm.transmat_, for_committors,
-                                                cond_committors)
+        tprobs = np.asarray(msm.all_transmats_)
+        for_committors = _ensemble_committors([source], [sink], tprobs)
+        cond_committors = _ensemble_conditional_committors(source, sink,
+                                                           waypoint, tprobs)
+        from_source = tprobs[:, source, :]
+        frac_visited = (np.sum(from_source * cond_committors, axis=1) /
+                        np.sum(from_source * for_committors, axis=1))
+        if return_samples:
+            return frac_visited
         return np.median(frac_visited, axis=0)
 
+    for_committors = committors([source], [sink], msm)
+    cond_committors = conditional_committors(source, sink, waypoint, msm)
+
     return _fraction_visited(source, sink, waypoint, msm.transmat_,
                              for_committors, cond_committors)
 
@@ -106,6 +117,13 @@ def hub_scores(msm, waypoints=None):
     hub_score : float
         The hub score for the waypoint
 
+    Notes
+    -----
+    The fraction of visits for every (source, sink, waypoint) triple is
+    computed in closed form from the fundamental matrix of the MSM, which is
+    factored once. The cost is O(N^3) for all the waypoints, instead of
+    two dense linear solves per triple.
+
     References
     ----------
     .. [1] Dickson & Brooks (2012), J. Chem. Theory Comput., 8, 3044-3052.
@@ -120,20 +138,91 @@ def hub_scores(msm, waypoints=None):
               isinstance(waypoints, np.ndarray)):
         raise ValueError("waypoints (%s) must be an int, a list, or None" %
                          str(waypoints))
+    waypoints = np.array(waypoints, dtype=int).reshape(-1)
 
-    hub_scores = []
-    for waypoint in waypoints:
-        other_states = (i for i in xrange(n_states) if i != waypoint)
+    if hasattr(msm, 'all_transmats_'):
+        transmats = msm.all_transmats_
+    else:
+        transmats = [msm.transmat_]
+    fundamental = [_fundamental_matrix(tprob) for tprob in transmats]
+
+    hub_scores = np.zeros(len(waypoints))
+    for sink in xrange(n_states):
+        fractions = [_fractions_visited(sink, waypoints, *model)
+                     for model in fundamental]
+        # like fraction_visited, take the median over the models for each
+        # (source, sink, waypoint) triple
+        fractions = (fractions[0] if len(fractions) == 1
+                     else np.median(fractions, axis=0))
+        hub_scores += np.nansum(fractions, axis=0)
+
+    hub_scores /= float((n_states - 1) * (n_states - 2))
+    return hub_scores
+
+
+def _fundamental_matrix(tprob):
+    """
+    The fundamental matrix Z = (I - T + 1 pi^T)^-1 of an ergodic MSM, and
+    its stationary distribution pi.
+    """
+    n_states = np.shape(tprob)[0]
+    # pi (I - T + 1 1^T) = 1^T determines the stationary distribution
+    ones = np.ones((n_states, n_states))
+    populations = scipy.linalg.solve((np.eye(n_states) - tprob + ones).T,
+                                     np.ones(n_states))
+    limiting_matrix = np.vstack([populations] * n_states)
+    fund_matrix = scipy.linalg.inv(np.eye(n_states) - tprob + limiting_matrix)
+    return fund_matrix, populations
+
+
+def _fractions_visited(sink, waypoints, fund_matrix, populations):
+    """
+    Fraction of the paths from every source to `sink` that visit each of
+    `waypoints` on the way.
+
+    With G the Green's function of the chain absorbed at the sink (the
+    expected number of visits to j before absorption, starting from i),
 
-        # calculate the hub score for this waypoint
-        hub_score = 0.0
-        for (source, sink) in itertools.permutations(other_states, 2):
-            hub_score += fraction_visited(source, sink, waypoint, msm)
+        h_c(a, b) = G[a, c] (G[a, a] - G[c, a]) / (G[a, a] G[c, c] - G[a, c] G[c, a]),
 
-        hub_score /= float((n_states - 1) * (n_states - 2))
-        hub_scores.append(hub_score)
+    which follows from the committors and conditional committors written in
+    terms of G, after removing the source from G by a rank-one update. G
+    itself is a rank-one update of the fundamental matrix Z,
 
-    return np.array(hub_scores)
+        G[i, j] = Z[i, j] - Z[b, j] + pi[j] (Z[b, b] - Z[i, b]) / pi[b].
+
+    Returns
+    -------
+    fractions : np.ndarray, shape=(n_states, len(waypoints))
+        fractions[a, k] is the fraction of visits to waypoints[k] from
+        source a. It is nan where the source, sink and waypoint are not
+        distinct.
+    """
+    Z = fund_matrix
+    b = sink
+
+    def green(rows, cols):
+        return (Z[np.ix_(rows, cols)] - Z[b, cols] +
+                np.outer(Z[b, b] - Z[rows, b], populations[cols]) /
+                populations[b])
+
+    states = np.arange(len(Z))
+    G_source_waypoint = green(states, waypoints)
+    G_waypoint_source = green(waypoints, states).T
+    diagonal = (np.diag(Z) - Z[b] +
+                populations * (Z[b, b] - Z[:, b]) / populations[b])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fractions = (G_source_waypoint *
+                     (diagonal[:, np.newaxis] - G_waypoint_source) /
+                     (np.outer(diagonal, diagonal[waypoints]) -
+                      G_source_waypoint * G_waypoint_source))
+    # these are probabilities, up to round-off
+    np.clip(fractions, 0, 1, out=fractions)
+    fractions[b, :] = np.nan
+    fractions[:, waypoints == b] = np.nan
+    fractions[waypoints, np.arange(len(waypoints))] = np.nan
+    return fractions
 
 
 def _fraction_visited(source, sink, waypoint, tprob, for_committors,
@@ -186,7 +275,7 @@ def _fraction_visited(source, sink, waypoint, tprob, for_committors,
     .. [1] Dickson & Brooks (2012), J. Chem. Theory Comput., 8, 3044-3052.
     """
 
-    fraction_visited = (np.float(tprob[source, :].dot(cond_committors)) /
-                        np.float(tprob[source, :].dot(for_committors)))
+    fraction_visited = (float(tprob[source, :].dot(cond_committors)) /
+                        float(tprob[source, :].dot(for_committors)))
 
     return fraction_visited
@@ -20,13 +20,17 @@ note that we are using ergodic Markov Chains.
 from __future__ import print_function, division, absolute_import
 import numpy as np
 import scipy
-from mdtraj.utils.six.moves import xrange
-import copy
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
 
-__all__ = ['mfpts']
+from . import _linalg
+from ._linalg import absorbing_solver, batch_absorbing_solve
 
+__all__ = ['mfpts', 'all_pairs_mfpts']
 
-def mfpts(msm, sinks=None, lag_time=1.):
+
+def mfpts(msm, sinks=None, lag_time=1., return_samples=False):
     """
     Gets the Mean First Passage Time (MFPT) for all states to a *set*
     of sinks.
@@ -48,6 +52,10 @@ def mfpts(msm, sinks=None, lag_time=1.):
         Lag time for the model. The MFPT will be reported in whatever
         units are given here. Default is (1) which is in units of the
         lag time of the MSM.
+    return_samples : bool, default=False
+        If ``msm`` is an ensemble of models with ``all_transmats_``, such as
+        a ``BayesianMarkovStateModel``, return the MFPTs of every sample
+        instead of their median.
 
     Returns
     -------
@@ -63,6 +71,15 @@ def mfpts(msm, sinks=None, lag_time=1.):
             is (n_states,). Where mfpts[i] is the mean first passage
             time from state i to any state in sinks.
 
+        With ``return_samples``, there is an extra first axis over the
+        samples.
+
+    See Also
+    --------
+    msmbuilder.tpt.all_pairs_mfpts : function
+        The MFPTs between all pairs of states, with blocked and approximate
+        methods for large MSMs.
+
     References
     ----------
     .. [1] Grinstead, C. M. and Snell, J. L. Introduction to
@@ -73,16 +90,99 @@ def mfpts(msm, sinks=None, lag_time=1.):
     """
 
     if hasattr(msm, 'all_transmats_'):
-        mfpts = np.zeros_like(msm.all_transmats_)
+        mfpts = _ensemble_mfpts(msm.all_transmats_, msm.all_populations_,
+                                sinks, lag_time)
+        if return_samples:
+            return mfpts
+        return np.median(mfpts, axis=0)
+
+    return _mfpts(msm.transmat_, msm.populations_, sinks, lag_time)
 
-        for i, el in enumerate(zip(msm.all_transmats_, msm.all_populations_)):
-            tprob = el[0]
-            populations = el[1]
-            mfpts[i, :, :] = _mfpts(tprob, populations, sinks, lag_time)
 
+def all_pairs_mfpts(msm, lag_time=1., method='auto', targets=None,
+                    n_components=10, return_samples=False):
+    """
+    Gets the Mean First Passage Times (MFPTs) between all pairs of states.
+
+    This is much cheaper than calling ``mfpts`` once for each sink: all of
+    the MFPTs follow from the fundamental matrix of the MSM, so only one
+    system has to be factored.
+
+    Parameters
+    ----------
+    msm : msmbuilder.MarkovStateModel
+        MSM fit to the data.
+    lag_time : float, optional
+        Lag time for the model. The MFPT will be reported in whatever
+        units are given here. Default is (1) which is in units of the
+        lag time of the MSM.
+    method : {'auto', 'dense', 'blocked', 'approximate'}
+        How to compute the MFPTs:
+            - 'dense' : Invert the fundamental matrix. This needs several
+                dense (n_states, n_states) arrays.
+            - 'blocked' : Factor the transition matrix with one absorbing
+                state once, and solve for the columns of the fundamental
+                matrix in blocks. Besides the result, this only needs the
+                factorization (which is sparse for a sparse transition
+                matrix) and (n_states, block) arrays, with blocks that fit
+                in ``msmbuilder.tpt._linalg.BATCH_BYTES``.
+            - 'approximate' : Use the ``n_components`` slowest relaxation
+                processes of a reversible MSM. The faster processes are
+                assumed to decay within one lag time, and only contribute
+                through the mean recurrence times 1 / populations[j]. The
+                error is of the order of the largest neglected eigenvalue.
+            - 'auto' [default] : 'dense' for dense transition matrices and
+                'blocked' for sparse ones.
+    targets : array_like, int, optional
+        Only compute the MFPTs into these states. With the 'blocked' and
+        'approximate' methods, memory then scales with
+        n_states * len(targets) instead of n_states ** 2.
+    n_components : int, default=10
+        Number of slow relaxation processes used by the 'approximate'
+        method.
+    return_samples : bool, default=False
+        If ``msm`` is an ensemble of models with ``all_transmats_``, such as
+        a ``BayesianMarkovStateModel``, return the MFPTs of every sample
+        instead of their median.
+
+    Returns
+    -------
+    mfpts : np.ndarray, float, shape=(n_states, n_targets)
+        mfpts[i, j] is the mean first passage time from state i to state
+        targets[j] (to state j if targets is None), in time units of
+        lag_time. With ``return_samples``, there is an extra first axis over
+        the samples.
+
+    See Also
+    --------
+    msmbuilder.tpt.mfpts : function
+        The MFPTs from every state into a set of sinks.
+
+    References
+    ----------
+    .. [1] Grinstead, C. M. and Snell, J. L. Introduction to
+           Probability. American Mathematical Soc., 1998.
+    """
+
+    if hasattr(msm, 'all_transmats_'):
+        if method in ('auto', 'dense'):
+            mfpts = _ensemble_mfpts(msm.all_transmats_, msm.all_populations_,
+                                    None, lag_time)
+            if targets is not None:
+                mfpts = mfpts[:, :, np.array(targets, dtype=int).reshape((-1,))]
+        else:
+            mfpts = np.array([
+                _all_pairs_mfpts(tprob, populations, lag_time, method=method,
+                                 targets=targets, n_components=n_components)
+                for tprob, populations in zip(msm.all_transmats_,
+                                              msm.all_populations_)])
+        if return_samples:
+            return mfpts
         return np.median(mfpts, axis=0)
 
-    return _mfpts(msm.transmat_, msm.populations_, sinks, lag_time)
+    return _all_pairs_mfpts(msm.transmat_, msm.populations_, lag_time,
+                            method=method, targets=targets,
+                            n_components=n_components)
 
 
 def _mfpts(tprob, populations, sinks, lag_time):
@@ -92,7 +192,7 @@ def _mfpts(tprob, populations, sinks, lag_time):
 
     Parameters
     ----------
-    tprob : np.ndarray
+    tprob : np.ndarray or scipy.sparse matrix
         Transition matrix
     populations : np.ndarray, (n_states,)
         MSM populations
@@ -137,19 +237,7 @@ def _mfpts(tprob, populations, sinks, lag_time):
 
     if sinks is None:
         # Use Thm 11.16 in [1]
-        limiting_matrix = np.vstack([populations] * n_states)
-
-        # Fundamental matrix
-        fund_matrix = scipy.linalg.inv(np.eye(n_states) - tprob +
-                                       limiting_matrix)
-
-        # mfpt[i,j] = (fund_matrix[j,j] - fund_matrix[i,j]) / populations[j]
-        mfpts = fund_matrix * -1
-        for j in xrange(n_states):
-            mfpts[:, j] += fund_matrix[j, j]
-            mfpts[:, j] /= populations[j]
-
-        mfpts *= lag_time
+        mfpts = _all_pairs_mfpts(tprob, populations, lag_time)
 
     else:
         # See section 11.5, and use Thm 11.5
@@ -160,20 +248,212 @@ def _mfpts(tprob, populations, sinks, lag_time):
         # 11.5 so that we also get the mfpts[sink] = 0.0
         sinks = np.array(sinks, dtype=int).reshape((-1,))
 
-        absorb_tprob = copy.copy(tprob)
+        interior, solve = absorbing_solver(tprob, sinks)
 
-        for state in sinks:
-            absorb_tprob[state, :] = 0.0
-            absorb_tprob[state, state] = 2.0
-            # note it has to be 2 because we subtract
-            # the identity below.
+        mfpts = np.zeros(n_states)
+        mfpts[interior] = lag_time * solve(np.ones(len(interior)))
 
-        lhs = np.eye(n_states) - absorb_tprob
+    return mfpts
 
-        rhs = np.ones(n_states)
-        for state in sinks:
-            rhs[state] = 0.0
 
-        mfpts = lag_time * np.linalg.solve(lhs, rhs)
+def _all_pairs_mfpts(tprob, populations, lag_time, method='auto',
+                     targets=None, n_components=10):
+    """
+    Gets the Mean First Passage Times (MFPTs) between all pairs of states.
 
+    Parameters
+    ----------
+    tprob : np.ndarray or scipy.sparse matrix
+        Transition matrix
+    populations : np.ndarray, (n_states,)
+        MSM populations
+    lag_time : float
+        Lag time for the model.
+    method : {'auto', 'dense', 'blocked', 'approximate'}
+        How to compute the MFPTs. See ``all_pairs_mfpts``.
+    targets : array_like, int, optional
+        Only compute the MFPTs into these states.
+    n_components : int, default=10
+        Number of slow relaxation processes used by the 'approximate'
+        method.
+
+    Returns
+    -------
+    mfpts : np.ndarray, float, shape=(n_states, n_targets)
+        mfpts[i, j] is the mean first passage time from state i to state
+        targets[j], in time units of lag_time.
+
+    Notes
+    -----
+    With the fundamental matrix Z = (I - T + 1 pi^T)^-1, Thm 11.16 in [1]
+    gives mfpt[i, j] = (Z[j, j] - Z[i, j]) / pi[j]. Any other solution of
+    (I - T) x = e_j - pi[j] 1 differs from Z[:, j] by a constant, which
+    cancels, so the 'blocked' method takes the solution with x[r] = 0 for
+    the most populated state r. This only needs the factorization of I - T
+    with state r absorbing.
+
+    For a reversible MSM with eigenvalues l_k and right eigenvectors r_k,
+    normalized to <r_k, r_k>_pi = 1, the spectral expansion of Z gives
+
+        mfpt[i, j] = (1 - delta_ij) / pi[j]
+                     + sum_{k > 1} l_k / (1 - l_k) r_k[j] (r_k[j] - r_k[i])
+
+    and the 'approximate' method truncates the sum to the ``n_components``
+    slowest processes.
+
+    References
+    ----------
+    .. [1] Grinstead, C. M. and Snell, J. L. Introduction to
+           Probability. American Mathematical Soc., 1998.
+    """
+    if method == 'auto':
+        method = 'blocked' if scipy.sparse.issparse(tprob) else 'dense'
+    if method not in ('dense', 'blocked', 'approximate'):
+        raise ValueError("method must be one of 'auto', 'dense', 'blocked', "
+                         "'approximate': %r" % method)
+
+    populations = np.asarray(populations, dtype=np.float64)
+    n_states = len(populations)
+    if targets is None:
+        targets = np.arange(n_states)
+    else:
+        targets = np.array(targets, dtype=int).reshape((-1,))
+
+    if method == 'dense':
+        if scipy.sparse.issparse(tprob):
+            tprob = tprob.toarray()
+        # Fundamental matrix
+        fund_matrix = np.negative(tprob)
+        fund_matrix += populations
+        fund_matrix[np.diag_indices(n_states)] += 1.0
+        fund_matrix = scipy.linalg.inv(fund_matrix, overwrite_a=True)
+
+        # mfpt[i,j] = (fund_matrix[j,j] - fund_matrix[i,j]) / populations[j]
+        mfpts = fund_matrix[:, targets]
+        mfpts *= -1
+        mfpts += fund_matrix[targets, targets]
+        mfpts /= populations[targets]
+
+    elif method == 'blocked':
+        reference = np.argmax(populations)
+        interior, solve = absorbing_solver(tprob, [reference])
+
+        mfpts = np.empty((n_states, len(targets)))
+        block_size = max(1, _linalg.BATCH_BYTES // (8 * n_states))
+        x = np.zeros((n_states, min(block_size, len(targets))))
+        for start in range(0, len(targets), block_size):
+            block = targets[start:start + block_size]
+            columns = np.arange(len(block))
+            rhs = np.zeros((n_states, len(block)))
+            rhs -= populations[block]
+            rhs[block, columns] += 1.0
+            x[interior, :len(block)] = solve(rhs[interior])
+            mfpts[:, start:start + len(block)] = (
+                (x[block, columns] - x[:, :len(block)]) / populations[block])
+
+    else:
+        eigvals, rv = _reversible_eigensystem(tprob, populations,
+                                              n_components + 1)
+        eigvals, rv = eigvals[1:], rv[:, 1:]
+        weights = eigvals / (1 - eigvals) * rv[targets]
+
+        mfpts = np.dot(-rv, weights.T)
+        mfpts += np.sum(weights * rv[targets], axis=1)
+        mfpts += 1 / populations[targets]
+        mfpts[targets, np.arange(len(targets))] = 0.0
+
+    mfpts *= lag_time
     return mfpts
+
+
+def _reversible_eigensystem(tprob, populations, k):
+    """
+    The k largest eigenvalues of a reversible transition matrix, and its
+    right eigenvectors normalized to <r_i, r_j>_pi = delta_ij.
+
+    These come from the symmetric matrix D^1/2 T D^-1/2, where D is the
+    diagonal matrix of the populations.
+    """
+    n_states = len(populations)
+    sqrt_pi = np.sqrt(populations)
+    if scipy.sparse.issparse(tprob):
+        tprob = scipy.sparse.csr_matrix(tprob)
+        flux = scipy.sparse.diags(populations).dot(tprob)
+        asymmetry = abs(flux - flux.T).max()
+        symmetric = (scipy.sparse.diags(sqrt_pi).dot(tprob)
+                     .dot(scipy.sparse.diags(1 / sqrt_pi)))
+    else:
+        tprob = np.asarray(tprob)
+        flux = populations[:, np.newaxis] * tprob
+        asymmetry = np.max(np.abs(flux - flux.T))
+        symmetric = sqrt_pi[:, np.newaxis] * tprob / sqrt_pi
+    if asymmetry > 1e-8 * abs(flux).max():
+        raise ValueError('The approximate method requires a reversible '
+                         'transition matrix, which satisfies detailed balance '
+                         'with its populations.')
+    symmetric = (symmetric + symmetric.T) / 2
+
+    k = min(k, n_states)
+    if k < n_states - 1:
+        eigvals, u = scipy.sparse.linalg.eigsh(symmetric, k=k, which='LA')
+    else:
+        if scipy.sparse.issparse(symmetric):
+            symmetric = symmetric.toarray()
+        eigvals, u = scipy.linalg.eigh(symmetric)
+    order = np.argsort(-eigvals)[:k]
+    return eigvals[order], u[:, order] / sqrt_pi[:, np.newaxis]
+
+
+def _ensemble_mfpts(tprobs, all_populations, sinks, lag_time):
+    """
+    Gets the Mean First Passage Time (MFPT) for all states to a *set*
+    of sinks, for each of an ensemble of transition matrices.
+
+    The systems of all of the transition matrices are stacked and solved at
+    once.
+
+    Parameters
+    ----------
+    tprobs : np.ndarray, shape=(n_samples, n_states, n_states)
+        Transition matrices
+    all_populations : np.ndarray, shape=(n_samples, n_states)
+        Populations of each MSM
+    sinks : array_like, int, optional
+        Indices of the sink states, or None for the MFPTs between all
+        pairs of states. See ``_mfpts``.
+    lag_time : float, optional
+        Lag time for the model.
+
+    Returns
+    -------
+    mfpts : np.ndarray, float
+        MFPT in time units of lag_time of each transition matrix, with
+        shape (n_samples, n_states, n_states) if sinks is None and
+        (n_samples, n_states) otherwise.
+    """
+    tprobs = np.asarray(tprobs, dtype=np.float64)
+    all_populations = np.asarray(all_populations, dtype=np.float64)
+    n_samples, n_states = tprobs.shape[:2]
+
+    if sinks is not None:
+        return lag_time * batch_absorbing_solve(
+            tprobs, sinks, np.ones((n_samples, n_states)))
+
+    # Use Thm 11.16 in [1] for each transition matrix
+    mfpts = np.empty_like(tprobs)
+    diagonal = np.arange(n_states)
+    batch_size = max(1, _linalg.BATCH_BYTES // (8 * n_states ** 2))
+    for start in range(0, n_samples, batch_size):
+        batch = slice(start, start + batch_size)
+        populations = all_populations[batch, np.newaxis, :]
+
+        # Fundamental matrices
+        fund_matrix = populations - tprobs[batch]
+        fund_matrix[:, diagonal, diagonal] += 1.0
+        fund_matrix = np.linalg.inv(fund_matrix)
+
+        # mfpt[i,j] = (fund_matrix[j,j] - fund_matrix[i,j]) / populations[j]
+        mfpts[batch] = ((fund_matrix[:, diagonal, diagonal][:, np.newaxis, :]
+                         - fund_matrix) / populations)
+
+    return lag_time * mfpts
@@ -35,8 +35,10 @@ References
        19011-19016.
 """
 from __future__ import print_function, division, absolute_import
+import heapq
+
 import numpy as np
-import copy
+import scipy.sparse
 
 __all__ = ['paths', 'top_path']
 
@@ -52,7 +54,7 @@ def top_path(sources, sinks, net_flux):
         One-dimensional list of nodes to define the source states.
     sinks : array_like, int
         One-dimensional list of nodes to define the sink states.
-    net_flux : np.ndarray, shape = [n_states, n_states]
+    net_flux : np.ndarray or scipy.sparse matrix, shape = [n_states, n_states]
         Net flux of the MSM
 
     Returns
@@ -86,76 +88,127 @@ def top_path(sources, sinks, net_flux):
            pathways from short off-equilibrium simulations." PNAS 106.45 (2009):
            19011-19016.
     """
-    sources = np.array(sources, dtype=np.int).reshape((-1,))
-    sinks = np.array(sinks, dtype=np.int).reshape((-1,))
-
-    n_states = net_flux.shape[0]
-
-    queue = list(sources)
-    # nodes to check (the "queue")
-    # going to use list.pop method so I can't keep it as an array
-
-    visited = np.zeros(n_states).astype(np.bool)
-    # have we already checked this node?
-
-    previous_node = np.ones(n_states).astype(np.int) * -1
-    # what node was found before finding this one
-
-    min_fluxes = np.ones(n_states) * -1 * np.inf
-    # what is the flux of the highest flux path
-    # from this node to the source set.
-
-    min_fluxes[sources] = np.inf
-    # source states are connected to the source
-    # so this distance is zero which means the flux is infinite
-
-    while len(queue) > 0: # iterate until there's nothing to check anymore
-
-        test_node = queue.pop(min_fluxes[queue].argmax())
-        # find the node in the queue that has the
-        # highest flux path to it from the source set
-
-        visited[test_node] = True
-
-        if np.all(visited[sinks]):
-            # if we've visited all of the sink states, then we just have to choose
-            # the path that goes to the sink state that is closest to the source
-            break
+    sources = np.array(sources, dtype=int).reshape((-1,))
+    sinks = np.array(sinks, dtype=int).reshape((-1,))
 
-        # if test_node in sinks: # I *think* we want to break ... or are there paths we still
-        # need to check?
-        # continue
-        # I think if sinks is more than one state we have to check everything
+    return _WidestPaths(sources, net_flux).top_path(sinks)
 
-        # now update the distances for each neighbor of the test_node:
-        neighbors = np.where(net_flux[test_node, :] > 0)[0]
-        if len(neighbors) == 0:
-            continue
 
-        new_fluxes = net_flux[test_node, neighbors].flatten()
-        # flux from test_node to each neighbor
-
-        new_fluxes[np.where(new_fluxes > min_fluxes[test_node])] = min_fluxes[test_node]
-        # previous step to get to test_node was lower flux, so that is still the path flux
-
-        ind = np.where((1 - visited[neighbors]) & (new_fluxes > min_fluxes[neighbors]))
-        min_fluxes[neighbors[ind]] = new_fluxes[ind]
-
-        previous_node[neighbors[ind]] = test_node
-        # each of these neighbors came from this test_node
-        # we don't want to update the nodes that have already been visited
-
-        queue.extend(neighbors[ind])
+class _WidestPaths(object):
+    """
+    The highest flux (widest) paths from a set of sources through a net flux
+    network.
 
-    top_path = []
-    # populate the path in reverse
-    top_path.append(int(sinks[min_fluxes[sinks].argmax()]))
-    # find the closest sink state
+    This is Dijkstra's algorithm with a binary heap, where the length of a
+    path is the minimum flux over its edges, on the CSR representation of
+    the net flux matrix. The search is lazy: ``top_path`` only settles
+    states until the paths to all of the sinks are known.
 
-    while previous_node[top_path[-1]] != -1:
-        top_path.append(previous_node[top_path[-1]])
+    Parameters
+    ----------
+    sources : np.ndarray, int
+        The source states.
+    net_flux : np.ndarray or scipy.sparse matrix
+        Net flux of the MSM
+    """
 
-    return np.array(top_path[::-1]), min_fluxes[top_path[0]]
+    def __init__(self, sources, net_flux):
+        self.sources = sources
+        self.n_states = net_flux.shape[0]
+
+        # only the edges with positive flux are part of the network
+        net_flux = scipy.sparse.csr_matrix(net_flux, dtype=np.float64,
+                                           copy=True)
+        net_flux.data[net_flux.data < 0] = 0.0
+        net_flux.eliminate_zeros()
+        net_flux.sum_duplicates()
+
+        # the search loop is faster on lists than on arrays
+        self._indptr = net_flux.indptr.tolist()
+        self._indices = net_flux.indices.tolist()
+        self._data = net_flux.data.tolist()
+
+        min_fluxes = np.ones(self.n_states) * -1 * np.inf
+        # what is the flux of the highest flux path
+        # from this node to the source set.
+
+        min_fluxes[self.sources] = np.inf
+        # source states are connected to the source
+        # so this distance is zero which means the flux is infinite
+
+        self._min_fluxes = min_fluxes.tolist()
+        self._previous_node = [-1] * self.n_states
+        # what node was found before finding this one
+
+        self._visited = [False] * self.n_states
+        # have we already checked this node?
+
+        # ties between equal fluxes go to the state that was queued first
+        self._order = [-1] * self.n_states
+        self._n_queued = 0
+        self._heap = []
+        for node in self.sources.tolist():
+            if self._order[node] < 0:
+                self._order[node] = self._n_queued
+                self._n_queued += 1
+            heapq.heappush(self._heap, (-self._min_fluxes[node],
+                                        self._order[node], node))
+
+    def _settle(self, sinks):
+        """Run Dijkstra's algorithm until all of the sinks are visited."""
+        indptr, indices, data = self._indptr, self._indices, self._data
+        min_fluxes = self._min_fluxes
+        previous_node = self._previous_node
+        visited = self._visited
+        order = self._order
+        heap = self._heap
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        unvisited_sinks = set(s for s in sinks if not visited[s])
+        while heap and unvisited_sinks:
+            neg_flux, _, test_node = heappop(heap)
+            # the state in the queue that has the highest
+            # flux path to it from the source set
+            if visited[test_node] or -neg_flux != min_fluxes[test_node]:
+                # an outdated entry
+                continue
+            visited[test_node] = True
+            unvisited_sinks.discard(test_node)
+
+            # now update the fluxes for each neighbor of the test_node,
+            # except those that have already been visited
+            flux = min_fluxes[test_node]
+            for k in range(indptr[test_node], indptr[test_node + 1]):
+                neighbor = indices[k]
+                new_flux = data[k]
+                if new_flux <= 0 or visited[neighbor]:
+                    continue
+                if new_flux > flux:
+                    # previous step to get to test_node was lower flux,
+                    # so that is still the path flux
+                    new_flux = flux
+                if new_flux > min_fluxes[neighbor]:
+                    min_fluxes[neighbor] = new_flux
+                    previous_node[neighbor] = test_node
+                    if order[neighbor] < 0:
+                        order[neighbor] = self._n_queued
+                        self._n_queued += 1
+                    heappush(heap, (-new_flux, order[neighbor], neighbor))
+
+    def top_path(self, sinks):
+        """The highest flux path into any of the sinks, and its flux."""
+        self._settle(sinks.tolist())
+        min_fluxes = np.array(self._min_fluxes)
+
+        top_path = []
+        # populate the path in reverse
+        top_path.append(int(sinks[min_fluxes[sinks].argmax()]))
+        # find the closest sink state
+
+        while self._previous_node[top_path[-1]] != -1:
+            top_path.append(self._previous_node[top_path[-1]])
+
+        return np.array(top_path[::-1]), min_fluxes[top_path[0]]
 
 
 def _remove_bottleneck(net_flux, path):
@@ -164,7 +217,7 @@ def _remove_bottleneck(net_flux, path):
     a particular edge, corresponding to the bottleneck of a particular
     path.
     """
-    net_flux = copy.copy(net_flux)
+    net_flux = net_flux.copy()
 
     bottleneck_ind = net_flux[path[:-1], path[1:]].argmin()
 
@@ -179,7 +232,7 @@ def _subtract_path_flux(net_flux, path):
     a path's flux from every edge in the path.
     """
 
-    net_flux = copy.copy(net_flux)
+    net_flux = net_flux.copy()
 
     net_flux[path[:-1], path[1:]] -= net_flux[path[:-1], path[1:]].min()
 
@@ -204,7 +257,7 @@ def paths(sources, sinks, net_flux, remove_path='subtract',
         One-dimensional list of nodes to define the source states.
     sinks : array_like, int
         One-dimensional list of nodes to define the sink states.
-    net_flux : np.ndarray
+    net_flux : np.ndarray or scipy.sparse matrix
         Net flux of the MSM
     remove_path : str or callable, optional
         Function for removing a path from the net flux matrix.
@@ -285,19 +338,27 @@ def paths(sources, sinks, net_flux, remove_path='subtract',
         else:
             raise ValueError("remove_path_func (%s) must be a callable or one of ['subtract', 'bottleneck']" % str(remove_path))
 
-    net_flux = copy.copy(net_flux)
+    net_flux = net_flux.copy()
 
     paths = []
     fluxes = []
 
+    sources = np.array(sources, dtype=int).reshape((-1,))
+    sinks = np.array(sinks, dtype=int).reshape((-1,))
+
     total_flux = net_flux[sources, :].sum()
     # total flux is the total flux coming from the sources (or going into the sinks)
 
+    if remove_path in (_subtract_path_flux, _remove_bottleneck):
+        net_flux = scipy.sparse.csr_matrix(net_flux)
+        # these only change the edges of the path, which is cheap on a
+        # sparse matrix
+
     not_done = True
     counter = 0
     expl_flux = 0.0
     while not_done:
-        path, flux = top_path(sources, sinks, net_flux)
+        path, flux = _WidestPaths(sources, net_flux).top_path(sinks)
         if np.isinf(flux):
             break
 